@@ -0,0 +1,235 @@
+# admission.py – Kiểm soát tải phía server: nhận phiên / RAM có hàng đợi + hạn chờ, chia băng thông công bằng
+#
+# Budget: semaphore có trọng số (1 mỗi phiên, hoặc số byte giữ trong RAM), hàng đợi FIFO – yêu cầu lớn ở đầu hàng
+# không bị các yêu cầu nhỏ chen mãi; hàng đợi đầy hoặc chờ quá hạn -> False, server trả BUSY để client thử lại sau.
+# Link + Bucket: token bucket mỗi kết nối mỗi chiều, tốc độ = min(CONN_RATE, dung lượng chiều đó / số kết nối
+# đang truyền) -> một client tải file lớn không chiếm hết đường truyền của những client khác.
+import asyncio, threading, time
+from collections import deque
+import config, metrics
+
+class Budget:
+    """
+    Dung lượng `capacity` (0 = không giới hạn) cho engine thread: acquire() chặn tối đa `timeout` giây.
+    Yêu cầu lớn hơn cả dung lượng được tính bằng dung lượng (chạy một mình thay vì bị từ chối mãi).
+    """
+
+    def __init__(self, name: str, capacity: int, queue: int = 0):
+        self.name      = name
+        self.capacity  = capacity
+        self.max_queue = queue           # số yêu cầu được chờ tối đa (0 = không chờ, đầy là BUSY ngay)
+        self.used      = 0
+        self.queue     = deque()         # [n, waiter] theo thứ tự đến
+        self.lock      = threading.Lock()
+        self.admitted = self.busy = 0
+        self.wait_total = self.wait_max = 0.0
+
+    def _enter(self, n: int):
+        """(n đã chặn trên, kết quả ngay: True / False, hoặc None = phải xếp hàng); gọi khi giữ lock."""
+        n = min(n, self.capacity)
+        if not self.queue and self.used + n <= self.capacity:
+            self.used += n
+            self._record(0.0)
+            return n, True
+        if len(self.queue) >= self.max_queue:
+            self._reject()
+            return n, False
+        return n, None
+
+    def _wake(self):
+        while self.queue and self.used + self.queue[0][0] <= self.capacity:
+            n, waiter = self.queue.popleft()
+            self.used += n
+            self._grant(waiter)
+
+    def _grant(self, waiter):
+        waiter.set()
+
+    def _record(self, waited: float):
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        if config.METRICS:
+            metrics.observe(f"server.admit.{self.name}", waited)
+
+    def _reject(self):
+        self.busy += 1
+        metrics.count(f"busy_{self.name}")
+
+    def try_acquire(self, n: int) -> bool:
+        """Giữ chỗ ngay nếu còn (không xếp hàng, không chặn trên, không chờ) – dùng khi đang đọc dở một frame."""
+        if not self.capacity:
+            return True
+        with self.lock:
+            if self.queue or self.used + n > self.capacity:
+                return False
+            self.used += n
+        return True
+
+    def acquire(self, n: int = 1, timeout: float = None) -> bool:
+        if not self.capacity:
+            return True
+        with self.lock:
+            n, ok = self._enter(n)
+            if ok is not None:
+                return ok
+            entry = [n, threading.Event()]
+            self.queue.append(entry)
+        t0 = time.perf_counter()
+        entry[1].wait(timeout)
+        with self.lock:
+            if not entry[1].is_set():    # hết hạn (được cấp đúng lúc này thì is_set() đã True)
+                self.queue.remove(entry)
+                self._wake()             # người đứng sau có thể vừa chỗ
+                self._reject()
+                return False
+            self._record(time.perf_counter() - t0)
+        return True
+
+    async def admit(self, n: int = 1, timeout: float = None) -> bool:
+        """Dùng được trong flow `async def` của engine thread (không await gì -> chạy thẳng qua run_sync)."""
+        return self.acquire(n, timeout)
+
+    def release(self, n: int = 1):
+        if not self.capacity:
+            return
+        with self.lock:
+            self.used -= min(n, self.capacity)
+            self._wake()
+
+    def stats(self) -> dict:
+        return {"capacity": self.capacity, "in_use": self.used, "queued": len(self.queue),
+                "admitted": self.admitted, "busy": self.busy,
+                "wait_avg_ms": round(self.wait_total / max(self.admitted, 1) * 1000, 3),
+                "wait_max_ms": round(self.wait_max * 1000, 3)}
+
+class AsyncBudget(Budget):
+    """Như Budget cho engine asyncio: chờ bằng Future trên event loop, không chặn thread nào."""
+
+    def _grant(self, waiter):
+        if not waiter.done():
+            waiter.set_result(True)
+
+    async def acquire(self, n: int = 1, timeout: float = None) -> bool:
+        if not self.capacity:
+            return True
+        n, ok = self._enter(n)
+        if ok is not None:
+            return ok
+        entry = [n, asyncio.get_running_loop().create_future()]
+        self.queue.append(entry)
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait((entry[1],), timeout=timeout)
+        finally:
+            if not entry[1].done():      # hết hạn / task bị huỷ khi đang chờ
+                entry[1].cancel()
+                self.queue.remove(entry)
+                self._wake()
+        if entry[1].cancelled():
+            self._reject()
+            return False
+        self._record(time.perf_counter() - t0)
+        return True
+
+    admit = acquire
+
+    def release(self, n: int = 1):
+        if self.capacity:
+            self.used -= min(n, self.capacity)
+            self._wake()
+
+# ---- Kích thước frame: frame lớn chỉ được nhận khi đã có RAM giữ chỗ cho nó ----
+class FrameGate:
+    """
+    Frame của một kết nối tới `base` byte được nhận tự do (điều khiển, DATA-CHUNK); lớn hơn phải khớp một
+    grant do yêu cầu đang chờ DATA mở (đã giữ chỗ trong Budget), mỗi grant dùng cho đúng một frame.
+    Grant có `grow(size) -> bool` được nới theo header frame nếu còn chỗ ngay; không có gì khớp -> đóng kết nối.
+    """
+
+    def __init__(self, base: int, cap: int):
+        self.base   = base
+        self.cap    = cap                # không grant nào được nới quá mức này
+        self.grants = []                 # [byte, grow]
+        self._lock  = threading.Lock()
+
+    def grant(self, n: int, grow=None) -> list:
+        g = [n, grow]
+        with self._lock:
+            self.grants.append(g)
+        return g
+
+    def revoke(self, g: list):
+        with self._lock:
+            self.grants = [x for x in self.grants if x is not g]
+
+    def check(self, size: int):
+        if size <= self.base:
+            return
+        with self._lock:
+            fit = [g for g in self.grants if g[0] >= size]
+            g = min(fit, key=lambda g: g[0]) if fit else next((g for g in self.grants if g[1]), None)
+            if g is not None and (fit or size <= self.cap and g[1](size)):
+                self.grants = [x for x in self.grants if x is not g]
+                return
+        metrics.count("frames_refused")
+        raise ConnectionError(f"frame too large ({size} bytes, no matching reservation)")
+
+# ---- Băng thông: token bucket mỗi kết nối, dung lượng mỗi chiều chia đều cho các kết nối đang truyền ----
+class Link:
+    """Một chiều (gửi / nhận) của server: `rate` byte/s tổng, `per_conn` byte/s mỗi kết nối (0 = không giới hạn)."""
+    ACTIVE = 0.25                        # giây: kết nối có byte trong khoảng này được tính là đang truyền
+
+    def __init__(self, rate: float, per_conn: float = 0):
+        self.rate      = rate
+        self.per_conn  = per_conn
+        self.seen      = {}              # Bucket -> lúc dùng hết phần token đã lấy (đang chờ vẫn là đang truyền)
+        self.flows     = 1
+        self.bytes     = 0
+        self.throttled = 0.0             # tổng giây các kết nối phải chờ token
+        self._counted  = 0.0
+        self._lock     = threading.Lock()
+
+    def share(self, bucket, n: int, now: float) -> float:
+        """Tốc độ hiện tại của `bucket` (byte/s, 0 = không giới hạn); đếm lại số kết nối đang truyền mỗi 50 ms."""
+        with self._lock:
+            self.bytes += n
+            self.seen[bucket] = max(now, self.seen.get(bucket, 0))
+            if now - self._counted > 0.05:
+                cut = now - self.ACTIVE
+                self.seen = {b: t for b, t in self.seen.items() if t >= cut}
+                self.flows, self._counted = len(self.seen), now
+        rates = [r for r in (self.per_conn, self.rate / self.flows if self.rate else 0) if r]
+        return min(rates) if rates else 0
+
+    def hold(self, bucket, wait: float, now: float):
+        """Kết nối phải chờ `wait` giây: vẫn tính là đang truyền tới lúc đó (không nhường phần của nó cho kết nối khác)."""
+        with self._lock:
+            self.throttled += wait
+            self.seen[bucket] = now + wait
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "per_conn": self.per_conn, "flows": self.flows, "bytes": self.bytes,
+                "throttled_s": round(self.throttled, 3)}
+
+class Bucket:
+    """Token bucket của một kết nối một chiều; take(n) -> số giây phải chờ trước khi gửi / đọc tiếp (0 = ngay)."""
+
+    def __init__(self, link: Link, burst: int = None):
+        self.link   = link
+        self.burst  = config.RATE_BURST if burst is None else burst
+        self.tokens = self.burst
+        self.stamp  = time.monotonic()
+
+    def take(self, n: int) -> float:
+        now  = time.monotonic()
+        rate = self.link.share(self, n, now)
+        if not rate:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * rate) - n
+        self.stamp  = now
+        if self.tokens >= 0:
+            return 0.0
+        wait = -self.tokens / rate       # nợ token: trả bằng thời gian chờ, lần sau được nạp lại đúng chừng đó
+        self.link.hold(self, wait, now)
+        return wait
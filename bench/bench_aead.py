@@ -0,0 +1,80 @@
+# bench_aead.py – So sánh AES-CBC + SHA-512 (cũ) với AEAD (AES-GCM / ChaCha20-Poly1305):
+# MB/s mã hoá (seal) / giải mã + kiểm tra (open) và bộ nhớ đỉnh, theo từng chunk (DATA-CHUNK)
+# lẫn cả file một gói (DATA). Mỗi phép đo chạy trong tiến trình riêng để đo peak RSS chính xác.
+# Run (từ thư mục gốc repo): python bench/bench_aead.py [--big-gb 2] [--whole-max-mb 1024]
+import argparse, json, os, subprocess, sys, tempfile, time
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import config, stream_utils as su
+from crypto_utils import CryptoUtils
+
+try:
+    import resource
+except ImportError:                      # Windows: không đo được peak RSS
+    resource = None
+
+MODES = ("cbc", "gcm", "chacha")
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else float("nan")
+
+def run_one(mode: str, path: str, file: str) -> dict:
+    aead, key = (None if mode == "cbc" else mode), os.urandom(32)
+    base, t_seal, t_open = peak_rss_mb(), 0.0, 0.0
+    if path == "chunk":
+        buf, out = bytearray(config.CHUNK_SIZE), bytearray(config.CHUNK_SIZE + 16)
+        with open(file, "rb", buffering=0) as f:
+            seq = 0
+            while n := f.readinto(buf):
+                t0 = time.perf_counter()
+                parts = su.seal_chunk(key, seq, memoryview(buf)[:n], out, aead)
+                t1 = time.perf_counter()
+                frame = b"".join(parts)      # bên nhận có frame liền một khối
+                t2 = time.perf_counter()
+                assert su.open_chunk(key, frame, aead)[0] == seq
+                t_seal += t1 - t0; t_open += time.perf_counter() - t2
+                seq += 1
+    else:
+        data, meta = Path(file).read_bytes(), b'{"name": "video.mp4"}'
+        t0  = time.perf_counter()
+        pkt = CryptoUtils.seal_packet(aead, key, data, meta)
+        t1  = time.perf_counter()
+        CryptoUtils.open_packet(aead, key, pkt, meta)
+        t_seal, t_open = t1 - t0, time.perf_counter() - t1
+    mb = os.path.getsize(file) / 2**20
+    return {"seal": mb / t_seal, "open": mb / t_open, "peak": peak_rss_mb() - base}
+
+def make_big(gb: float) -> str:
+    f = tempfile.NamedTemporaryFile(prefix="bench_aead_", suffix=".bin", delete=False)
+    with f:
+        for _ in range(int(gb * 1024)):
+            f.write(os.urandom(1 << 20))
+    return f.name
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--big-gb", type=float, default=2, help="kích thước file lớn sinh ngẫu nhiên (0 = bỏ qua)")
+    ap.add_argument("--whole-max-mb", type=int, default=1024, help="chỉ đo gói DATA cả file với input nhỏ hơn")
+    ap.add_argument("--one", nargs=3, metavar=("MODE", "PATH", "FILE"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.one:
+        print(json.dumps(run_one(*args.one))); sys.exit()
+
+    inputs = [("video.mp4", "video.mp4")]
+    big = make_big(args.big_gb) if args.big_gb > 0 else None
+    if big:
+        inputs.append((f"{args.big_gb:g} GB", big))
+    try:
+        print(f"{'input':>10} | {'path':>5} | {'mode':>6} | {'seal MB/s':>10} | {'open MB/s':>10} | {'peak MB':>8}")
+        for label, file in inputs:
+            for path in ("chunk", "whole"):
+                if path == "whole" and os.path.getsize(file) > args.whole_max_mb << 20:
+                    continue
+                for mode in MODES:
+                    out = subprocess.run([sys.executable, __file__, "--one", mode, path, file],
+                                         capture_output=True, text=True, check=True).stdout
+                    r = json.loads(out)
+                    print(f"{label:>10} | {path:>5} | {mode:>6} | {r['seal']:>10.1f} | {r['open']:>10.1f} | {r['peak']:>8.1f}")
+    finally:
+        if big:
+            os.unlink(big)
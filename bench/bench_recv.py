@@ -0,0 +1,53 @@
+# bench_recv.py – So sánh nhận frame: buf += chunk (cũ) vs recv_into vào bytearray/memoryview
+# Run: python bench/bench_recv.py [--sizes 65536 1048576 16777216] [--repeat 5]
+import argparse, socket, struct, sys, threading, time
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import net_utils as nu
+
+def recv_exact_concat(sock, n):
+    """Bản cũ của net_utils._recv_exact (để so sánh)."""
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return b""
+        buf += chunk
+    return buf
+
+def recv_raw_concat(sock):
+    size = struct.unpack("!I", recv_exact_concat(sock, 4))[0]
+    return recv_exact_concat(sock, size)
+
+def run(recv, size: int, repeat: int) -> float:
+    a, b = socket.socketpair()
+    payload = bytes(size)
+    def sender():
+        for _ in range(repeat):
+            a.sendall(struct.pack("!I", size)); a.sendall(payload)
+    t = threading.Thread(target=sender, daemon=True)
+    t0 = time.perf_counter()
+    t.start()
+    for _ in range(repeat):
+        assert len(recv(b)) == size
+    dt = time.perf_counter() - t0
+    t.join(); a.close(); b.close()
+    return dt
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[64 << 10, 1 << 20, 16 << 20, 64 << 20])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    pool = nu.RecvBuffer()
+    paths = [("concat (cũ)",      recv_raw_concat),
+             ("recv_into",        nu._recv_raw),
+             ("recv_into + pool", lambda s: nu._recv_raw(s, pool))]
+    print(f"{'frame':>10} | " + " | ".join(f"{name:>18}" for name, _ in paths))
+    for size in args.sizes:
+        cells = []
+        for _, recv in paths:
+            dt = run(recv, size, args.repeat)
+            cells.append(f"{size * args.repeat / dt / 2**20:>12.1f} MB/s")
+        print(f"{size:>10} | " + " | ".join(f"{c:>18}" for c in cells))
@@ -0,0 +1,43 @@
+# bench_rsa_pool.py – Số handshake/giây (RSA decrypt khoá phiên + RSA sign metadata) theo số worker
+# Run (từ thư mục gốc repo): python bench/bench_rsa_pool.py [--handshakes 400] [--workers 0 1 2 4]
+import argparse, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from crypto_utils import CryptoUtils
+
+def handshakes(priv, enc_keys: list, threads: int) -> float:
+    """Mô phỏng server: mỗi kết nối trên một thread gọi rsa_decrypt + rsa_sign."""
+    def one(enc_sk):
+        CryptoUtils.rsa_decrypt(priv, enc_sk)
+        CryptoUtils.rsa_sign(priv, b'{"name": "video.mp4"}')
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(one, enc_keys))
+    return len(enc_keys) / (time.perf_counter() - t0)
+
+def batched(priv, enc_keys: list) -> float:
+    t0 = time.perf_counter()
+    CryptoUtils.rsa_decrypt_many(priv, enc_keys)
+    CryptoUtils.rsa_sign_many(priv, [b'{"name": "video.mp4"}'] * len(enc_keys))
+    return len(enc_keys) / (time.perf_counter() - t0)
+
+if __name__ == "__main__":
+    cores = os.cpu_count() or 1
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--handshakes", type=int, default=400)
+    ap.add_argument("--threads", type=int, default=64, help="số kết nối đồng thời mô phỏng")
+    ap.add_argument("--workers", type=int, nargs="+",
+                    default=sorted({0, 1, 2, cores // 2 or 1, cores}))
+    args = ap.parse_args()
+
+    priv, pub = CryptoUtils.load_or_create_rsa("server")
+    enc_keys  = [CryptoUtils.rsa_encrypt(pub, os.urandom(32)) for _ in range(args.handshakes)]
+    print(f"cores={cores}  handshakes={args.handshakes}  threads={args.threads}")
+    print(f"{'workers':>8} | {'handshake/s (threads)':>22} | {'handshake/s (batched)':>22}")
+    for w in args.workers:
+        if w:
+            CryptoUtils.start_pool(["server"], w)
+        print(f"{w or 'inline':>8} | {handshakes(priv, enc_keys, args.threads):>22.0f} | "
+              f"{batched(priv, enc_keys):>22.0f}")
+        CryptoUtils.stop_pool()
@@ -0,0 +1,43 @@
+# bench_startup.py – Thời gian khởi động lạnh: mỗi lần đo là một tiến trình Python mới (import, --help, nạp khoá RSA),
+# chạy trong thư mục tạm có sẵn keys/ để không đo việc sinh khoá. "keys (PEM)" xoá bản DER trước mỗi lần -> nạp PEM
+# và kiểm tra khoá riêng đầy đủ; "keys (DER cache)" đọc bản DER đã kiểm tra.
+# Run (từ thư mục gốc repo): python bench/bench_startup.py [--repeat 10]
+import argparse, os, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+REPO = Path(__file__).resolve().parent.parent
+
+LOAD_KEYS = "from crypto_utils import keys; keys.pair('client'); keys.pair('server')"
+CASES = [
+    ("import client",     ["-c", "import client"]),
+    ("import server",     ["-c", "import server"]),
+    ("client.py --help",  [str(REPO / "client.py"), "--help"]),
+    ("server.py --help",  [str(REPO / "server.py"), "--help"]),
+    ("keys (PEM)",        ["-c", LOAD_KEYS]),
+    ("keys (DER cache)",  ["-c", LOAD_KEYS]),
+]
+
+def run(argv: list, cwd: str, env: dict) -> float:
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, *argv], cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=10, help="số tiến trình mỗi trường hợp")
+    args = ap.parse_args()
+
+    env = {**os.environ, "PYTHONPATH": str(REPO)}
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as cwd:
+        run(["-c", LOAD_KEYS], cwd, env)                     # sinh keys/ (không tính giờ)
+        base = min(run(["-c", "pass"], cwd, env) for _ in range(args.repeat))
+        print(f"python -c pass: {base * 1000:.1f} ms (đã trừ khỏi các cột dưới)")
+        print(f"{'case':>18} | {'min ms':>8} | {'median ms':>9}")
+        for label, argv in CASES:
+            times = []
+            for _ in range(args.repeat):
+                if label == "keys (PEM)":
+                    for der in Path(cwd, "keys").glob("*.der"):
+                        der.unlink()
+                times.append(run(argv, cwd, env) - base)
+            print(f"{label:>18} | {min(times) * 1000:>8.1f} | {statistics.median(times) * 1000:>9.1f}")
@@ -0,0 +1,236 @@
+# bench_transfer.py – Đo cả hệ thống: chạy server.py thật trên cổng tạm, N client (mỗi client một tiến trình)
+# đồng thời upload / download file tổng hợp hoặc chỉ bắt tay trao khoá; báo MB/s, độ trễ p50/p95/p99,
+# handshake/s, CPU và peak RSS từng phía dưới dạng JSON để so với lần chạy trước (--baseline).
+# Mất gói tắt mặc định (--loss 0); --loss > 0 seed random từng tiến trình bằng --seed (lặp lại được, trừ thứ tự
+# giữa các thread của server). --netem PROFILE đặt proxy netem.py (trễ, băng thông, mất segment, seed --seed)
+# giữa client và server.
+# Run (từ thư mục gốc repo): python bench/bench_transfer.py [--clients 8] [--ops 4] [--sizes 1M 16M] [--stream]
+#                            [--phases handshake upload download] [--engine asyncio] [--netem wan]
+#                            [--out run.json] [--baseline old.json]
+import argparse, contextlib, io, json, math, os, random, runpy, shutil, signal, socket, subprocess, sys, tempfile, time
+from pathlib import Path
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+import config, netem
+
+try:
+    import resource
+except ImportError:                      # Windows: không đo được CPU / peak RSS
+    resource = None
+
+PHASES = ("handshake", "upload", "download")
+
+def parse_size(s: str) -> int:
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    return int(float(s[:-1]) * units[s[-1].upper()]) if s[-1].upper() in units else int(s)
+
+def usage() -> dict:
+    """CPU (user + sys, giây) và peak RSS (MB) của tiến trình này."""
+    if resource is None:
+        return {"cpu_s": None, "peak_rss_mb": None}
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    rss = ru.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+    return {"cpu_s": round(ru.ru_utime + ru.ru_stime, 3), "peak_rss_mb": round(rss, 1)}
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[max(0, math.ceil(p / 100 * len(s)) - 1)], 4)   # nearest-rank
+
+def patch_config(args):
+    config.PORT, config.LOSS_RATE, config.STEP_DELAY = args.port, args.loss, 0
+    random.seed(args.seed)
+
+# ---- Vai server: server.py thật, báo CPU / RSS khi bị dừng (SIGTERM) ----
+def run_server(args):
+    patch_config(args)
+
+    def stop(*_):
+        Path("server_usage.json").write_text(json.dumps(usage()))
+        os._exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    sys.argv = ["server.py", "--engine", args.engine, "--crypto-procs", str(args.crypto_procs)]
+    runpy.run_path(str(REPO / "server.py"), run_name="__main__")
+
+# ---- Vai client: một tiến trình, `ops` thao tác liên tiếp, in kết quả JSON ----
+def run_client(args):
+    patch_config(args)
+    import client as c
+    files = sorted(Path("data").iterdir())
+    up, down = (c.upload_stream, c.download_stream) if args.stream else (c.upload, c.download)
+
+    def handshake() -> bool:
+        if not args.tickets:
+            c.TICKET_PATH.unlink(missing_ok=True)
+        steps = c.StepTracker(3, quiet=True)
+        ch = c.connect(None, steps)
+        try:
+            return c.key_exchange(ch, steps)[0] is not None
+        finally:
+            ch.close()
+
+    def download(name: str) -> bool:
+        ok = down(name)
+        Path("downloaded_" + name).unlink(missing_ok=True)
+        return ok
+
+    ops = {"handshake": [(handshake, (), 0)] * args.ops,
+           "upload":    [(up, (f,), f.stat().st_size) for f in files] * args.ops,
+           "download":  [(download, (f.name,), f.stat().st_size) for f in files] * args.ops}[args.phase]
+    lat, nbytes, fails = [], 0, 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.phase == "handshake" and args.tickets:
+            up(files[0])                 # lấy vé phiên trước (không tính giờ)
+        time.sleep(max(0, args.start_at - time.time()))   # mọi client bắt đầu cùng lúc
+        start = time.time()
+        for fn, fargs, size in ops:
+            t0 = time.perf_counter()
+            try:
+                ok = fn(*fargs)
+            except (Exception, SystemExit):
+                ok = False
+            if ok:
+                lat.append(time.perf_counter() - t0); nbytes += size
+            else:
+                fails += 1
+        end = time.time()
+    print(json.dumps({"start": start, "end": end, "lat": lat, "bytes": nbytes, "fails": fails, **usage()}))
+
+# ---- Điều phối ----
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_port(port: int, proc, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+def role_args(args, port: int = None, **extra) -> list:
+    out = [sys.executable, str(Path(__file__).resolve()), "--port", str(port or args.port), "--loss", str(args.loss)]
+    for k, v in extra.items():
+        out += [f"--{k.replace('_', '-')}", str(v)]
+    return out
+
+def run_phase(args, work: Path, phase: str) -> dict:
+    start_at = time.time() + 1 + 0.1 * args.clients      # đủ để mọi tiến trình client import xong
+    procs = [subprocess.Popen(role_args(args, role="client", phase=phase, ops=args.ops, seed=args.seed + i,
+                                        start_at=start_at)
+                              + (["--stream"] if args.stream else []) + (["--tickets"] if args.tickets else []),
+                              cwd=work / f"c{i}", stdout=subprocess.PIPE, text=True)
+             for i in range(args.clients)]
+    res = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in procs]
+    wall = max(r["end"] for r in res) - min(r["start"] for r in res)
+    lat  = [x for r in res for x in r["lat"]]
+    out  = {"ops": len(lat), "fails": sum(r["fails"] for r in res), "wall_s": round(wall, 3),
+            "latency_s": {f"p{p}": percentile(lat, p) for p in (50, 95, 99)},
+            "client": {"cpu_s": round(sum(r["cpu_s"] or 0 for r in res), 3),
+                       "peak_rss_mb": max((r["peak_rss_mb"] or 0) for r in res)}}
+    if phase == "handshake":
+        out["handshakes_per_s"] = round(len(lat) / wall, 1) if wall else None
+    else:
+        out["mb_per_s"] = round(sum(r["bytes"] for r in res) / 2**20 / wall, 2) if wall else None
+    return out
+
+def make_workdir(args) -> Path:
+    """Thư mục tạm: keys/ của server, mỗi client một thư mục riêng (vé phiên, resume, file tải về) với file ngẫu nhiên riêng."""
+    work = Path(tempfile.mkdtemp(prefix="bench_transfer_"))
+    for i in range(args.clients):
+        data = work / f"c{i}" / "data"
+        data.mkdir(parents=True)
+        for size in args.sizes:
+            with open(data / f"syn_{size}_c{i}.bin", "wb") as f:
+                for left in range(size, 0, -(1 << 20)):
+                    f.write(os.urandom(min(left, 1 << 20)))
+    return work
+
+def compare(result: dict, baseline: dict):
+    """In tỉ lệ lần này / baseline cho các chỉ số chính của từng phase."""
+    print(f"{'phase':>10} | {'metric':>16} | {'baseline':>10} | {'now':>10} | {'ratio':>6}")
+    for phase, now in result["phases"].items():
+        old = baseline.get("phases", {}).get(phase)
+        if not old:
+            continue
+        rows = [(k, old.get(k), now.get(k)) for k in ("mb_per_s", "handshakes_per_s") if k in now]
+        rows += [(f"latency {k}", old["latency_s"][k], v) for k, v in now["latency_s"].items()]
+        for name, a, b in rows:
+            ratio = f"{b / a:6.2f}" if a and b is not None else "   n/a"
+            print(f"{phase:>10} | {name:>16} | {a if a is not None else 'n/a':>10} | "
+                  f"{b if b is not None else 'n/a':>10} | {ratio}")
+
+def main(args):
+    args.port = free_port()              # cổng client kết nối (server, hoặc netem trước server)
+    srv_port  = free_port() if args.netem else args.port
+    work = make_workdir(args)
+    server = subprocess.Popen(role_args(args, srv_port, role="server", engine=args.engine,
+                                        crypto_procs=args.crypto_procs, seed=args.seed),
+                              cwd=work, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    proxy = None
+    try:
+        wait_port(srv_port, server)      # server đã tạo keys/ -> chép cho từng client
+        if args.netem:
+            proxy = subprocess.Popen([sys.executable, str(REPO / "netem.py"), "--listen", str(args.port),
+                                      "--target", str(srv_port), "--profile", args.netem, "--seed", str(args.seed)],
+                                     cwd=work, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_port(args.port, proxy)
+        for i in range(args.clients):
+            shutil.copytree(work / "keys", work / f"c{i}" / "keys")
+        phases = {p: run_phase(args, work, p) for p in args.phases}
+    finally:
+        for p in (proxy, server):
+            if p is not None:
+                p.terminate()
+                p.wait()
+    try:
+        srv = json.loads((work / "server_usage.json").read_text())
+    except OSError:
+        srv = {}
+    shutil.rmtree(work, ignore_errors=True)
+    return {"config": {"clients": args.clients, "ops": args.ops, "sizes": args.sizes, "stream": args.stream,
+                       "tickets": args.tickets, "engine": args.engine, "crypto_procs": args.crypto_procs,
+                       "loss": args.loss, "seed": args.seed, "chunk_size": config.CHUNK_SIZE,
+                       "netem": {"profile": args.netem, **netem.PROFILES[args.netem]} if args.netem else None,
+                       "aead": list(config.AEAD), "compress": list(config.COMPRESS), "cores": os.cpu_count()},
+            "phases": phases, "server": srv}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=4, help="số client đồng thời (mỗi client một tiến trình)")
+    ap.add_argument("--ops", type=int, default=3, help="số lần lặp mỗi thao tác của mỗi client")
+    ap.add_argument("--sizes", nargs="+", default=["1M", "16M"], help="kích thước file tổng hợp (K / M / G)")
+    ap.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    ap.add_argument("--stream", action="store_true", help="upload / download theo luồng DATA-CHUNK")
+    ap.add_argument("--tickets", action="store_true", help="bắt tay bằng vé phiên thay vì RSA (phase handshake)")
+    ap.add_argument("--engine", choices=["thread", "asyncio"], default="thread")
+    ap.add_argument("--crypto-procs", type=int, default=0)
+    ap.add_argument("--loss", type=float, default=0.0, help="LOSS_RATE cho cả hai phía")
+    ap.add_argument("--netem", choices=sorted(netem.PROFILES), help="mạng giả lập bằng proxy netem.py")
+    ap.add_argument("--seed", type=int, default=1, help="seed random (drop gói tất định)")
+    ap.add_argument("--out", help="ghi kết quả JSON vào file này")
+    ap.add_argument("--baseline", help="file JSON của lần chạy trước để so sánh")
+    ap.add_argument("--role", choices=["server", "client"], help=argparse.SUPPRESS)
+    ap.add_argument("--phase", choices=PHASES, help=argparse.SUPPRESS)
+    ap.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--start-at", type=float, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.role == "server":
+        run_server(args)
+    elif args.role == "client":
+        run_client(args)
+    else:
+        args.sizes = [parse_size(s) for s in args.sizes]
+        result = main(args)
+        print(json.dumps(result, indent=2))
+        if args.out:
+            Path(args.out).write_text(json.dumps(result, indent=2))
+        if args.baseline:
+            compare(result, json.loads(Path(args.baseline).read_text()))
@@ -1,119 +1,805 @@
 # client.py – Upload / Download cloud simulation
 # Run: python client.py --mode upload   --file video.mp4
+#      python client.py --mode upload   --file video.mp4 --stream
+#      python client.py --mode upload   --file video.mp4 --stream --parallel 4
 #      python client.py --mode download --file video.mp4
+#      python client.py --mode download --file video.mp4 --stream
+#      python client.py --mode download --file video.mp4 --range 0:1048576 --range 50000000:1048576
+#      python client.py --mode upload   --file a.txt b.txt photos/   (lô: một kết nối bền, pipeline)
+#      python client.py --mode upload   --file photos/ --connections 4  (lô trên 4 kết nối bền)
+#      python client.py --mode list     [--prefix vid]
+#      python client.py --mode stat     --file video.mp4
+#      python client.py --mode stats                                 (bộ đếm server: cache hit / miss…)
+#      python client.py --mode upload   --file video.mp4 --metrics run.json   (đo đạc từng pha, "-" = stdout)
+#      python client.py --mode upload   --file video.mp4 --loss 0     (mạng giả lập bằng netem.py thay vì drop gói)
 
-import argparse, base64, json, os, socket, sys, time
+import argparse, asyncio, atexit, functools, itertools, json, os, random, socket, sys, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-import config, net_utils as nu
-from crypto_utils import CryptoUtils
+import config, metrics, net_utils as nu, stream_utils as su
+from crypto_utils import CryptoUtils, keys
 from ui_utils import print_requirement_table, StepTracker
 
-print_requirement_table()
-
-client_priv, client_pub = CryptoUtils.load_or_create_rsa("client")
-server_priv, server_pub = CryptoUtils.load_or_create_rsa("server")
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--mode", choices=["upload", "download"], required=True)
-parser.add_argument("--file", default="video.mp4")
-args = parser.parse_args()
-
-def handshake(sock: socket.socket, tracker: StepTracker):
+def handshake(sock: socket.socket, tracker: StepTracker) -> nu.Channel:
     tracker.next("Handshake: Hello/Ready")
-    nu._send_raw(sock, b"Hello!")
-    if nu._recv_raw(sock) != b"Ready!":
+    ch = nu.client_handshake(sock)
+    if ch is None:
         nu.error("Handshake failed")
         sys.exit(1)
-    nu.info("    -> OK")
+    feats = ((["binary frames"] if ch.binary else []) + ([ch.aead.upper()] if ch.aead else [])
+             + ([ch.codec + " chunks"] if ch.codec else []))
+    nu.info("    -> OK" + (f" ({', '.join(feats)})" if feats else ""))
+    return ch
 
-def upload():
-    src = Path(args.file)
-    if not src.exists():
-        nu.error("File not found"); return
-    data = src.read_bytes()
-    steps = StepTracker(6)
+def connect(ch, steps: StepTracker):
+    """Kết nối + handshake mới, hoặc dùng kênh có sẵn (kênh con của phiên bền ở chế độ lô)."""
+    if ch is not None:
+        return ch
+    steps.next("Connect to server")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(config.TIMEOUT)
+    sock.connect((config.HOST, config.PORT))
+    return handshake(sock, steps)
+
+def tracker(total: int, ch) -> StepTracker:
+    """Chế độ lô bỏ 2 bước connect/handshake và không in từng bước."""
+    return StepTracker(total) if ch is None else StepTracker(total - 2, quiet=True)
+
+# ---- Vé phiên: sau một lần RSA, các kết nối sau suy ra khoá bằng HKDF ----
+TICKET_PATH = Path(config.KEYS_DIR, f"ticket_{config.HOST}_{config.PORT}.json")
+
+def load_ticket() -> dict:
+    try:
+        t = json.loads(TICKET_PATH.read_text())
+        return {"ticket": bytes.fromhex(t["ticket"]), "master": bytes.fromhex(t["master"])}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def save_ticket(pkt: dict, sk: bytes):
+    """Lưu vé server cấp kèm ACK / DATA; master suy ra từ khoá phiên RSA của lần truyền đó."""
+    if pkt.get("ticket"):
+        master = CryptoUtils.derive_key(sk, info=b"resumption")
+        data = json.dumps({"ticket": bytes(pkt["ticket"]).hex(), "master": master.hex()}).encode()
+        tmp  = TICKET_PATH.with_name(f".{TICKET_PATH.name}.{os.getpid()}.{threading.get_ident()}")
+        fd   = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)   # master là bí mật: chỉ chủ sở hữu đọc
+        with open(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, TICKET_PATH)     # file cũ (có thể đã mở cho mọi người đọc) được thay hẳn
+
+def drop_ticket():
+    TICKET_PATH.unlink(missing_ok=True)
+    nu.warn("    -> session ticket rejected; fall back to RSA")
 
-    steps.next("Encrypt file (AES-CBC)")
+def check_busy(resp: dict) -> dict:
+    """NACK err=busy (server hết chỗ trong RAM / hàng đợi) -> nu.Busy để vòng thử lại chờ rồi làm lại."""
+    if resp.get("err") == "busy":
+        raise nu.Busy(resp.get("retry", 1000) / 1000)
+    return resp
+
+def key_exchange(ch: nu.Channel, steps: StepTracker, size: int = None) -> tuple:
+    """
+    Gói KEY: có vé -> {ticket, nonce}, khoá = HKDF(master, nonce client + nonce server), không RSA;
+    không có / bị từ chối -> enc_sk RSA như cũ. Trả về (sk, dùng vé?), sk = None nếu bị từ chối.
+    `size`: số byte gói kế tiếp mang (DATA trọn gói / digest của DATA-STREAM), để server giữ chỗ RAM trước
+    và chấp nhận frame cỡ đó (hết chỗ -> nu.Busy).
+    """
+    t = load_ticket()
+    extra = {} if size is None else {"size": size}
+    if t:
+        steps.next("Send session ticket (no RSA)")
+        nonce = os.urandom(16)
+        ch.send({"type": "KEY", "ticket": t["ticket"], "nonce": nonce, **extra})
+        resp = check_busy(ch.recv())
+        if resp.get("type") == "KEY-OK":
+            return CryptoUtils.derive_key(t["master"], nonce + bytes(resp["nonce"])), True
+        if resp.get("err") != "ticket":
+            return None, True
+        drop_ticket()
+    else:
+        steps.next("Send session-key packet (RSA)")
     sk = os.urandom(32)
-    iv = os.urandom(16)
-    cipher = CryptoUtils.aes_encrypt(sk, iv, data)
+    ch.send({"type": "KEY", "enc_sk": CryptoUtils.rsa_encrypt(keys.pub("server"), sk), **extra})
+    if check_busy(ch.recv()).get("type") != "KEY-OK":
+        return None, False
+    return sk, False
 
-    steps.next("Sign metadata (RSA/SHA-512)")
-    meta = {"name": src.name, "size": len(data), "timestamp": int(time.time())}
-    meta_json = json.dumps(meta, sort_keys=True).encode()
-    sig_meta  = CryptoUtils.rsa_sign(client_priv, meta_json)
+def sign_meta(sk: bytes, resumed: bool, data: bytes) -> bytes:
+    return CryptoUtils.hmac_sha512(sk, data) if resumed else CryptoUtils.rsa_sign(keys.priv("client"), data)
 
-    steps.next("Encrypt session key (RSA)")
-    enc_sk = CryptoUtils.rsa_encrypt(server_pub, sk)
+def chunk_progress(progress, size: int, have=()):
+    """
+    progress(byte đã xong, tổng) -> callback theo chunk cho su.send_chunks / recv_chunks (None nếu không theo dõi);
+    báo ngay phần đã có sẵn (`have`: resume / dedup).
+    """
+    if progress is None:
+        return None
+    done = set(have)
 
-    steps.next("Connect to server")
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(config.TIMEOUT)
-    sock.connect((config.HOST, config.PORT))
-    handshake(sock, steps)
+    def on_chunk(seq: int = None):
+        if seq is not None:
+            done.add(seq)
+        progress(min(len(done) * config.CHUNK_SIZE, size), size)
+    on_chunk()
+    return on_chunk
+
+def upload(path, ch=None, progress=None) -> bool:
+    src = Path(path)
+    if not src.exists():
+        nu.error("File not found"); return False
+    with metrics.timer("client.upload.read"):
+        data = src.read_bytes()
+    steps = tracker(5, ch)
 
-    steps.next("Send session-key packet")
-    nu.send_json(sock, {"type": "KEY", "enc_sk": base64.b64encode(enc_sk).decode()})
-    if nu.recv_json(sock).get("type") != "KEY-OK":
-        nu.error("Server rejected session key"); return
+    ch = connect(ch, steps)
 
-    steps.next("Send DATA & wait ACK")
-    pkt = {
-        "type":   "DATA",
-        "iv":     base64.b64encode(iv).decode(),
-        "cipher": base64.b64encode(cipher).decode(),
-        "hash":   CryptoUtils.sha512(iv + cipher).hex(),
-        "sig":    base64.b64encode(sig_meta).decode(),
-        "meta":   base64.b64encode(meta_json).decode(),
-    }
+    with metrics.timer("client.upload.key"):
+        sk, resumed = key_exchange(ch, steps, len(data))
+    if sk is None:
+        nu.error("Server rejected session key"); return False
+
+    steps.next(f"Encrypt file ({(ch.aead or 'AES-CBC').upper()}) & sign metadata")
+    meta = {"name": src.name, "size": len(data), "timestamp": int(time.time())}
+    meta_json = json.dumps(meta, sort_keys=True).encode()
+    with metrics.timer("client.upload.seal"):
+        sig_meta = sign_meta(sk, resumed, meta_json)
+        pkt = {
+            "type":   "DATA",
+            **CryptoUtils.seal_packet(ch.aead, sk, data, meta_json),
+            "sig":    sig_meta,
+            "meta":   meta_json,
+        }
 
+    steps.next("Send DATA & wait ACK")
     for attempt in range(1, config.MAX_RETRY + 1):
         nu.info(f"   attempt {attempt}")
-        nu.send_json(sock, pkt)
         try:
-            if nu.recv_json(sock).get("type") == "ACK":
+            with metrics.timer("client.upload.send_ack"):
+                ch.send(pkt)
+                resp = ch.recv()
+            if resp.get("type") == "ACK":
+                if not resumed:
+                    save_ticket(resp, sk)
+                metrics.count("upload_bytes", len(data))
+                if progress:
+                    progress(len(data), len(data))
                 steps.done("Upload")
-                break
+                return True
         except socket.timeout:
+            metrics.count("retries")
             nu.warn("   timeout; retry")
+    nu.error("Upload failed after retries")
+    return False
+
+def upload_stream(path, ch=None, parallel: int = 1, progress=None) -> bool:
+    src = Path(path)
+    if not src.exists():
+        nu.error("File not found"); return False
+    size  = src.stat().st_size
+    steps = tracker(6, ch)
+
+    steps.next("Hash file & chunks (SHA-512)")
+    whole, digests = su.file_digests(src)
+    meta = {"name": src.name, "size": size, "timestamp": int(time.time()), "sha512": whole.hex()}
+    state = Path(config.RESUME_DIR, f"upload_{src.name}.json")
+    token = load_resume_token(state, meta)
+
+    ch = connect(ch, steps)
+    if ch.codec and su.file_compressible(src):   # nội dung đã nén sẵn (MP4, ZIP…) -> gửi nguyên
+        meta["compress"] = ch.codec
+    meta_json = json.dumps(meta, sort_keys=True).encode()
+
+    sk, resumed = key_exchange(ch, steps, len(digests))   # gói DATA-STREAM mang danh sách digest
+    if sk is None:
+        nu.error("Server rejected session key"); return False
+    sig_meta = sign_meta(sk, resumed, meta_json)
+
+    steps.next("Open stream" + (" (resume)" if token else ""))
+    ch.send({"type": "DATA-STREAM", "sig": sig_meta, "meta": meta_json, "token": token,
+             "digests": digests}, lossy=False)  # server chỉ cần các chunk nó chưa có
+    resp = ch.recv()
+    if resp.get("type") != "STREAM-OK":
+        nu.error("Server rejected stream"); return False
+    state.parent.mkdir(exist_ok=True)
+    state.write_text(json.dumps({"token": resp["token"], "size": size, "sha512": meta["sha512"]}))
+    have = su.from_ranges(resp["have"])
+    seqs = [s for s in range(su.chunk_count(size)) if s not in have]
+    if have:
+        nu.info(f"    -> resume / dedup: server has {len(have)}/{su.chunk_count(size)} chunk")
+    on_chunk = chunk_progress(progress, size, have)
+
+    steps.next("Send DATA-CHUNK & wait CHUNK-ACK" + (f" ({parallel} connections)" if parallel > 1 else ""))
+    ach = nu.AwaitableChannel(ch)        # stream_utils viết dạng async, chạy blocking ở đây
+    with ThreadPoolExecutor(max(parallel - 1, 1)) as ex:
+        # chia xen kẽ: mọi kết nối đi qua file cùng nhịp và xong gần như cùng lúc
+        joins = [ex.submit(upload_join, src, meta_json, resp["token"], seqs[i::parallel], on_chunk)
+                 for i in range(1, parallel)]
+        sent = nu.run_sync(su.send_chunks(ach, src, sk, seqs[::parallel], meta.get("compress"), on_chunk))
+        sent = all([f.result() for f in joins]) and sent
+    if not sent:
+        nu.error("Upload interrupted (run again to resume)"); return False
+    resp = nu.run_sync(su.finish_send(ach))
+    if resp.get("type") == "ACK":
+        state.unlink(missing_ok=True)
+        if not resumed:
+            save_ticket(resp, sk)
+        steps.done("Upload (streamed)")
+        return True
+    elif resp.get("type") == "NACK":
+        if "have" not in resp:           # hash sai -> server đã huỷ bản dở dang
+            state.unlink(missing_ok=True)
+        nu.error("Server rejected upload")
     else:
-        nu.error("Upload failed after retries")
+        nu.error("Upload failed after retries (run again to resume)")
+    return False
 
-def download():
-    steps = StepTracker(5)
-    steps.next("Connect to server")
+def upload_join(src: Path, meta_json: bytes, token: str, seqs: list, on_chunk=None) -> bool:
+    """
+    Kết nối phụ của upload song song: tham gia upload `token` và gửi các chunk `seqs`;
+    kết nối hỏng (vd. gói KEY bị drop) thì nối lại và chỉ gửi các chunk server chưa có.
+    """
+    steps = StepTracker(2, quiet=True)
+    for attempt in range(1, config.MAX_RETRY + 1):
+        ch = connect(None, steps)
+        try:
+            sk, resumed = key_exchange(ch, steps, 0)
+            if sk is None:
+                continue
+            ch.send({"type": "DATA-STREAM", "sig": sign_meta(sk, resumed, meta_json), "meta": meta_json,
+                     "token": token, "join": 1}, lossy=False)
+            resp = ch.recv()
+            if resp.get("type") != "STREAM-OK":
+                return False             # kết nối chính đã kết thúc
+            have = su.from_ranges(resp["have"])
+            ach  = nu.AwaitableChannel(ch)
+            codec = json.loads(meta_json).get("compress")
+            if (nu.run_sync(su.send_chunks(ach, src, sk, [s for s in seqs if s not in have], codec, on_chunk))
+                    and nu.run_sync(su.finish_send(ach)).get("type") == "ACK"):
+                return True
+        except (OSError, ConnectionError) as e:
+            nu.warn(f"   parallel stream: {e}")
+        finally:
+            ch.close()
+    return False
+
+def load_resume_token(state: Path, meta: dict) -> str:
+    """Token của lần upload dở trước đó nếu vẫn là cùng nội dung file."""
+    try:
+        st = json.loads(state.read_text())
+        if st["size"] == meta["size"] and st["sha512"] == meta["sha512"]:
+            return st["token"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return ""
+
+def signed_request(ch: nu.Channel, fields: dict) -> tuple:
+    """
+    Gửi DOWNLOAD / LIST / STAT ký bằng vé phiên (HMAC, không RSA) nếu có, không thì RSA; vé bị từ chối
+    -> gửi lại bằng RSA trên cùng kết nối. Trả về (gói trả lời, gói đã gửi, vé đã dùng).
+    """
+    t = load_ticket()
+    while True:
+        req = dict(fields)
+        subject = nu.request_subject(req)
+        if t:
+            req["ticket"], req["nonce"] = t["ticket"], os.urandom(16)
+            req["sig"] = CryptoUtils.hmac_sha512(CryptoUtils.derive_key(t["master"], req["nonce"], b"auth"), subject)
+        else:
+            req["sig"] = CryptoUtils.rsa_sign(keys.priv("client"), subject)
+        ch.send(req)
+        resp = ch.recv()
+        if not (t and resp.get("err") == "ticket"):
+            return resp, req, t
+        drop_ticket(); t = {}
+
+def request_download(ch: nu.Channel, name: str, **extra) -> tuple:
+    """DOWNLOAD đã ký; trả về (gói trả lời, sk, dùng vé?), sk = None nếu server từ chối."""
+    resp, req, t = signed_request(ch, {"type": "DOWNLOAD", "file": name, **extra})
+    if resp.get("type") not in ("DATA", "DATA-STREAM"):
+        check_busy(resp)
+        return resp, None, bool(t)
+    if t:
+        return resp, CryptoUtils.derive_key(t["master"], req["nonce"] + bytes(resp["nonce"])), True
+    return resp, CryptoUtils.rsa_decrypt(keys.priv("client"), resp["enc_sk"]), False
+
+def download(name: str, ch=None, dest=None, progress=None) -> bool:
+    dst   = Path(dest or "downloaded_" + name)
+    steps = tracker(4, ch)
+    ch = connect(ch, steps)
+
+    steps.next("Send signed download request & wait DATA")
+    with metrics.timer("client.download.request"):
+        resp, sk, resumed = request_download(ch, name)
+    if resp.get("type") != "DATA":
+        nu.error("Server refused download"); return False
+
+    steps.next("Verify integrity & decrypt")
+    try:
+        with metrics.timer("client.download.open"):
+            plain = CryptoUtils.open_packet(ch.aead, sk, resp, resp["meta"])
+    except ValueError as e:
+        nu.error(f"Integrity check failed ({e})"); return False
+
+    with metrics.timer("client.download.write"):
+        dst.write_bytes(plain)
+    metrics.count("download_bytes", len(plain))
+    if progress:
+        progress(len(plain), len(plain))
+    if not resumed:
+        save_ticket(resp, sk)
+    ch.send({"type": "ACK"})
+    steps.done(f"Download (saved to {dst})")
+    return True
+
+def download_range(name: str, offset: int, length: int = None, ch=None) -> tuple:
+    """
+    Tải đoạn [offset, offset + length) (length None -> tới cuối file): server chỉ đọc đoạn đó, mã hoá
+    và ký meta của đoạn (offset, total, mtime). Trả về (meta, dữ liệu), hoặc None nếu lỗi.
+    """
+    ch = connect(ch, StepTracker(2, quiet=True))
+    resp, sk, resumed = request_download(ch, name, offset=offset, length=length)
+    if resp.get("type") != "DATA":
+        nu.error(f"Server refused range {offset}+{length} ({resp.get('err', 'timeout')})"); return None
+    if not (CryptoUtils.hmac_verify(sk, resp["sig"], resp["meta"]) if resumed
+            else CryptoUtils.rsa_verify(keys.pub("server"), resp["sig"], resp["meta"])):
+        nu.error("Bad server signature"); return None
+    meta = json.loads(bytes(resp["meta"]))
+    try:
+        data = CryptoUtils.open_packet(ch.aead, sk, resp, resp["meta"])
+    except ValueError as e:
+        nu.error(f"Integrity check failed ({e})"); return None
+    if meta.get("name") != name or meta.get("offset") != offset or meta["size"] != len(data):
+        nu.error("Range metadata mismatch"); return None
+    if not resumed:
+        save_ticket(resp, sk)
+    ch.send({"type": "ACK"})
+    return meta, data
+
+def fetch_ranges(name: str, ranges: list) -> list:
+    """
+    Tải nhiều đoạn (offset, length) cùng lúc trên một phiên bền (tối đa PIPELINE yêu cầu), mỗi đoạn thử lại
+    tối đa MAX_RETRY lần. Trả về dữ liệu theo thứ tự `ranges`; None nếu có đoạn hỏng hoặc file đổi giữa chừng.
+    """
+    ch, mux = open_session()
+    if mux is None:
+        return None
+
+    def one(rng):
+        for attempt in range(1, config.MAX_RETRY + 1):
+            if attempt > 1:
+                metrics.count("retries")
+            sub = mux.open()
+            try:
+                if got := download_range(name, *rng, ch=sub):
+                    return got
+            except nu.Busy as e:
+                backoff(e)
+            except Exception as e:
+                nu.warn(f"   range {rng[0]}: {e or type(e).__name__}")
+            finally:
+                sub.close()
+        return None
+
+    try:
+        got = one(ranges[0])             # yêu cầu đầu đi riêng: lần RSA duy nhất, nhận vé phiên
+        with ThreadPoolExecutor(config.PIPELINE) as ex:
+            got = [got] + list(ex.map(one, ranges[1:]))
+    finally:
+        ch.close()
+    if None in got or len({m["mtime"] for m, _ in got}) != 1:
+        return None
+    return [data for _, data in got]
+
+def download_ranges(name: str, specs: list) -> bool:
+    """CLI --range: ghi các đoạn vào downloaded_<name> đúng vị trí (file thưa, xem được phần đầu ngay)."""
+    ranges = [(int(o), int(n)) for o, n in (s.split(":") for s in specs)]
+    t0 = time.time()
+    parts = fetch_ranges(name, ranges)
+    if parts is None:
+        nu.error("Range download failed"); return False
+    dst = Path("downloaded_" + name)
+    with open(dst, "r+b" if dst.exists() else "wb") as f:
+        for (offset, _), data in zip(ranges, parts):
+            f.seek(offset); f.write(data)
+    nu.info(f"[RANGE] {len(ranges)} range(s), {sum(map(len, parts))} bytes in {time.time() - t0:.1f}s -> {dst}")
+    return True
+
+def download_stream(name: str, ch=None, dest=None, progress=None) -> bool:
+    dst   = Path(dest or "downloaded_" + name)
+    state = Path(config.RESUME_DIR, dst.name + ".json")
+    steps = tracker(4, ch)
+    ch = connect(ch, steps)
+
+    steps.next("Send signed download request & wait DATA-STREAM header")
+    req = {"stream": 1}
+    try:                                 # đã tải dở -> báo server các chunk đã có
+        prev = json.loads(state.read_text())
+        req.update(resume=prev["info"], have=prev["have"])
+    except (OSError, ValueError, KeyError):
+        pass
+    hdr, sk, resumed = request_download(ch, name, **req)
+    if hdr.get("type") != "DATA-STREAM":
+        nu.error("Server refused download"); return False
+    if not (CryptoUtils.hmac_verify(sk, hdr["sig"], hdr["meta"]) if resumed
+            else CryptoUtils.rsa_verify(keys.pub("server"), hdr["sig"], hdr["meta"])):
+        nu.error("Bad server signature"); return False
+    meta = json.loads(bytes(hdr["meta"]))
+    codec = meta.get("compress")
+    if codec and codec not in ch.caps:
+        nu.error(f"Server chose unsupported compression {codec!r}"); return False
+    part = su.PartialFile.resume(su.part_path(dst), state,   # khác phiên bản / nội dung -> tải lại từ đầu
+                                 {k: meta[k] for k in ("name", "size", "mtime", "sha512") if k in meta})
+    if part.have:
+        nu.info(f"    -> resume: {len(part.have)}/{part.total} chunk on disk")
+
+    steps.next("Receive DATA-CHUNK & decrypt to disk")
+    ch.settimeout(config.TIMEOUT * (config.MAX_RETRY + 1))
+    try:
+        nu.run_sync(su.recv_chunks(nu.AwaitableChannel(ch), part, sk, codec,
+                                   chunk_progress(progress, meta["size"], part.have)))
+    except Exception:
+        part.close(); raise
+    if not part.complete():
+        part.close()
+        ch.send({"type": "NACK"}, lossy=False)
+        nu.error("Download incomplete (run again to resume)"); return False
+
+    part.sync()
+    if meta.get("sha512") and su.file_sha512(part.data_path).hex() != meta["sha512"]:
+        part.discard()                   # bản dở dang cũ / hỏng: bỏ hẳn, lần sau tải lại từ đầu
+        ch.send({"type": "NACK"}, lossy=False)
+        nu.error("SHA-512 mismatch, partial download discarded"); return False
+    part.commit(dst)
+    if not resumed:
+        save_ticket(hdr, sk)
+    ch.send({"type": "ACK"}, lossy=False)
+    steps.done("Download (streamed to " + str(dst) + ")")
+    return True
+
+# ---- Duyệt file trên server (LIST / STAT, trả lời từ chỉ mục metadata) ----
+def browse(fields: dict) -> dict:
+    """Một LIST / STAT đã ký trên kết nối mới; gói đi hoặc về bị mất -> thử lại. Trả về gói trả lời ({} nếu hết lượt)."""
+    for attempt in range(1, config.MAX_RETRY + 1):
+        try:
+            ch = connect(None, StepTracker(2, quiet=True))
+        except nu.Busy as e:
+            backoff(e); continue
+        try:
+            if resp := signed_request(ch, fields)[0]:
+                return resp
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            ch.close()
+        nu.warn(f"   {fields['type']} timed out ({attempt}/{config.MAX_RETRY})")
+    return {}
+
+def list_files(prefix: str = "") -> list:
+    """Mọi file trên server có tên bắt đầu bằng `prefix` (theo thứ tự tên, đi hết các trang); None nếu lỗi."""
+    files, after = [], ""
+    while True:
+        resp = browse({"type": "LIST", "prefix": prefix, "after": after, "limit": config.LIST_LIMIT})
+        if resp.get("type") != "LIST-OK":
+            return None
+        files += resp["files"]
+        if not (after := resp["next"]):
+            return files
+
+def stat_file(name: str) -> dict:
+    """Metadata của một file trên server; "verified" = chữ ký RSA của người upload hợp lệ. None nếu không có."""
+    resp = browse({"type": "STAT", "file": name})
+    if resp.get("type") != "STAT-OK":
+        return None
+    st = resp["file"]
+    if st["auth"] == "rsa":              # HMAC (vé phiên) chỉ server kiểm được lúc upload
+        st["verified"] = CryptoUtils.rsa_verify(keys.pub("client"), resp["sig"], resp["meta"])
+    return st
+
+def show_list(prefix: str):
+    files = list_files(prefix)
+    if files is None:
+        nu.error("Server refused LIST"); return
+    for f in files:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(f["stored_ns"] / 1e9))
+        print(f"{f['size']:>14,}  {when}  {(f['sha512'] or '')[:16]:16}  {f['name']}")
+    nu.info(f"[LIST] {len(files)} file(s)" + (f" matching {prefix!r}" if prefix else ""))
+
+def show_stats():
+    resp = browse({"type": "STATS"})
+    if resp.get("type") != "STATS-OK":
+        nu.error("Server refused STATS"); return
+    print(json.dumps({k: v for k, v in resp.items() if k != "type"}, indent=2))
+
+def show_stat(name: str):
+    st = stat_file(name)
+    if st is None:
+        nu.error(f"[STAT] {name}: not found"); return
+    for k in ("name", "size", "sha512", "timestamp", "stored_ns", "auth", "verified"):
+        if st.get(k) is not None:
+            print(f"  {k:>10}: {st[k]}")
+
+# ---- Chế độ lô: một kết nối bền (mux), tối đa PIPELINE yêu cầu cùng lúc ----
+def expand(paths: list) -> list:
+    """Thư mục -> các file trực tiếp bên trong (tên trên server là tên file)."""
+    out = []
+    for p in map(Path, paths):
+        out += sorted(f for f in p.iterdir() if f.is_file()) if p.is_dir() else [p]
+    return out
+
+def open_session() -> tuple:
+    """Kết nối bền (mux) cho nhiều yêu cầu song song: (kênh, Mux), Mux = None nếu server không hỗ trợ."""
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(config.TIMEOUT)
     sock.connect((config.HOST, config.PORT))
-    handshake(sock, steps)
-
-    steps.next("Send signed download request")
-    req_sig = CryptoUtils.rsa_sign(client_priv, args.file.encode())
-    nu.send_json(sock, {
-        "type": "DOWNLOAD",
-        "file": args.file,
-        "sig":  base64.b64encode(req_sig).decode()
-    })
-
-    steps.next("Wait DATA packet")
-    resp = nu.recv_json(sock)
-    if resp.get("type") != "DATA":
-        nu.error("Server refused download"); return
+    ch = nu.client_handshake(sock, nu.supported_caps())
+    if ch is None or "mux" not in ch.caps:
+        nu.error("Server does not support persistent sessions"); sock.close()
+        return ch, None
+    return ch, nu.Mux(ch).start()
 
-    steps.next("Verify hash & decrypt")
-    iv     = base64.b64decode(resp["iv"])
-    cipher = base64.b64decode(resp["cipher"])
-    if CryptoUtils.sha512(iv + cipher).hex() != resp["hash"]:
-        nu.error("Hash mismatch"); return
-    sk = CryptoUtils.rsa_decrypt(client_priv, base64.b64decode(resp["enc_sk"]))
-    plain = CryptoUtils.aes_decrypt(sk, iv, cipher)
+# ---- Thư viện: Client giữ khoá + pool phiên bền đã handshake, API đồng bộ (Future) và asyncio ----
+class Cancelled(Exception):
+    """Thao tác bị huỷ qua `cancel` (threading.Event): Future của nó raise lỗi này."""
 
-    Path("downloaded_" + args.file).write_bytes(plain)
-    nu.send_json(sock, {"type": "ACK"})
-    steps.done("Download (saved to downloaded_" + args.file + ")")
+def cancellable(progress, cancel):
+    """Bọc progress: `cancel` đã set -> raise Cancelled ở lần báo tiến độ kế (ranh giới chunk), trừ khi đã xong."""
+    if cancel is None:
+        return progress
 
-if __name__ == "__main__":
-    if args.mode == "upload":
-        upload()
+    def on_progress(done: int, total: int):
+        if cancel.is_set() and done < total:
+            raise Cancelled()
+        if progress:
+            progress(done, total)
+    return on_progress
+
+class Client:
+    """
+    Upload / download dùng lại được từ code khác (GUI, script, bench):
+
+        with Client(stream=True) as c:
+            c.upload("a.bin", progress=lambda done, total: ...).result()      # Future[bool]
+            oks = [f.result() for f in c.upload_many(paths, concurrency=8)]
+            ok  = await c.adownload("a.bin", "out/a.bin")                      # trong coroutine
+
+    Mỗi thao tác chạy trên một kênh con của một trong `connections` phiên bền (mux): handshake một lần, mở lười,
+    tự mở lại khi server đóng phiên rảnh; gói KEY / DOWNLOAD mất -> làm lại tối đa MAX_RETRY lần.
+    connections=0 (hoặc server không hỗ trợ mux): mỗi thao tác một kết nối riêng, in từng bước như CLI.
+    Callback progress(byte đã xong, tổng) chạy trên thread của thao tác. `cancel` (threading.Event) huỷ thao tác
+    đang chạy ở ranh giới chunk (luồng) -> Future raise Cancelled; phần đã truyền giữ lại để resume.
+    """
+
+    def __init__(self, connections: int = 1, workers: int = None, stream: bool = False, parallel: int = 1):
+        self.connections = connections
+        self.workers     = workers or config.PIPELINE * max(connections, 1)   # số thao tác chạy cùng lúc
+        self.stream      = stream
+        self.parallel    = parallel    # số kết nối cho upload một file (cùng stream)
+        self._sessions   = [None] * connections          # (kênh, Mux) của từng phiên bền
+        self._locks      = [threading.Lock() for _ in range(connections)]
+        self._rr         = itertools.count()
+        self._primed     = threading.Event()             # đã có vé phiên -> các thao tác chạy song song
+        self._prime_lock = threading.Lock()
+        self._pool       = ThreadPoolExecutor(self.workers, thread_name_prefix="client")
+        if load_ticket():
+            self._primed.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def warm(self):
+        """Mở trước mọi phiên bền (handshake ngay thay vì ở thao tác đầu)."""
+        for i in range(self.connections):
+            self._session(i)
+        return self
+
+    def close(self, wait: bool = True):
+        self._pool.shutdown(wait)
+        for s in self._sessions:
+            if s:
+                s[0].close()
+
+    # ---- API đồng bộ: trả về Future[bool] ----
+    def upload(self, path, progress=None, cancel=None) -> Future:
+        progress = cancellable(progress, cancel)
+        if self.stream:
+            return self._pool.submit(self._run, upload_stream, path, cancel, parallel=self.parallel,
+                                     progress=progress)
+        return self._pool.submit(self._run, upload, path, cancel, progress=progress)
+
+    def download(self, name: str, dest=None, progress=None, cancel=None) -> Future:
+        """Lưu vào `dest` (mặc định downloaded_<name>)."""
+        fn = download_stream if self.stream else download
+        return self._pool.submit(self._run, fn, name, cancel, dest=dest, progress=cancellable(progress, cancel))
+
+    def upload_many(self, paths, concurrency: int = None, progress=None, cancel=None) -> list:
+        """
+        Một Future mỗi file, tối đa `concurrency` thao tác cùng lúc; progress(path, byte đã xong, tổng);
+        `cancel` huỷ cả lô.
+        """
+        return self._many(lambda p, cb: self.upload(p, cb, cancel), list(paths), concurrency, progress)
+
+    def download_many(self, names, dest_dir=None, concurrency: int = None, progress=None, cancel=None) -> list:
+        """Như upload_many; `dest_dir` -> lưu thành dest_dir/<name>."""
+        return self._many(lambda n, cb: self.download(n, Path(dest_dir, n) if dest_dir else None, cb, cancel),
+                          list(names), concurrency, progress)
+
+    # ---- API asyncio ----
+    async def aupload(self, path, progress=None, cancel=None) -> bool:
+        return await asyncio.wrap_future(self.upload(path, progress, cancel))
+
+    async def adownload(self, name: str, dest=None, progress=None, cancel=None) -> bool:
+        return await asyncio.wrap_future(self.download(name, dest, progress, cancel))
+
+    async def aupload_many(self, paths, concurrency: int = None, progress=None, cancel=None) -> list:
+        return await asyncio.gather(*map(asyncio.wrap_future,
+                                         self.upload_many(paths, concurrency, progress, cancel)))
+
+    async def adownload_many(self, names, dest_dir=None, concurrency: int = None, progress=None,
+                             cancel=None) -> list:
+        return await asyncio.gather(*map(asyncio.wrap_future,
+                                         self.download_many(names, dest_dir, concurrency, progress, cancel)))
+
+    # ---- Bên trong ----
+    def _many(self, submit, items: list, concurrency, progress) -> list:
+        """Chạy `submit(item, callback)` cho từng item, mỗi thao tác xong mới mở thao tác kế (giữ `concurrency`)."""
+        out, todo, lock = [Future() for _ in items], iter(enumerate(items)), threading.Lock()
+
+        def launch():
+            with lock:
+                nxt = next(todo, None)
+            if nxt is None:
+                return
+            i, item = nxt
+            f = submit(item, functools.partial(progress, item) if progress else None)
+            f.add_done_callback(lambda f, i=i: copy(f, out[i]))
+
+        def copy(src: Future, dst: Future):
+            try:                         # thao tác kế luôn được mở, kể cả khi dst đã bị người gọi huỷ
+                if dst.done():
+                    pass
+                elif src.cancelled():
+                    dst.cancel()
+                elif src.exception() is not None:
+                    dst.set_exception(src.exception())
+                else:
+                    dst.set_result(src.result())
+            finally:
+                launch()
+
+        for _ in range(min(concurrency or self.workers, len(items))):
+            launch()
+        return out
+
+    def _session(self, i: int):
+        """Mux của phiên bền thứ i, mở (lại) nếu chưa có / đã đóng; None nếu server không hỗ trợ mux."""
+        with self._locks[i]:
+            s = self._sessions[i]
+            if s is None or s[1].closed:
+                if s:
+                    s[0].close()
+                ch, mux = open_session()
+                if mux is None:
+                    self.connections = 0     # chuyển sang một kết nối mỗi thao tác
+                    return None
+                s = self._sessions[i] = (ch, mux)
+            return s[1]
+
+    def _run(self, fn, item, cancel, **kw) -> bool:
+        if not self._primed.is_set():    # thao tác đầu đi riêng: lần RSA duy nhất, nhận vé phiên
+            with self._prime_lock:
+                if not self._primed.is_set():
+                    try:
+                        return self._call(fn, item, cancel, **kw)
+                    finally:
+                        self._primed.set()
+        return self._call(fn, item, cancel, **kw)
+
+    def _call(self, fn, item, cancel, **kw) -> bool:
+        """
+        Phiên bền: thất bại / lỗi bất kỳ -> làm lại trên kênh con mới (gói KEY / DOWNLOAD mất, phiên bị đóng).
+        Kết nối riêng: chỉ làm lại khi kết nối đứt (reset…; luồng thì resume); server từ chối -> False ngay.
+        """
+        for attempt in range(1, config.MAX_RETRY + 1):
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            if attempt > 1:
+                metrics.count("retries")
+            sub = None
+            try:
+                if self.connections and (mux := self._session(next(self._rr) % self.connections)):
+                    sub = mux.open()
+                if fn(item, sub, **kw):
+                    return True
+                if sub is None:
+                    return False
+            except Cancelled:
+                raise
+            except nu.Busy as e:
+                backoff(e, cancel)
+            except (OSError, ConnectionError) as e:
+                nu.warn(f"   {item}: {e or type(e).__name__}")
+            except Exception as e:
+                if sub is None:
+                    raise
+                nu.warn(f"   {item}: {e or type(e).__name__}")
+            finally:
+                if sub is not None:
+                    sub.close()
+        return False
+
+def backoff(e: nu.Busy, cancel=None):
+    """Chờ thời gian server gợi ý (+ tới 50% ngẫu nhiên để các client không cùng quay lại một lúc)."""
+    wait = e.retry_after * random.uniform(1, 1.5)
+    nu.warn(f"   server busy; retry in {wait:.1f}s")
+    metrics.count("busy")
+    (cancel or threading.Event()).wait(wait)
+
+# ---- CLI ----
+def batch(client: Client, mode: str, items: list) -> int:
+    t0   = time.time()
+    futs = client.upload_many(items) if mode == "upload" else client.download_many(items)
+    done = 0
+    for item, f in zip(items, futs):
+        if f.result():
+            done += 1
+            nu.info(f"[OK] {item}")
+        else:
+            nu.error(f"[FAIL] {item}")
+    nu.info(f"[BATCH] {done}/{len(items)} file(s) in {time.time() - t0:.1f}s over "
+            f"{client.connections or len(items)} connection(s)")
+    return done
+
+def dump_metrics(path: str):
+    out = json.dumps(metrics.snapshot(), indent=2)
+    if path == "-":
+        print(out)
     else:
-        download()
+        Path(path).write_text(out)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["upload", "download", "list", "stat", "stats"], required=True)
+    parser.add_argument("--file", nargs="+", default=["video.mp4"],
+                        help="một hoặc nhiều file / thư mục (nhiều file -> chế độ lô trên một kết nối)")
+    parser.add_argument("--stream", action="store_true", help="upload / download theo luồng DATA-CHUNK")
+    parser.add_argument("--parallel", type=int, default=1,
+                        help="số kết nối song song cho upload một file (cùng --stream)")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="số phiên bền dùng chung cho chế độ lô (mỗi phiên tối đa PIPELINE yêu cầu)")
+    parser.add_argument("--range", action="append", default=[], metavar="OFFSET:LENGTH",
+                        help="chỉ tải các đoạn byte này, song song trên một kết nối (--mode download)")
+    parser.add_argument("--prefix", default="", help="chỉ liệt kê file có tên bắt đầu bằng chuỗi này (--mode list)")
+    parser.add_argument("--metrics", nargs="?", const="-", metavar="PATH",
+                        help="bật đo đạc, khi thoát ghi tóm tắt JSON (bộ đếm + thời gian từng pha) vào PATH ('-' = stdout)")
+    parser.add_argument("--loss", type=float, default=config.LOSS_RATE,
+                        help="xác suất drop gói mô phỏng trong tiến trình (0 khi đi qua netem.py)")
+    args = parser.parse_args()
+    config.LOSS_RATE = args.loss
+
+    print_requirement_table()
+    if args.metrics:
+        config.METRICS = True
+        atexit.register(dump_metrics, args.metrics)
+    if args.mode == "list":
+        show_list(args.prefix); return
+    if args.mode == "stats":
+        show_stats(); return
+    if args.mode == "stat":
+        for name in args.file:
+            show_stat(name)
+        return
+    if args.mode == "download" and args.range:
+        download_ranges(args.file[0], args.range); return
+    items  = expand(args.file) if args.mode == "upload" else args.file
+    single = len(items) == 1 and not Path(args.file[0]).is_dir()
+    with Client(0 if single else max(args.connections, 1), stream=args.stream,
+                parallel=max(args.parallel, 1)) as client:
+        if single:                       # một file: kết nối riêng, in từng bước
+            (client.upload(items[0]) if args.mode == "upload" else client.download(items[0])).result()
+        elif items:
+            batch(client, args.mode, items)
+
+if __name__ == "__main__":
+    main()
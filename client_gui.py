@@ -3,10 +3,88 @@ from ttkbootstrap.constants import *
 from tkinter import filedialog, messagebox, scrolledtext
 import threading
 import os
+import queue
+import re
 import sys
-import shutil
+import time
 import client
-from pathlib import Path
+import config
+
+class LogSink:
+    """
+    Thay sys.stdout / sys.stderr: write() từ mọi thread chỉ đẩy vào hàng đợi, không chạm widget;
+    GUI rút cả lô trên timer Tk (drain), bỏ mã màu ANSI của net_utils.
+    """
+    ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+
+    def write(self, msg):
+        if msg:
+            self.queue.put(msg)
+
+    def flush(self):
+        pass
+
+    def drain(self, max_lines: int) -> str:
+        """Mọi thứ đã ghi từ lần rút trước, chỉ giữ `max_lines` dòng cuối (log dồn quá nhanh thì bỏ phần cũ)."""
+        parts = []
+        try:
+            while True:
+                parts.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        text = self.ANSI.sub("", "".join(parts))
+        if text.count("\n") > max_lines:
+            text = "".join(text.splitlines(keepends=True)[-max_lines:])
+        return text
+
+class Transfer:
+    """Một dòng của hàng đợi truyền: thread truyền ghi tiến độ / trạng thái, timer Tk đọc để vẽ."""
+
+    def __init__(self, kind: str, name: str, dest: str = None):
+        self.kind, self.name, self.dest = kind, name, dest
+        self.done = self.total = 0
+        self.rate   = 0.0                # byte/giây (trung bình trượt)
+        self.status = "Chờ"
+        self.cancel = threading.Event()
+        self.future = None
+        self._last  = None               # (done, thời điểm) ở lần vẽ trước
+        self.reported = False            # đã in kết quả ra log
+
+    def progress(self, done: int, total: int):
+        """Callback của client.Client (thread truyền)."""
+        self.done, self.total = done, total
+        if self.status == "Chờ":
+            self.status = "Đang chạy"
+
+    def finished(self, future):
+        if future.cancelled():
+            self.status = "Đã huỷ"
+        elif isinstance(future.exception(), client.Cancelled):
+            self.status = "Đã huỷ"
+        elif future.exception() is not None:
+            self.status = "Lỗi"
+            print(f"[EXCEPTION] {self.name}: {future.exception()}")
+        else:
+            self.status = "Xong" if future.result() else "Lỗi"
+
+    def sample(self, now: float):
+        """Cập nhật tốc độ từ lượng byte tăng thêm kể từ lần vẽ trước (gọi trên thread Tk)."""
+        if self._last is not None and self.status == "Đang chạy" and now > self._last[1]:
+            inst = (self.done - self._last[0]) / (now - self._last[1])
+            self.rate = inst if not self.rate else 0.7 * self.rate + 0.3 * inst
+        self._last = (self.done, now)
+
+    def row(self) -> tuple:
+        pct  = 100 * self.done / self.total if self.total else (100 if self.status == "Xong" else 0)
+        bar  = "█" * int(pct / 5) + "░" * (20 - int(pct / 5))
+        left = (self.total - self.done) / self.rate if self.rate > 0 and self.status == "Đang chạy" else None
+        eta  = time.strftime("%M:%S", time.gmtime(left)) if left is not None and left < 360000 else ""
+        speed = f"{self.rate / 2**20:.1f}" if self.status == "Đang chạy" else ""
+        return ("⬆️" if self.kind == "upload" else "⬇️", self.name, f"{bar} {pct:3.0f}%",
+                f"{self.done / 2**20:.1f} / {self.total / 2**20:.1f} MB", speed, eta, self.status)
 
 class ClientGUI:
     def __init__(self, master):
@@ -39,8 +117,12 @@ class ClientGUI:
         self.create_main_tab()
         self.create_log_tab()
         self.redirect_stdout()
-        self.file_path = None
+        self.file_paths = []
         self.download_filename = None
+        self.client = client.Client(stream=True)   # phiên bền dùng chung cho mọi upload / download
+        self.transfers = {}                        # iid của dòng Treeview -> Transfer
+        master.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.tick()
 
     def create_topbar(self, master):
         topbar = tb.Frame(master, bootstyle="dark")
@@ -77,8 +159,10 @@ class ClientGUI:
             self.current_theme_index = self.available_themes.index(new_theme)
 
     def create_main_tab(self):
-        left = tb.Frame(self.tab_main)
-        right = tb.Frame(self.tab_main)
+        top = tb.Frame(self.tab_main)
+        top.pack(fill="x")
+        left = tb.Frame(top)
+        right = tb.Frame(top)
         left.pack(side="left", expand=True, fill="both", padx=10)
         right.pack(side="right", expand=True, fill="both", padx=10)
 
@@ -94,15 +178,38 @@ class ClientGUI:
             .pack(side="left", padx=5)
 
         # Download section
-        tb.Label(right, text="Chọn file từ máy (trùng với tên đã upload):", font=("Segoe UI", 12)).pack(anchor="w", pady=(0, 5))
-        btn_choose = tb.Button(right, text="📂 Chọn file", command=self.choose_filename_for_download, bootstyle="outline-secondary")
-        btn_choose.pack(pady=5, anchor="w")
+        tb.Label(right, text="Chọn file trên server:", font=("Segoe UI", 12)).pack(anchor="w", pady=(0, 5))
+        self.remote_combo = tb.Combobox(right, state="readonly", width=40)
+        self.remote_combo.pack(pady=5, anchor="w", fill="x")
+        self.remote_combo.bind("<<ComboboxSelected>>", self.choose_filename_for_download)
+        btn_refresh = tb.Button(right, text="🔄 Tải danh sách", command=self.threaded_refresh, bootstyle="outline-secondary")
+        btn_refresh.pack(pady=5, anchor="w")
         btn_download = tb.Button(right, text="⬇️ Download", command=self.threaded_download, bootstyle="primary")
         btn_download.pack(pady=10, anchor="w")
 
-        
-
-        
+        self.create_queue_panel(self.tab_main)
+
+    def create_queue_panel(self, parent):
+        box = tb.Labelframe(parent, text="📦 Hàng đợi truyền", padding=10)
+        box.pack(fill="both", expand=True, padx=10, pady=(10, 0))
+        cols = (("kind", "", 40), ("file", "File", 180), ("progress", "Tiến độ", 190),
+                ("bytes", "Đã truyền", 140), ("speed", "MB/s", 60), ("eta", "ETA", 60), ("status", "Trạng thái", 90))
+        self.queue_view = tb.Treeview(box, columns=[c[0] for c in cols], show="headings", height=8)
+        for col, text, width in cols:
+            self.queue_view.heading(col, text=text)
+            self.queue_view.column(col, width=width, anchor="w")
+        self.queue_view.pack(fill="both", expand=True)
+
+        row = tb.Frame(box)
+        row.pack(fill="x", pady=(8, 0))
+        self.total_bar = tb.Progressbar(row, maximum=100, bootstyle="success-striped")
+        self.total_bar.pack(side="left", fill="x", expand=True, padx=(0, 10))
+        self.total_label = tb.Label(row, text="", width=28)
+        self.total_label.pack(side="left")
+        tb.Button(row, text="🧹 Xoá mục đã xong", command=self.clear_finished, bootstyle="outline-secondary")\
+            .pack(side="right", padx=5)
+        tb.Button(row, text="⛔ Huỷ mục đã chọn", command=self.cancel_selected, bootstyle="outline-danger")\
+            .pack(side="right", padx=5)
 
     def create_log_tab(self):
         tb.Label(self.tab_log, text="📜 Nhật ký hệ thống:", font=("Segoe UI", 12)).pack(anchor="w", pady=(0, 5))
@@ -110,62 +217,119 @@ class ClientGUI:
         self.log.pack(padx=10, pady=10, fill="both", expand=True)
 
     def browse_file(self):
-        path = filedialog.askopenfilename()
-        if path:
-            self.file_path = path
-            self.label_filename.config(text=os.path.basename(path))
+        paths = filedialog.askopenfilenames()
+        if paths:
+            self.file_paths = list(paths)
+            self.label_filename.config(text=os.path.basename(paths[0]) if len(paths) == 1
+                                       else f"{len(paths)} file đã chọn")
+
+    def choose_filename_for_download(self, event=None):
+        self.download_filename = self.remote_combo.get()
+        print(f"[CHỌN FILE] Tên để tải từ server: {self.download_filename}")
 
-    def choose_filename_for_download(self):
-        path = filedialog.askopenfilename(title="Chọn file cục bộ để lấy tên tải từ server")
-        if path:
-            self.download_filename = os.path.basename(path)
-            print(f"[CHỌN FILE] Tên để tải từ server: {self.download_filename}")
+    def threaded_refresh(self):
+        threading.Thread(target=self.refresh_remote_files, daemon=True).start()
+
+    def refresh_remote_files(self):
+        try:
+            files = client.list_files()
+            if files is None:
+                print("[ERR] Server từ chối LIST")
+                return
+            names = [f["name"] for f in files]
+            self.master.after(0, lambda: self.remote_combo.configure(values=names))
+            print(f"[LIST] {len(names)} file trên server")
+        except Exception as e:
+            print(f"[EXCEPTION] {e}")
 
     def threaded_upload(self):
-        if not self.file_path:
+        if not self.file_paths:
             messagebox.showwarning("Lỗi", "Vui lòng chọn file để upload")
             return
-        threading.Thread(target=self.upload_file, daemon=True).start()
+        for path in self.file_paths:
+            t = self.add_transfer(Transfer("upload", os.path.basename(path)))
+            t.future = self.client.upload(path, t.progress, t.cancel)
+            t.future.add_done_callback(t.finished)
 
     def threaded_download(self):
         if not self.download_filename:
             messagebox.showwarning("Lỗi", "Vui lòng chọn file để tải từ server")
             return
-        threading.Thread(target=self.download_file, daemon=True).start()
-
-    def upload_file(self):
-        try:
-            client.upload(self.file_path)
-            messagebox.showinfo("Upload", f"Đã upload thành công: {os.path.basename(self.file_path)}")
+        save_path = filedialog.asksaveasfilename(title="Chọn nơi lưu file tải về", initialfile=self.download_filename)
+        if not save_path:
+            print("[HỦY] Người dùng chưa chọn vị trí lưu")
+            return
+        t = self.add_transfer(Transfer("download", self.download_filename, save_path))
+        t.future = self.client.download(self.download_filename, save_path, t.progress, t.cancel)
+        t.future.add_done_callback(t.finished)
+
+    # ---- Hàng đợi truyền: thread truyền chỉ ghi vào Transfer, tick() vẽ lại trên thread Tk ----
+    def add_transfer(self, t: Transfer) -> Transfer:
+        self.transfers[self.queue_view.insert("", "end", values=t.row())] = t
+        return t
+
+    def cancel_selected(self):
+        for iid in self.queue_view.selection():
+            t = self.transfers.get(iid)
+            if t and t.status in ("Chờ", "Đang chạy"):
+                t.cancel.set()
+                t.future.cancel()            # chưa chạy -> bỏ khỏi hàng đợi ngay
+                print(f"[HỦY] {t.name}")
+
+    def clear_finished(self):
+        for iid, t in list(self.transfers.items()):
+            if t.future.done():
+                self.queue_view.delete(iid)
+                del self.transfers[iid]
+
+    def tick(self):
+        """Timer Tk: ghi log theo lô và vẽ lại hàng đợi; widget chỉ được chạm ở đây (thread Tk)."""
+        self.flush_log()
+        self.refresh_queue()
+        self.master.after(config.GUI_REFRESH_MS, self.tick)
+
+    def flush_log(self):
+        text = self.sink.drain(config.GUI_LOG_LINES)
+        if not text:
+            return
+        self.log.insert("end", text)
+        excess = int(self.log.index("end-1c").split(".")[0]) - config.GUI_LOG_LINES
+        if excess > 0:
+            self.log.delete("1.0", f"{excess + 1}.0")
+        self.log.see("end")
+
+    def refresh_queue(self):
+        now, done, total, rate = time.monotonic(), 0, 0, 0.0
+        for iid, t in self.transfers.items():
+            t.sample(now)
+            values = t.row()
+            if tuple(self.queue_view.item(iid, "values")) != values:
+                self.queue_view.item(iid, values=values)
+            if t.status in ("Xong", "Lỗi", "Đã huỷ") and not t.reported:
+                t.reported = True
+                self.report(t)
+            if t.status in ("Chờ", "Đang chạy"):
+                done, total, rate = done + t.done, total + t.total, rate + t.rate
+        self.total_bar.configure(value=100 * done / total if total else 0)
+        self.total_label.configure(text=f"{done / 2**20:.1f} / {total / 2**20:.1f} MB  {rate / 2**20:.1f} MB/s"
+                                   if total else "")
+
+    def report(self, t: Transfer):
+        """Một lần cho mỗi transfer khi kết thúc (thread Tk)."""
+        if t.status != "Xong":
+            print(f"[{'HỦY' if t.status == 'Đã huỷ' else 'ERR'}] {t.kind} {t.name}")
+        elif t.kind == "upload":
+            print(f"[OK] Đã upload: {t.name}")
             self.master.bell()
-        except Exception as e:
-            print(f"[EXCEPTION] {e}")
-
-    def download_file(self):
-        try:
-            save_path = filedialog.asksaveasfilename(title="Chọn nơi lưu file tải về", initialfile=self.download_filename)
-            if not save_path:
-                print("[HỦY] Người dùng chưa chọn vị trí lưu")
-                return
-
-            filename = self.download_filename
-            temp_file = Path(f"downloaded_{filename}")
-            if temp_file.exists():
-                temp_file.unlink()
+        else:
+            print(f"[OK] File đã lưu tại: {t.dest}")
+            self.play_download_sound()
 
-            client.download(filename)
-
-            if temp_file.exists():
-                shutil.move(str(temp_file), save_path)
-                print(f"[OK] File đã lưu tại: {save_path}")
-                messagebox.showinfo("Download", f"Tải thành công: {os.path.basename(save_path)}")
-                self.play_download_sound()
-                os.startfile(os.path.dirname(save_path))
-            else:
-                print(f"[ERR] Không tìm thấy file sau khi tải: {temp_file}")
-
-        except Exception as e:
-            print(f"[EXCEPTION] {e}")
+    def on_close(self):
+        for t in self.transfers.values():
+            t.cancel.set()
+        self.client.close(wait=False)      # không chặn cửa sổ vì thao tác đang chạy
+        self.master.destroy()
 
     def play_download_sound(self):
         try:
@@ -179,19 +343,9 @@ class ClientGUI:
         messagebox.showinfo("Thông báo", f"Bạn đã chọn ngôn ngữ: {lang} (tính năng chưa được kích hoạt hoàn chỉnh)")
 
     def redirect_stdout(self):
-        class StdoutRedirector:
-            def __init__(self, text_widget):
-                self.text_widget = text_widget
-
-            def write(self, msg):
-                self.text_widget.insert("end", msg)
-                self.text_widget.see("end")
-
-            def flush(self):
-                pass
-
-        sys.stdout = StdoutRedirector(self.log)
-        sys.stderr = StdoutRedirector(self.log)
+        self.sink = LogSink()
+        sys.stdout = self.sink
+        sys.stderr = self.sink
 
 if __name__ == "__main__":
     app = tb.Window(themename="darkly")
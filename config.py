@@ -4,9 +4,64 @@ PORT = 9000
 TIMEOUT   = 5        # giây đợi ACK / nhận gói
 MAX_RETRY = 3
 LOSS_RATE = 0.10     # xác suất drop gói mô phỏng (chỉ áp dụng cho gói DATA)
+STEP_DELAY = 0.3     # giây dừng sau mỗi bước in ra cho dễ đọc (0 = không dừng, vd. khi benchmark)
+
+# Truyền theo luồng (DATA-STREAM / DATA-CHUNK)
+CHUNK_SIZE    = 64 * 1024  # byte plaintext mỗi DATA-CHUNK (bội số 16 cho AES)
+WINDOW        = 32         # số DATA-CHUNK gửi trước khi chờ CHUNK-ACK
+CHUNK_RETRY   = 10         # số lần gửi lại tối đa của một chunk
+STATE_SYNC    = 64         # fsync + lưu trạng thái resume sau mỗi N chunk
+BINARY_FRAMES = True       # đề nghị binary frame khi handshake (False = JSON+base64 cũ)
+AEAD          = ("gcm", "chacha")  # AEAD đề nghị khi handshake, theo thứ tự ưu tiên (() = AES-CBC + SHA-512 cũ)
+COMPRESS      = ("zlib",)  # nén từng chunk trước khi mã hoá: "zlib" / "lzma" theo thứ tự ưu tiên (() = tắt)
+COMPRESS_LEVEL = 6         # mức nén zlib (1-9) / preset lzma (0-9)
+COMPRESS_RATIO = 0.9       # chỉ nén khi mẫu nén nhanh còn < 90% kích thước (bỏ qua MP4, ZIP…)
+
+# Server
+BACKLOG       = 128        # hàng đợi listen()
+MAX_SESSIONS  = 256        # số phiên xử lý đồng thời tối đa
+MAX_STREAMS   = 16         # số yêu cầu chạy cùng lúc trên một phiên bền (mux); hơn nữa -> BUSY cho yêu cầu đó
+ASYNC_WORKERS = 8          # thread pool cho RSA / AES / đĩa (engine asyncio)
+CRYPTO_PROCS  = 0          # tiến trình cho RSA khoá riêng (0 = tắt, chạy ngay trên thread gọi)
+SESSION_IDLE  = 60         # giây: đóng phiên bền (mux) rảnh, không còn yêu cầu nào
+CACHE_BYTES   = 256 * 1024 * 1024  # RAM cho LRU chunk plaintext của file hay được tải (0 = tắt)
+PARTIAL_TTL   = 7 * 24 * 3600      # giây: upload dở dang không được ghi tiếp lâu hơn -> xoá (lúc khởi động + mỗi giờ)
+
+# Kiểm soát tải (admission.py): quá tải -> trả BUSY kèm thời gian nên thử lại, không để kết nối treo / hết RAM
+ADMIT_QUEUE   = 64         # số kết nối được chờ khi đã đủ MAX_SESSIONS phiên (nhiều hơn -> BUSY ngay)
+ADMIT_WAIT    = 2.0        # giây tối đa một kết nối / yêu cầu chờ chỗ (nhỏ hơn TIMEOUT client chờ "Ready!")
+MAX_INFLIGHT  = 512 * 1024 * 1024  # byte file giữ trọn trong RAM cùng lúc (DATA không theo luồng; 0 = không giới hạn)
+MAX_FRAME     = 1024 * 1024 * 1024 # byte: frame lớn nhất server nhận (header báo lớn hơn -> đóng kết nối, không cấp bộ đệm)
+MAX_CONTROL   = 1024 * 1024        # byte: frame nhận không cần giữ chỗ (điều khiển, DATA-CHUNK); lớn hơn phải khớp KEY size
+ADMIT_DEFAULT = 16 * 1024 * 1024   # byte giữ chỗ cho KEY không báo size (client cũ); header DATA lớn hơn -> giữ thêm nếu còn chỗ
+BUSY_RETRY    = 1.0        # giây client nên chờ trước khi thử lại sau BUSY
+# Băng thông (token bucket mỗi kết nối): tổng mỗi chiều chia đều cho các kết nối đang truyền
+RATE_OUT      = 0          # byte/s server gửi đi, tổng mọi kết nối (0 = không giới hạn)
+RATE_IN       = 0          # byte/s server nhận vào, tổng mọi kết nối (0 = không giới hạn)
+CONN_RATE     = 0          # byte/s tối đa mỗi kết nối, mỗi chiều (0 = không giới hạn)
+RATE_BURST    = 256 * 1024 # byte một kết nối được dồn khi rảnh
+
+# Đo đạc (metrics.py): bộ đếm + thời gian từng pha; tắt thì mỗi điểm đo chỉ kiểm tra cờ
+METRICS       = False      # server.py --metrics / client.py --metrics cũng bật
+METRICS_PORT  = 9100       # cổng HTTP text Prometheus của server (GET /metrics)
+
+# Chế độ lô (client.py --file a b c / thư mục): một kết nối bền cho cả lô
+PIPELINE      = 8          # số yêu cầu đang chạy cùng lúc trên kết nối
+
+# Vé phiên: kết nối sau dùng lại master secret, khoá mỗi lần truyền suy ra bằng HKDF (không RSA)
+TICKET_LIFETIME = 24 * 3600   # giây
+
+# Duyệt file trên server (LIST / STAT, chỉ mục SQLite trong STORAGE_DIR)
+LIST_LIMIT = 500          # số file tối đa mỗi trang LIST
+
+# GUI (client_gui.py): log + hàng đợi truyền được vẽ lại theo lô trên timer Tk
+GUI_REFRESH_MS = 100      # chu kỳ rút log / cập nhật tiến độ
+GUI_LOG_LINES  = 5000     # số dòng log giữ lại (bỏ dòng cũ nhất)
 
 STORAGE_DIR = "DISK C"
+FSYNC       = True        # fsync chunk + manifest trước khi file được coi là đã lưu (False: nhanh, mất khi sập nguồn)
 KEYS_DIR    = "keys"
+RESUME_DIR  = ".resume"   # trạng thái upload/download dở dang phía client
 
 # Bảng theo dõi yêu cầu
 REQUIREMENTS = [
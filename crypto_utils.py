@@ -1,13 +1,16 @@
-import os, hashlib
+import os, hashlib, hmac, struct, threading, time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, padding as sym_padding, serialization
 from cryptography.hazmat.primitives.asymmetric import padding as asym_padding, rsa
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-import config
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import config, metrics
 
-KEY_DIR = Path(config.KEYS_DIR)
-KEY_DIR.mkdir(exist_ok=True)
+KEY_DIR = Path(config.KEYS_DIR)          # tạo khi sinh khoá / vé lần đầu, không tạo lúc import
 
 class CryptoUtils:
     """RSA-2048 (PKCS#1 v1.5), AES-CBC, SHA-512 helpers"""
@@ -15,12 +18,25 @@ class CryptoUtils:
     # ---- RSA ----
     @staticmethod
     def load_or_create_rsa(prefix: str):
+        """
+        Nạp cặp khoá `prefix` từ KEY_DIR (sinh mới nếu chưa có). Lần nạp PEM đầu kiểm tra khoá riêng đầy đủ
+        (~40 ms / khoá) rồi ghi bản DER đã kiểm tra (<prefix>_priv.der); các lần sau đọc bản DER, bỏ qua bước
+        kiểm tra. Bản DER cũ hơn PEM (khoá bị thay) bị bỏ qua và ghi lại.
+        """
         priv_path = KEY_DIR / f"{prefix}_priv.pem"
         pub_path  = KEY_DIR / f"{prefix}_pub.pem"
+        der_path  = KEY_DIR / f"{prefix}_priv.der"
         if priv_path.exists() and pub_path.exists():
-            priv = serialization.load_pem_private_key(priv_path.read_bytes(), None, default_backend())
-            pub  = serialization.load_pem_public_key(pub_path.read_bytes(),  default_backend())
+            if der_path.exists() and der_path.stat().st_mtime_ns >= priv_path.stat().st_mtime_ns:
+                priv = serialization.load_der_private_key(der_path.read_bytes(), None,
+                                                          unsafe_skip_rsa_key_validation=True)
+            else:
+                priv = serialization.load_pem_private_key(priv_path.read_bytes(), None, default_backend())
+                _write_der_cache(der_path, priv)
+            pub = serialization.load_pem_public_key(pub_path.read_bytes(), default_backend())
+            _register(prefix, priv)
             return priv, pub
+        KEY_DIR.mkdir(exist_ok=True)
         priv = rsa.generate_private_key(65537, 2048, default_backend())
         pub  = priv.public_key()
         priv_path.write_bytes(priv.private_bytes(
@@ -31,21 +47,57 @@ class CryptoUtils:
             serialization.Encoding.PEM,
             serialization.PublicFormat.SubjectPublicKeyInfo))
         print(f"[KEY] RSA pair generated: {priv_path} / {pub_path}")
+        _write_der_cache(der_path, priv)
+        _register(prefix, priv)
         return priv, pub
 
     @staticmethod
+    @metrics.timed("crypto.rsa_encrypt")
     def rsa_encrypt(pub, data: bytes):
-        return pub.encrypt(data, asym_padding.PKCS1v15())
+        return pub.encrypt(bytes(data), asym_padding.PKCS1v15())
 
     @staticmethod
+    @metrics.timed("crypto.rsa_decrypt")
     def rsa_decrypt(priv, data: bytes):
-        return priv.decrypt(data, asym_padding.PKCS1v15())
+        return _rsa_private("decrypt", priv, [bytes(data)])[0]
 
     @staticmethod
+    @metrics.timed("crypto.rsa_sign")
     def rsa_sign(priv, data: bytes):
-        return priv.sign(data, asym_padding.PKCS1v15(), hashes.SHA512())
+        return _rsa_private("sign", priv, [bytes(data)])[0]
 
     @staticmethod
+    @metrics.timed("crypto.rsa_decrypt_many")
+    def rsa_decrypt_many(priv, items) -> list:
+        """Giải mã cả lô – với pool tiến trình, lô được chia đều cho các worker."""
+        return _rsa_private("decrypt", priv, [bytes(d) for d in items])
+
+    @staticmethod
+    @metrics.timed("crypto.rsa_sign_many")
+    def rsa_sign_many(priv, items) -> list:
+        return _rsa_private("sign", priv, [bytes(d) for d in items])
+
+    @staticmethod
+    def start_pool(prefixes=("server",), workers: int = 0):
+        """
+        Chuyển RSA khoá riêng (decrypt / sign) của các khoá `prefixes` sang pool tiến trình
+        (mặc định số core); mỗi worker tự nạp khoá một lần lúc khởi động.
+        """
+        global _pool, _pool_size
+        CryptoUtils.stop_pool()
+        _pool_size = workers or os.cpu_count() or 1
+        _pool = ProcessPoolExecutor(_pool_size, initializer=_worker_init, initargs=(tuple(prefixes),))
+        list(_pool.map(_worker_ping, range(_pool_size)))    # khởi động worker trước khi nhận tải
+
+    @staticmethod
+    def stop_pool():
+        global _pool
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+    @staticmethod
+    @metrics.timed("crypto.rsa_verify")
     def rsa_verify(pub, sig: bytes, data: bytes):
         try:
             pub.verify(sig, data, asym_padding.PKCS1v15(), hashes.SHA512())
@@ -53,17 +105,224 @@ class CryptoUtils:
         except Exception:
             return False
 
+    # ---- HMAC / HKDF (phiên nối lại bằng vé, không RSA) ----
+    @staticmethod
+    @metrics.timed("crypto.hmac_sha512")
+    def hmac_sha512(key: bytes, data: bytes) -> bytes:
+        return hmac.new(bytes(key), data, hashlib.sha512).digest()
+
+    @staticmethod
+    def hmac_verify(key: bytes, sig: bytes, data: bytes) -> bool:
+        return hmac.compare_digest(CryptoUtils.hmac_sha512(key, data), bytes(sig))
+
+    @staticmethod
+    @metrics.timed("crypto.derive_key")
+    def derive_key(master: bytes, salt: bytes = b"", info: bytes = b"transfer") -> bytes:
+        """HKDF-SHA256: khoá AES 32 byte cho một lần truyền (salt = nonce client + nonce server)."""
+        return HKDF(hashes.SHA256(), 32, bytes(salt) or None, info, default_backend()).derive(bytes(master))
+
     # ---- AES-CBC ----
     @staticmethod
+    @metrics.timed("crypto.aes_encrypt")
     def aes_encrypt(key: bytes, iv: bytes, data: bytes):
         padder = sym_padding.PKCS7(128).padder()
         padded = padder.update(data) + padder.finalize()
         return Cipher(algorithms.AES(key), modes.CBC(iv), default_backend()).encryptor().update(padded)
 
     @staticmethod
+    @metrics.timed("crypto.aes_decrypt")
     def aes_decrypt(key: bytes, iv: bytes, data: bytes):
         dec = Cipher(algorithms.AES(key), modes.CBC(iv), default_backend()).decryptor().update(data)
         unpad = sym_padding.PKCS7(128).unpadder()
         return unpad.update(dec) + unpad.finalize()
 
-    sha512 = staticmethod(lambda d: hashlib.sha512(d).digest())
+    # ---- AEAD (AES-GCM / ChaCha20-Poly1305): mã hoá + xác thực trong một lượt, không padding ----
+    AEAD_NONCE = 12
+    AEAD_TAG   = 16
+
+    @staticmethod
+    @metrics.timed("crypto.aead_encrypt")
+    def aead_encrypt(alg: str, key: bytes, nonce: bytes, data: bytes, aad: bytes = b"") -> bytes:
+        """Trả về cipher || tag; `aad` được xác thực nhưng không mã hoá."""
+        return _AEAD[alg](key).encrypt(nonce, data, aad)
+
+    @staticmethod
+    @metrics.timed("crypto.aead_encrypt_into")
+    def aead_encrypt_into(alg: str, key: bytes, nonce: bytes, data, out: bytearray, aad: bytes = b""):
+        """Như aead_encrypt; AES-GCM ghi thẳng vào `out` dùng lại (len(out) >= len(data) + 16)."""
+        if alg != "gcm":
+            return CryptoUtils.aead_encrypt(alg, key, nonce, data, aad)
+        enc = Cipher(algorithms.AES(key), modes.GCM(nonce), default_backend()).encryptor()
+        enc.authenticate_additional_data(aad)
+        n = enc.update_into(data, out)
+        enc.finalize()
+        out[n:n + 16] = enc.tag
+        return memoryview(out)[:n + 16]
+
+    @staticmethod
+    @metrics.timed("crypto.aead_decrypt")
+    def aead_decrypt(alg: str, key: bytes, nonce: bytes, data: bytes, aad: bytes = b"") -> bytes:
+        """ValueError nếu dữ liệu / aad bị sửa hoặc sai khoá."""
+        try:
+            return _AEAD[alg](key).decrypt(nonce, data, aad)
+        except InvalidTag:
+            raise ValueError("authentication failed") from None
+
+    # ---- Gói DATA cả file: AEAD (meta làm AAD) hoặc AES-CBC + SHA-512(iv + cipher) ----
+    @staticmethod
+    def seal_packet(aead: str, key: bytes, data: bytes, aad: bytes = b"") -> dict:
+        if aead:
+            nonce = os.urandom(CryptoUtils.AEAD_NONCE)
+            return {"iv": nonce, "cipher": CryptoUtils.aead_encrypt(aead, key, nonce, data, aad)}
+        iv     = os.urandom(16)
+        cipher = CryptoUtils.aes_encrypt(key, iv, data)
+        return {"iv": iv, "cipher": cipher, "hash": CryptoUtils.sha512(iv, cipher)}
+
+    @staticmethod
+    def open_packet(aead: str, key: bytes, pkt: dict, aad: bytes = b"") -> bytes:
+        """Plaintext của gói DATA; ValueError nếu sai hash / tag."""
+        if aead:
+            return CryptoUtils.aead_decrypt(aead, key, pkt["iv"], pkt["cipher"], aad)
+        if CryptoUtils.sha512(pkt["iv"], pkt["cipher"]) != pkt.get("hash"):
+            raise ValueError("hash mismatch")
+        return CryptoUtils.aes_decrypt(key, pkt["iv"], pkt["cipher"])
+
+    # ---- AES-CBC vào bộ đệm dùng lại (từng chunk của luồng) ----
+    @staticmethod
+    @metrics.timed("crypto.aes_encrypt_into")
+    def aes_encrypt_into(key: bytes, iv: bytes, data, out: bytearray) -> memoryview:
+        """Như aes_encrypt nhưng ghi vào `out` dùng lại (len(out) >= len(data) + 16)."""
+        enc  = AesCbcStream(key, iv)
+        n    = len(enc.update_into(data, out))
+        tail = enc.finalize()
+        out[n:n + len(tail)] = tail
+        return memoryview(out)[:n + len(tail)]
+
+    @staticmethod
+    @metrics.timed("crypto.sha512")
+    def sha512(*parts) -> bytes:
+        """SHA-512 của các mảnh nối tiếp – sha512(iv, cipher) thay cho sha512(iv + cipher)."""
+        h = hashlib.sha512()
+        for p in parts:
+            h.update(p)
+        return h.digest()
+
+_AEAD = {"gcm": AESGCM, "chacha": ChaCha20Poly1305}
+
+class SessionTickets:
+    """
+    Vé phiên phía server: (hạn dùng, master secret) mã hoá AES-CBC rồi xác thực HMAC-SHA512
+    bằng khoá vé của server, lưu ở KEY_DIR/ticket.key nên vé vẫn dùng được sau khi khởi động lại.
+    """
+    TAG = 64
+
+    def __init__(self, path: Path = KEY_DIR / "ticket.key", lifetime: int = config.TICKET_LIFETIME):
+        path = Path(path)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(os.urandom(64))
+        key = path.read_bytes()
+        self._enc, self._mac = key[:32], key[32:]
+        self.lifetime = lifetime
+
+    def issue(self, master: bytes) -> bytes:
+        iv   = os.urandom(16)
+        body = iv + CryptoUtils.aes_encrypt(self._enc, iv, struct.pack("!Q", int(time.time()) + self.lifetime) + master)
+        return body + CryptoUtils.hmac_sha512(self._mac, body)
+
+    def open(self, ticket: bytes):
+        """Master secret của vé, hoặc None nếu vé giả / hỏng / hết hạn."""
+        ticket = bytes(ticket)
+        body, tag = ticket[:-self.TAG], ticket[-self.TAG:]
+        if len(body) < 32 or not CryptoUtils.hmac_verify(self._mac, tag, body):
+            return None
+        plain = CryptoUtils.aes_decrypt(self._enc, body[:16], body[16:])
+        exp,  = struct.unpack_from("!Q", plain)
+        return plain[8:] if exp > time.time() else None
+
+def _write_der_cache(path: Path, priv):
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "wb") as f:
+            f.write(priv.private_bytes(serialization.Encoding.DER, serialization.PrivateFormat.PKCS8,
+                                       serialization.NoEncryption()))
+    except OSError:                      # thư mục chỉ đọc: vẫn chạy, chỉ chậm hơn
+        pass
+
+class KeyRing:
+    """
+    Khoá RSA nạp lười: chỉ đọc (hoặc sinh) cặp khoá ở lần dùng đầu, giữ đối tượng đã giải mã cho cả tiến trình.
+    `keys.priv("client")`, `keys.pub("server")`.
+    """
+
+    def __init__(self):
+        self._pairs = {}
+        self._lock  = threading.Lock()
+
+    def pair(self, prefix: str) -> tuple:
+        p = self._pairs.get(prefix)
+        if p is None:
+            with self._lock:
+                if (p := self._pairs.get(prefix)) is None:
+                    p = self._pairs[prefix] = CryptoUtils.load_or_create_rsa(prefix)
+        return p
+
+    def priv(self, prefix: str):
+        return self.pair(prefix)[0]
+
+    def pub(self, prefix: str):
+        return self.pair(prefix)[1]
+
+keys = KeyRing()
+
+# ---- Pool tiến trình cho RSA khoá riêng ----
+_RSA_OPS = {
+    "decrypt": lambda priv, d: priv.decrypt(d, asym_padding.PKCS1v15()),
+    "sign":    lambda priv, d: priv.sign(d, asym_padding.PKCS1v15(), hashes.SHA512()),
+}
+_pool, _pool_size = None, 0
+_key_names = {}        # id(priv) -> prefix của khoá do load_or_create_rsa nạp
+_keys      = []        # giữ tham chiếu để id() không bị dùng lại
+_worker_keys = {}      # (trong worker) prefix -> khoá riêng
+
+def _register(prefix: str, priv):
+    _key_names[id(priv)] = prefix
+    _keys.append(priv)
+
+def _rsa_private(op: str, priv, items: list) -> list:
+    name = _key_names.get(id(priv))
+    if _pool is None or name is None:
+        return [_RSA_OPS[op](priv, d) for d in items]
+    if len(items) == 1:
+        return _pool.submit(_worker_run, op, name, items).result()
+    step    = -(-len(items) // _pool_size)
+    batches = [items[i:i + step] for i in range(0, len(items), step)]
+    return [r for out in _pool.map(_worker_run, [op] * len(batches), [name] * len(batches), batches)
+            for r in out]
+
+def _worker_init(prefixes):
+    for p in prefixes:
+        _worker_keys[p] = CryptoUtils.load_or_create_rsa(p)[0]
+
+def _worker_ping(_):
+    return os.getpid()
+
+def _worker_run(op: str, prefix: str, items: list) -> list:
+    priv = _worker_keys[prefix]
+    return [_RSA_OPS[op](priv, d) for d in items]
+
+class AesCbcStream:
+    """Context mã hoá AES-CBC: update_into() từng phần, finalize() thêm padding PKCS7 ở cuối."""
+
+    def __init__(self, key: bytes, iv: bytes):
+        self._ctx  = Cipher(algorithms.AES(key), modes.CBC(iv), default_backend()).encryptor()
+        self.total = 0                  # số byte plaintext đã mã hoá (để tính padding)
+
+    def update_into(self, data, out: bytearray) -> memoryview:
+        """Mã hoá vào bộ đệm `out` dùng lại (len(out) >= len(data) + 15), không cấp phát."""
+        self.total += len(data)
+        return memoryview(out)[:self._ctx.update_into(data, out)]
+
+    def finalize(self) -> bytes:
+        n = 16 - self.total % 16        # PKCS7: phần dư lẻ đang nằm trong context CBC
+        return self._ctx.update(bytes([n]) * n) + self._ctx.finalize()
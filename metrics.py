@@ -0,0 +1,117 @@
+# metrics.py – Đo đạc nhẹ cho client và server
+#
+# Bộ đếm (byte gửi / nhận, gói bị drop, chunk gửi lại, lần thử lại…) và thời gian từng pha (RSA, AES,
+# SHA-512, mã hoá frame, socket I/O, các bước của upload / download). config.METRICS = False thì mỗi
+# điểm đo chỉ tốn một lần kiểm tra cờ. Xuất dạng text Prometheus (server: GET /metrics) hoặc JSON
+# (client.py --metrics).
+import functools, threading, time
+import config
+
+_lock    = threading.Lock()
+_counts  = {}                            # tên -> giá trị
+_timings = {}                            # tên pha -> [số lần, tổng giây, lâu nhất]
+
+def count(name: str, n: int = 1):
+    if config.METRICS:
+        with _lock:
+            _counts[name] = _counts.get(name, 0) + n
+
+def observe(name: str, seconds: float):
+    with _lock:
+        t = _timings.get(name)
+        if t is None:
+            _timings[name] = [1, seconds, seconds]
+        else:
+            t[0] += 1; t[1] += seconds; t[2] = max(t[2], seconds)
+
+class _Timer:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.t0)
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_TIMER = _NoTimer()
+
+def timer(name: str):
+    """`with metrics.timer("server.upload.store"): ...` – đo một khối (kể cả các await bên trong)."""
+    return _Timer(name) if config.METRICS else _NO_TIMER
+
+def timed(name: str):
+    """Decorator: đo thời gian mỗi lần gọi hàm."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kw):
+            if not config.METRICS:
+                return fn(*args, **kw)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kw)
+            finally:
+                observe(name, time.perf_counter() - t0)
+        return inner
+    return wrap
+
+# ---- Xuất ----
+def snapshot() -> dict:
+    with _lock:
+        return {"counters": dict(_counts),
+                "timings": {k: {"count": c, "total_s": round(s, 6), "max_s": round(m, 6)}
+                            for k, (c, s, m) in _timings.items()}}
+
+def reset():
+    with _lock:
+        _counts.clear(); _timings.clear()
+
+def prometheus(gauges: dict = None) -> str:
+    """Text exposition format: counter transfer_<tên>_total, summary transfer_phase_seconds{phase=...}, gauge."""
+    snap, lines = snapshot(), []
+    for name, v in sorted(snap["counters"].items()):
+        lines += [f"# TYPE transfer_{name}_total counter", f"transfer_{name}_total {v}"]
+    if snap["timings"]:
+        lines += ["# TYPE transfer_phase_seconds summary"]
+        for name, t in sorted(snap["timings"].items()):
+            lines += [f'transfer_phase_seconds_count{{phase="{name}"}} {t["count"]}',
+                      f'transfer_phase_seconds_sum{{phase="{name}"}} {t["total_s"]}']
+        lines += ["# TYPE transfer_phase_seconds_max gauge"]
+        lines += [f'transfer_phase_seconds_max{{phase="{name}"}} {t["max_s"]}'
+                  for name, t in sorted(snap["timings"].items())]
+    for name, v in sorted((gauges or {}).items()):
+        lines += [f"# TYPE transfer_{name} gauge", f"transfer_{name} {v}"]
+    return "\n".join(lines) + "\n"
+
+def serve_http(port: int, gauges=dict):
+    """Endpoint GET /metrics trên thread nền; `gauges()` trả về các giá trị tức thời thêm vào (kho, cache…)."""
+    import http.server                   # ~25 ms import – chỉ trả khi thật sự bật endpoint
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404); return
+            body = prometheus(gauges()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    srv = http.server.ThreadingHTTPServer((config.HOST, port), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
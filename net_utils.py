@@ -1,4 +1,4 @@
-import json, random, socket, struct, sys, os, config
+import asyncio, base64, itertools, json, queue, random, socket, struct, sys, os, threading, time, config, metrics
 
 # ---- ANSI màu (tự tắt trên CMD cũ) ----
 ANSI  = sys.platform != "win32" or "ANSICON" in os.environ or "WT_SESSION" in os.environ
@@ -12,36 +12,653 @@ def warn(msg):  print(YEL   + msg + RESET, flush=True)
 def error(msg): print(RED   + msg + RESET, flush=True)
 
 # ---- Length-prefixed framing (4-byte big-endian) ----
-def _send_raw(sock: socket.socket, data: bytes):
+def _send_raw(sock: socket.socket, data: bytes, lossy: bool = True):
     """
     Gửi dữ liệu kèm chiều dài (4 byte). Control messages "Hello!" / "Ready!"
     sẽ luôn được gửi; các gói khác có thể bị drop với xác suất LOSS_RATE
-    để mô phỏng lỗi mạng.
+    để mô phỏng lỗi mạng (lossy=False để tắt, vd. header của một luồng).
     """
-    if data not in (b"Hello!", b"Ready!") and random.random() < config.LOSS_RATE:
-        warn("[SIM] Packet dropped (not sent)")
+    if lossy and data not in (b"Hello!", b"Ready!") and _dropped():
         return
-    sock.sendall(struct.pack("!I", len(data)) + data)
-
-def _recv_exact(sock: socket.socket, n: int) -> bytes:
-    buf = b""
-    while len(buf) < n:
-        chunk = sock.recv(n - len(buf))
-        if not chunk:
-            return b""
-        buf += chunk
-    return buf
-
-def _recv_raw(sock: socket.socket) -> bytes:
+    _sendv(sock, [struct.pack("!I", len(data)), data])
+
+def _dropped() -> bool:
+    if random.random() < config.LOSS_RATE:
+        metrics.count("packets_dropped")
+        warn("[SIM] Packet dropped (not sent)")
+        return True
+    return False
+
+@metrics.timed("net.send")
+def _sendv(sock: socket.socket, parts: list):
+    """Gửi nhiều mảnh liên tiếp không nối chuỗi (sendmsg scatter-gather nếu có)."""
+    if config.METRICS:
+        metrics.count("bytes_sent", sum(len(p) for p in parts))
+    if not hasattr(sock, "sendmsg"):             # Windows: không có sendmsg
+        sock.sendall(b"".join(parts)); return
+    views = [memoryview(p).cast("B") for p in parts if len(p)]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0]); views.pop(0)
+        if views:
+            views[0] = views[0][sent:]
+
+def _slices(parts: list, size: int):
+    """Chia các mảnh của một frame thành từng lát <= size byte (memoryview, không copy) để gửi theo nhịp token."""
+    piece, room = [], size
+    for p in parts:
+        view = memoryview(p).cast("B")
+        while len(view):
+            piece.append(view[:room]); n = min(room, len(view))
+            view, room = view[n:], room - n
+            if not room:
+                yield piece
+                piece, room = [], size
+    if piece:
+        yield piece
+
+def _recv_into(sock: socket.socket, view: memoryview) -> bool:
+    """Điền đầy `view` bằng recv_into (không tạo bytes trung gian); False nếu đóng giữa chừng."""
+    pos = 0
+    while pos < len(view):
+        n = sock.recv_into(view[pos:])
+        if not n:
+            return False
+        pos += n
+    return True
+
+def _recv_exact(sock: socket.socket, n: int, pool=None):
+    """Một lần cấp phát cho cả frame (hoặc dùng lại `pool`); trả về b"" khi kết nối đóng."""
+    view = pool.take(n) if pool else memoryview(bytearray(n))
+    if not _recv_into(sock, view):
+        return b""
+    metrics.count("bytes_recv", n)
+    return view if pool else view.obj
+
+def _check_size(size: int, gate):
+    """`gate` (admission.FrameGate, None = không giới hạn) từ chối frame -> ConnectionError trước khi cấp bộ đệm."""
+    if gate is not None:
+        gate.check(size)
+
+@metrics.timed("net.recv")
+def _recv_raw(sock: socket.socket, pool=None, gate=None):
     hdr = _recv_exact(sock, 4)
     if not hdr:
         return b""
     size = struct.unpack("!I", hdr)[0]
-    return _recv_exact(sock, size)
+    _check_size(size, gate)
+    return _recv_exact(sock, size, pool)
+
+class RecvBuffer:
+    """Bộ đệm nhận dùng lại giữa các frame; dữ liệu trả về chỉ hợp lệ tới lần nhận kế tiếp."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def take(self, n: int) -> memoryview:
+        if len(self.buf) < n:
+            self.buf = bytearray(n)
+        return memoryview(self.buf)[:n]
 
-def send_json(sock: socket.socket, obj: dict):
-    _send_raw(sock, json.dumps(obj).encode())
+def send_json(sock: socket.socket, obj: dict, lossy: bool = True):
+    _send_raw(sock, json.dumps(obj).encode(), lossy)
 
 def recv_json(sock: socket.socket) -> dict:
     data = _recv_raw(sock)
     return json.loads(data.decode()) if data else {}
+
+# ---- Binary frame: header cố định type (1) | flags (1) | length (4) ----
+FRAME_HDR   = struct.Struct("!BBI")
+FRAME_TYPES = ("KEY", "KEY-OK", "DATA", "ACK", "NACK", "DOWNLOAD",
+               "DATA-STREAM", "DATA-CHUNK", "DATA-END", "STREAM-OK", "CHUNK-ACK",
+               "LIST", "LIST-OK", "STAT", "STAT-OK", "STATS", "STATS-OK")
+_TYPE_ID    = {t: i + 1 for i, t in enumerate(FRAME_TYPES)}
+FLAG_RAW    = 0x01      # payload là bytes thô (DATA-CHUNK), không chia field
+
+# Field: name_len (1) | name | kind (1) | val_len (4) | value
+# kind: b=bytes thô, s=str UTF-8, i=int 64-bit, j=JSON (list/dict/None…)
+_FIELD_HDR = struct.Struct("!cI")
+
+def _pack_fields(obj: dict) -> list:
+    parts = []
+    for k, v in obj.items():
+        if k == "type":
+            continue
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            kind, val = b"b", v
+        elif isinstance(v, str):
+            kind, val = b"s", v.encode()
+        elif isinstance(v, int) and not isinstance(v, bool):
+            kind, val = b"i", struct.pack("!q", v)
+        else:
+            kind, val = b"j", json.dumps(v).encode()
+        name = k.encode()
+        parts += [bytes([len(name)]) + name + _FIELD_HDR.pack(kind, len(val)), val]
+    return parts
+
+def _unpack_fields(payload) -> dict:
+    """Field kiểu bytes được trả về dạng memoryview trỏ vào payload (không copy)."""
+    obj, pos, view = {}, 0, memoryview(payload)
+    while pos < len(payload):
+        n = payload[pos]; pos += 1
+        name = bytes(payload[pos:pos + n]).decode(); pos += n
+        kind, size = _FIELD_HDR.unpack_from(payload, pos); pos += _FIELD_HDR.size
+        val = view[pos:pos + size]; pos += size
+        if kind == b"s":   val = bytes(val).decode()
+        elif kind == b"i": val = struct.unpack("!q", val)[0]
+        elif kind == b"j": val = json.loads(bytes(val))
+        obj[name] = val
+    return obj
+
+def _frame_type(tid: int) -> str:
+    """Id trong header -> tên loại frame; id 0 / quá số loại đã biết -> ConnectionError (không để FRAME_TYPES[-1])."""
+    if not 1 <= tid <= len(FRAME_TYPES):
+        raise ConnectionError(f"unknown frame type id {tid}")
+    return FRAME_TYPES[tid - 1]
+
+@metrics.timed("net.recv")
+def recv_frame(sock: socket.socket, pool=None, gate=None):
+    """
+    Trả về (type, flags, payload) hoặc (None, 0, b"") khi kết nối đóng.
+    Chỉ frame FLAG_RAW mới nhận vào `pool`; frame có field luôn có bộ đệm riêng.
+    """
+    hdr = _recv_exact(sock, FRAME_HDR.size)
+    if not hdr:
+        return None, 0, b""
+    tid, flags, size = FRAME_HDR.unpack(hdr)
+    ftype = _frame_type(tid)
+    _check_size(size, gate)
+    payload = _recv_exact(sock, size, pool if flags & FLAG_RAW else None) if size else b""
+    if size and not payload:
+        return None, 0, b""
+    return ftype, flags, payload
+
+# ---- Chế độ JSON cũ: các field nhị phân đi dưới dạng base64 / hex ----
+_B64_FIELDS = ("iv", "cipher", "sig", "meta", "enc_sk", "ticket", "nonce", "digests")
+_HEX_FIELDS = ("hash",)
+
+def _to_json(obj: dict) -> dict:
+    out = dict(obj)
+    for k in _B64_FIELDS:
+        if k in out: out[k] = base64.b64encode(out[k]).decode()
+    for k in _HEX_FIELDS:
+        if k in out: out[k] = bytes(out[k]).hex()
+    return out
+
+def _from_json(obj: dict) -> dict:
+    for k in _B64_FIELDS:
+        if k in obj: obj[k] = base64.b64decode(obj[k])
+    for k in _HEX_FIELDS:
+        if k in obj: obj[k] = bytes.fromhex(obj[k])
+    return obj
+
+_RAW_MARK = b"\x00"
+
+# ---- Mã hoá / giải mã message, dùng chung cho Channel và AsyncChannel ----
+@metrics.timed("frame.encode")
+def _encode(obj: dict, binary: bool) -> list:
+    """Các mảnh (header + dữ liệu) của một frame message, chưa nối lại."""
+    if binary:
+        parts = _pack_fields(obj)
+        return [FRAME_HDR.pack(_TYPE_ID[obj["type"]], 0, sum(len(p) for p in parts))] + parts
+    data = json.dumps(_to_json(obj)).encode()
+    return [struct.pack("!I", len(data)), data]
+
+def _chunk_header(binary: bool, size: int) -> list:
+    if binary:
+        return [FRAME_HDR.pack(_TYPE_ID["DATA-CHUNK"], FLAG_RAW, size)]
+    return [struct.pack("!I", size + 1), _RAW_MARK]   # JSON không bao giờ bắt đầu bằng byte 0
+
+@metrics.timed("frame.decode")
+def _decode_json(data) -> dict:
+    if data[:1] == _RAW_MARK:
+        return {"type": "DATA-CHUNK", "data": data[1:]}
+    return _from_json(json.loads(bytes(data))) if data else {}
+
+@metrics.timed("frame.decode")
+def _decode_frame(ftype, flags, payload) -> dict:
+    if ftype is None:
+        return {}
+    if flags & FLAG_RAW:
+        return {"type": ftype, "data": payload}
+    obj = _unpack_fields(payload)
+    obj["type"] = ftype
+    return obj
+
+# ---- Channel: kết nối đã handshake, message là dict với field nhị phân kiểu bytes ----
+class Channel:
+    def __init__(self, sock: socket.socket, caps=()):
+        self.sock   = sock
+        self.caps   = set(caps)
+        self.binary = "bin" in self.caps
+        self.aead   = aead_of(caps)
+        self.codec  = codec_of(caps)
+        self.pool   = RecvBuffer()      # DATA-CHUNK dùng chung một bộ đệm
+        self.tx = self.rx = None        # admission.Bucket giới hạn tốc độ gửi / nhận (server gán, None = tự do)
+        self.gate   = None              # admission.FrameGate: kích thước frame được nhận (server gán)
+
+    def send(self, obj: dict, lossy: bool = True):
+        if lossy and _dropped():
+            return
+        self._write(_encode(obj, self.binary))
+
+    def recv(self) -> dict:
+        """
+        Message điều khiển -> dict. DATA-CHUNK -> {"type": "DATA-CHUNK", "data": memoryview}
+        trỏ vào bộ đệm dùng chung, phải xử lý xong trước lần recv() kế tiếp.
+        """
+        if not self.binary:
+            data = _recv_raw(self.sock, self.pool, self.gate)
+            msg  = _decode_json(data)
+        else:
+            ftype, flags, data = recv_frame(self.sock, self.pool, self.gate)
+            msg = _decode_frame(ftype, flags, data)
+        if self.rx and (wait := self.rx.take(len(data))) > 0:
+            time.sleep(wait)             # đọc chậm lại -> TCP bên gửi tự giảm tốc
+        return msg
+
+    def send_chunk(self, *parts, lossy: bool = True):
+        """DATA-CHUNK: các mảnh bytes thô ghép liền (không base64/JSON) trong một frame."""
+        if lossy and _dropped():
+            return
+        self._write(_chunk_header(self.binary, sum(len(p) for p in parts)) + list(parts))
+
+    def _write(self, parts: list):
+        if not self.tx:
+            _sendv(self.sock, parts); return
+        for piece in _slices(parts, self.tx.burst):
+            if (wait := self.tx.take(sum(len(p) for p in piece))) > 0:
+                time.sleep(wait)
+            _sendv(self.sock, piece)
+
+    def settimeout(self, t):
+        self.sock.settimeout(t)
+
+    def close(self):
+        self.sock.close()
+
+# ---- Chạy cùng một flow `async def` trên engine thread (blocking) lẫn asyncio ----
+class _Ready:
+    """Awaitable đã có sẵn kết quả: `await` trả về ngay, không nhường event loop."""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        return self.value
+        yield
+
+class AwaitableChannel:
+    """Bọc Channel blocking cho các flow `async def`: I/O chạy ngay trên thread hiện tại (xem run_sync)."""
+
+    def __init__(self, ch: Channel):
+        self.ch     = ch
+        self.caps   = ch.caps
+        self.binary = ch.binary
+        self.aead   = ch.aead
+        self.codec  = ch.codec
+        self.gate   = ch.gate
+
+    def send(self, obj: dict, lossy: bool = True):
+        return _Ready(self.ch.send(obj, lossy))
+
+    def send_chunk(self, *parts, lossy: bool = True):
+        return _Ready(self.ch.send_chunk(*parts, lossy=lossy))
+
+    def recv(self):
+        return _Ready(self.ch.recv())
+
+    def run(self, fn, *args):
+        """Việc nặng (RSA / AES / đĩa): ở chế độ blocking chạy thẳng."""
+        return _Ready(fn(*args))
+
+    def settimeout(self, t):
+        self.ch.settimeout(t)
+
+def run_sync(coro):
+    """Chạy hết một coroutine chỉ await AwaitableChannel (không cần event loop)."""
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    raise RuntimeError("coroutine suspended outside an event loop")
+
+class AsyncChannel:
+    """Channel trên asyncio streams: cùng giao diện với AwaitableChannel, việc nặng đẩy sang `executor`."""
+
+    def __init__(self, reader, writer, caps=(), executor=None):
+        self.reader   = reader
+        self.writer   = writer
+        self.caps     = set(caps)
+        self.binary   = "bin" in self.caps
+        self.aead     = aead_of(caps)
+        self.codec    = codec_of(caps)
+        self.executor = executor
+        self.timeout  = config.TIMEOUT
+        self.tx = self.rx = None
+        self.gate     = None
+
+    async def _write(self, parts: list):
+        if config.METRICS:
+            metrics.count("bytes_sent", sum(len(p) for p in parts))
+        for piece in _slices(parts, self.tx.burst) if self.tx else (parts,):
+            if self.tx and (wait := self.tx.take(sum(len(p) for p in piece))) > 0:
+                await asyncio.sleep(wait)
+            with metrics.timer("net.send"):
+                self.writer.writelines(piece)
+                await self.writer.drain()
+
+    async def send(self, obj: dict, lossy: bool = True):
+        if lossy and _dropped():
+            return
+        await self._write(_encode(obj, self.binary))
+
+    async def send_chunk(self, *parts, lossy: bool = True):
+        if lossy and _dropped():
+            return
+        await self._write(_chunk_header(self.binary, sum(len(p) for p in parts)) + list(parts))
+
+    async def recv(self) -> dict:
+        try:
+            msg, size = await asyncio.wait_for(self._recv(), self.timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout("timed out") from None
+        if self.rx and (wait := self.rx.take(size)) > 0:
+            await asyncio.sleep(wait)    # chờ token ngoài hạn timeout của lần nhận
+        return msg
+
+    async def _recv(self) -> tuple:
+        r = self.reader
+        try:
+            if not self.binary:
+                size = struct.unpack("!I", await r.readexactly(4))[0]
+                _check_size(size, self.gate)
+                metrics.count("bytes_recv", 4 + size)
+                return _decode_json(await r.readexactly(size)), size
+            tid, flags, size = FRAME_HDR.unpack(await r.readexactly(FRAME_HDR.size))
+            ftype = _frame_type(tid)
+            _check_size(size, self.gate)
+            metrics.count("bytes_recv", FRAME_HDR.size + size)
+            return _decode_frame(ftype, flags, await r.readexactly(size)), size
+        except asyncio.IncompleteReadError:
+            return {}, 0
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def settimeout(self, t):
+        self.timeout = t
+
+# ---- Phiên bền (tính năng "mux"): nhiều yêu cầu KEY / DOWNLOAD song song trên một kết nối ----
+# Mỗi message mang trường "rid"; DATA-CHUNK mang rid ở 4 byte đầu payload.
+RID       = struct.Struct("!I")
+_STARTERS = ("KEY", "DOWNLOAD", "LIST", "STAT", "STATS")
+
+def _demux(msg: dict) -> tuple:
+    """(rid, message); DATA-CHUNK được chép khỏi bộ đệm dùng chung vì kênh con xử lý sau."""
+    if msg.get("type") == "DATA-CHUNK":
+        data = msg["data"]
+        return RID.unpack_from(data)[0], {"type": "DATA-CHUNK", "data": bytes(data[RID.size:])}
+    return msg.pop("rid", 0), msg
+
+class MuxChannel:
+    """Kênh con (một rid) của Mux: cùng giao diện với Channel, nhận qua hàng đợi do thread đọc nạp vào."""
+
+    def __init__(self, mux, rid: int):
+        self.mux     = mux
+        self.rid     = rid
+        self.caps    = mux.ch.caps
+        self.binary  = mux.ch.binary
+        self.aead    = mux.ch.aead
+        self.codec   = mux.ch.codec
+        self.gate    = mux.ch.gate       # frame do pump() của cả kết nối nhận -> dùng chung gate
+        self.inbox   = queue.Queue()
+        self.timeout = config.TIMEOUT
+
+    def send(self, obj: dict, lossy: bool = True):
+        self.mux.send(dict(obj, rid=self.rid), lossy)
+
+    def send_chunk(self, *parts, lossy: bool = True):
+        self.mux.send_chunk(RID.pack(self.rid), *parts, lossy=lossy)
+
+    def recv(self) -> dict:
+        try:
+            return self.inbox.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out") from None
+
+    def settimeout(self, t):
+        self.timeout = t
+
+    def close(self):
+        self.mux.subs.pop(self.rid, None)
+
+class Mux:
+    """
+    Chia một Channel blocking cho nhiều kênh con: pump() đọc socket và chuyển message tới kênh con
+    theo rid; KEY / DOWNLOAD với rid mới tạo kênh con và gọi `on_request(sub)` (phía server).
+    Đã có `max_subs` kênh con đang chạy -> yêu cầu mới nhận ngay gói `busy` (kèm rid), không tạo thread.
+    """
+
+    def __init__(self, ch: Channel, on_request=None, max_subs: int = 0, busy: dict = None):
+        self.ch         = ch
+        self.on_request = on_request
+        self.max_subs   = max_subs       # 0 = không giới hạn
+        self.busy       = busy
+        self.subs       = {}
+        self.closed     = False          # pump() đã dừng: kết nối đóng / hết SESSION_IDLE
+        self._lock      = threading.Lock()
+        self._rids      = itertools.count(1)
+
+    def open(self) -> MuxChannel:
+        sub = MuxChannel(self, next(self._rids))
+        self.subs[sub.rid] = sub
+        return sub
+
+    def send(self, obj: dict, lossy: bool = True):
+        with self._lock:
+            self.ch.send(obj, lossy)
+
+    def send_chunk(self, *parts, lossy: bool = True):
+        with self._lock:
+            self.ch.send_chunk(*parts, lossy=lossy)
+
+    def start(self):
+        threading.Thread(target=self.pump, daemon=True).start()
+        return self
+
+    def pump(self):
+        """Đọc tới khi kết nối đóng, hoặc rảnh quá SESSION_IDLE giây mà không còn yêu cầu nào."""
+        self.ch.settimeout(config.SESSION_IDLE)
+        while True:
+            try:
+                msg = self.ch.recv()
+            except socket.timeout:
+                if self.subs:
+                    continue
+                msg = {}
+            except OSError:
+                msg = {}
+            if not msg:
+                self.closed = True
+                for sub in list(self.subs.values()):
+                    sub.inbox.put({})
+                return
+            rid, msg = _demux(msg)
+            sub = self.subs.get(rid)
+            if sub is None and self.on_request and msg.get("type") in _STARTERS:
+                if self.max_subs and len(self.subs) >= self.max_subs:
+                    metrics.count("busy_streams")
+                    self.send(dict(self.busy, rid=rid), lossy=False); continue
+                sub = self.subs[rid] = MuxChannel(self, rid)
+                sub.inbox.put(msg)
+                self.on_request(sub)
+            elif sub is not None:
+                sub.inbox.put(msg)       # message của rid đã xong (ACK trùng…) bị bỏ qua
+
+class AsyncMuxChannel:
+    """Kênh con của AsyncMux: cùng giao diện với AsyncChannel."""
+
+    def __init__(self, mux, rid: int):
+        self.mux     = mux
+        self.rid     = rid
+        self.caps    = mux.ch.caps
+        self.binary  = mux.ch.binary
+        self.aead    = mux.ch.aead
+        self.codec   = mux.ch.codec
+        self.gate    = mux.ch.gate
+        self.inbox   = asyncio.Queue()
+        self.timeout = config.TIMEOUT
+
+    async def send(self, obj: dict, lossy: bool = True):
+        await self.mux.ch.send(dict(obj, rid=self.rid), lossy)
+
+    async def send_chunk(self, *parts, lossy: bool = True):
+        await self.mux.ch.send_chunk(RID.pack(self.rid), *parts, lossy=lossy)
+
+    async def recv(self) -> dict:
+        try:
+            return await asyncio.wait_for(self.inbox.get(), self.timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout("timed out") from None
+
+    async def run(self, fn, *args):
+        return await self.mux.ch.run(fn, *args)
+
+    def settimeout(self, t):
+        self.timeout = t
+
+    def close(self):
+        self.mux.subs.pop(self.rid, None)
+
+class AsyncMux:
+    """Như Mux nhưng trên AsyncChannel: pump() là coroutine, `on_request(sub)` thường tạo task mới."""
+
+    def __init__(self, ch: AsyncChannel, on_request, max_subs: int = 0, busy: dict = None):
+        self.ch         = ch
+        self.on_request = on_request
+        self.max_subs   = max_subs
+        self.busy       = busy
+        self.subs       = {}
+
+    async def pump(self):
+        self.ch.settimeout(config.SESSION_IDLE)
+        while True:
+            try:
+                msg = await self.ch.recv()
+            except socket.timeout:
+                if self.subs:
+                    continue
+                msg = {}
+            except OSError:
+                msg = {}
+            if not msg:
+                for sub in list(self.subs.values()):
+                    sub.inbox.put_nowait({})
+                return
+            rid, msg = _demux(msg)
+            sub = self.subs.get(rid)
+            if sub is None and msg.get("type") in _STARTERS:
+                if self.max_subs and len(self.subs) >= self.max_subs:
+                    metrics.count("busy_streams")
+                    await self.ch.send(dict(self.busy, rid=rid), lossy=False); continue
+                sub = self.subs[rid] = AsyncMuxChannel(self, rid)
+                sub.inbox.put_nowait(msg)
+                self.on_request(sub)
+            elif sub is not None:
+                sub.inbox.put_nowait(msg)
+
+# ---- Phần client ký của yêu cầu không mang khoá phiên (DOWNLOAD / LIST / STAT / STATS) ----
+def request_subject(req: dict) -> bytes:
+    """DOWNLOAD ký tên file (như cũ); các loại khác có tiền tố loại để chữ ký không dùng lại được cho loại khác."""
+    if req["type"] == "DOWNLOAD" and "offset" in req:
+        return b"RANGE\0" + json.dumps([req["file"], req["offset"], req.get("length")]).encode()
+    if req["type"] == "DOWNLOAD":
+        return req["file"].encode()
+    if req["type"] == "STAT":
+        return b"STAT\0" + req["file"].encode()
+    if req["type"] == "STATS":
+        return b"STATS"
+    return b"LIST\0" + json.dumps([req.get("prefix", ""), req.get("after", ""), req.get("limit", 0)]).encode()
+
+# ---- Handshake Hello/Ready + đàm phán tính năng ("Hello! bin" -> "Ready! bin") ----
+AEAD_CAPS  = ("gcm", "chacha")
+CODEC_CAPS = ("zlib", "lzma")
+
+def supported_caps(mux: bool = True) -> tuple:
+    """Tính năng phía này hỗ trợ; client chỉ đề nghị "mux" khi cần phiên bền (chế độ lô)."""
+    return ((("bin",) if config.BINARY_FRAMES else ()) + tuple(c for c in config.AEAD if c in AEAD_CAPS)
+            + tuple(c for c in config.COMPRESS if c in CODEC_CAPS) + (("mux",) if mux else ()))
+
+def aead_of(caps):
+    """AEAD đã thống nhất: cái đầu tiên theo thứ tự client đề nghị, None = AES-CBC + SHA-512."""
+    return next((c for c in caps if c in AEAD_CAPS), None)
+
+def codec_of(caps):
+    """Codec nén chunk đã thống nhất (None = không nén); file cụ thể có nén hay không ghi trong meta."""
+    return next((c for c in caps if c in CODEC_CAPS), None)
+
+def _with_caps(word: bytes, caps) -> bytes:
+    return word + (b" " + ",".join(caps).encode() if caps else b"")
+
+def _parse_caps(data: bytes) -> list:
+    return [c for c in bytes(data).decode().strip().split(",") if c]
+
+def _agree(hello, caps):
+    """Danh sách tính năng chung, hoặc None nếu không phải Hello!."""
+    if hello[:6] != b"Hello!":
+        return None
+    return [c for c in _parse_caps(hello[6:]) if c in caps]
+
+class Busy(ConnectionError):
+    """Server quá tải (trả "Busy! <ms>" thay cho "Ready!", hoặc NACK err=busy): thử lại sau `retry_after` giây."""
+
+    def __init__(self, retry_after: float = 1.0):
+        super().__init__(f"server busy, retry in {retry_after:g}s")
+        self.retry_after = retry_after
+
+def busy_reply(retry_after: float) -> bytes:
+    return b"Busy! " + str(int(retry_after * 1000)).encode()
+
+def client_handshake(sock: socket.socket, caps=None):
+    """Gửi Hello! kèm tính năng đề nghị; trả về Channel, None nếu server từ chối, raise Busy nếu server quá tải."""
+    caps = supported_caps(mux=False) if caps is None else caps
+    _send_raw(sock, _with_caps(b"Hello!", caps), lossy=False)
+    reply = _recv_raw(sock)
+    if reply[:5] == b"Busy!":
+        sock.close()
+        raise Busy(int(bytes(reply[5:]).strip() or 1000) / 1000)
+    if reply[:6] != b"Ready!":
+        return None
+    return Channel(sock, _parse_caps(reply[6:]))
+
+def server_handshake(sock: socket.socket, caps=None, busy: float = 0):
+    """
+    Chờ Hello!; client cũ gửi đúng "Hello!" sẽ nhận "Ready!" và dùng JSON.
+    busy > 0: server không nhận thêm phiên -> trả "Busy! <ms>" (client thử lại sau busy giây), trả về None.
+    """
+    agreed = _agree(_recv_raw(sock), supported_caps() if caps is None else caps)
+    if agreed is None:
+        return None
+    if busy:
+        _send_raw(sock, busy_reply(busy), lossy=False); return None
+    _send_raw(sock, _with_caps(b"Ready!", agreed), lossy=False)
+    return Channel(sock, agreed)
+
+async def async_server_handshake(reader, writer, caps=None, executor=None, busy: float = 0):
+    """Như server_handshake nhưng trên asyncio streams; trả về AsyncChannel hoặc None."""
+    try:
+        size  = struct.unpack("!I", await asyncio.wait_for(reader.readexactly(4), config.TIMEOUT))[0]
+        hello = await asyncio.wait_for(reader.readexactly(size), config.TIMEOUT)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+    agreed = _agree(hello, supported_caps() if caps is None else caps)
+    if agreed is None:
+        return None
+    ready = busy_reply(busy) if busy else _with_caps(b"Ready!", agreed)
+    writer.write(struct.pack("!I", len(ready)) + ready)
+    await writer.drain()
+    return None if busy else AsyncChannel(reader, writer, agreed, executor)
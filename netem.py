@@ -0,0 +1,150 @@
+# netem.py – Proxy TCP giả lập mạng WAN trên localhost (asyncio): trễ, jitter, băng thông, mất segment, reset
+#
+# TCP thật không làm mất byte: segment "mất" được phát lại sau RTO (lùi lũy thừa nếu mất tiếp), nên mất gói hiện ra
+# thành trễ + chặn đầu hàng như trên mạng thật, luồng frame không bị lệch như LOSS_RATE của net_utils. Mọi quyết định
+# ngẫu nhiên lấy từ random.Random(seed / số thứ tự kết nối / chiều) -> cùng seed, cùng thứ tự kết nối = cùng kết quả.
+# Run: python server.py --port 9001 --loss 0
+#      python netem.py --target 9001 --profile wan          (nghe ở config.PORT: client.py không cần đổi)
+#      python client.py --mode upload --file video.mp4 --loss 0
+#      python netem.py --target 9001 --delay 80 --jitter 20 --rate 10 --loss 0.02 --reset 0.001 --seed 7
+import argparse, asyncio, itertools, random, socket
+import config, net_utils as nu
+
+# delay / jitter: ms một chiều; rate: Mbit/s mỗi chiều của mỗi kết nối (0 = không giới hạn); loss: xác suất mỗi segment;
+# reset: xác suất mỗi segment làm đứt cả kết nối (RST)
+PROFILES = {
+    "lan":   dict(delay=0.5, jitter=0.1, rate=1000, loss=0,     reset=0),
+    "wan":   dict(delay=40,  jitter=5,   rate=50,   loss=0.001, reset=0),
+    "dsl":   dict(delay=25,  jitter=8,   rate=8,    loss=0.005, reset=0),
+    "3g":    dict(delay=150, jitter=40,  rate=2,    loss=0.02,  reset=0),
+    "flaky": dict(delay=60,  jitter=30,  rate=10,   loss=0.05,  reset=0.0005),
+}
+SHAPE = ("delay", "jitter", "rate", "loss", "byte_loss", "reset", "rto", "mss")
+DEFAULTS = dict(delay=0, jitter=0, rate=0, loss=0, byte_loss=0, reset=0, rto=200, mss=1448)
+
+class Reset(Exception):
+    """Segment trúng xác suất reset: đóng cả hai phía bằng RST."""
+
+async def pipe(src: asyncio.StreamReader, dst: asyncio.StreamWriter, opt, rng: random.Random, st: dict):
+    """
+    Chép src -> dst từng segment (<= mss byte). Segment chiếm link len*8/rate giây (đọc chậm lại -> TCP bên gửi
+    tự giảm tốc), tới nơi sau delay ± jitter (+ RTO mỗi lần "mất"); không bao giờ đảo thứ tự.
+    """
+    loop  = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def deliver():
+        while (item := await queue.get()) is not None:
+            at, data = item
+            if (wait := at - loop.time()) > 0:
+                await asyncio.sleep(wait)
+            dst.write(data)
+            await dst.drain()
+        if dst.can_write_eof():
+            dst.write_eof()              # half-close như đầu bên kia
+
+    task = asyncio.create_task(deliver())
+    link_free = last_at = loop.time()
+    try:
+        while data := await src.read(opt.mss):
+            if task.done():
+                task.result()            # phía nhận đã lỗi (đóng / reset) -> dừng chiều này
+            now = loop.time()
+            if opt.rate:
+                if link_free < now - 0.01:   # link rảnh -> lịch mới; không thì nối tiếp (sleep trễ không cộng dồn)
+                    link_free = now
+                link_free += len(data) * 8 / (opt.rate * 1e6)
+                if link_free - now > 0.002:
+                    await asyncio.sleep(link_free - now)
+                now = link_free
+            if opt.reset and rng.random() < opt.reset:
+                st["resets"] += 1
+                raise Reset()
+            at = now + max(0.0, opt.delay + (rng.gauss(0, opt.jitter) if opt.jitter else 0)) / 1000
+            p_loss = 1 - (1 - opt.loss) * (1 - opt.byte_loss) ** len(data)
+            rto = opt.rto / 1000
+            while p_loss and rng.random() < p_loss:
+                st["lost"] += 1
+                at += rto; rto *= 2
+            last_at = max(at, last_at)
+            queue.put_nowait((last_at, data))
+            st["bytes"] += len(data)
+    except BaseException:
+        task.cancel()
+        raise
+    queue.put_nowait(None)               # EOF: giao nốt các segment còn trên "đường truyền" rồi half-close
+    await task
+
+def _nodelay(writer: asyncio.StreamWriter):
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)   # không để Nagle cộng thêm trễ
+
+async def serve(opt):
+    conns  = itertools.count(1)
+    totals = {"up": {"bytes": 0, "lost": 0, "resets": 0}, "down": {"bytes": 0, "lost": 0, "resets": 0}}
+
+    async def handle(c_reader, c_writer):
+        n = next(conns)
+        try:
+            s_reader, s_writer = await asyncio.open_connection(opt.target_host, opt.target)
+        except OSError as e:
+            nu.warn(f"[NETEM] #{n}: target unreachable ({e})"); c_writer.close(); return
+        for w in (c_writer, s_writer):
+            _nodelay(w)
+        st = {d: {"bytes": 0, "lost": 0, "resets": 0} for d in ("up", "down")}
+        up   = asyncio.create_task(pipe(c_reader, s_writer, opt, random.Random(f"{opt.seed}/{n}/up"), st["up"]))
+        down = asyncio.create_task(pipe(s_reader, c_writer, opt, random.Random(f"{opt.seed}/{n}/down"), st["down"]))
+        pending = {up, down}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(isinstance(t.exception(), (Reset, OSError)) for t in done):
+                for w in (c_writer, s_writer):
+                    w.transport.abort()  # RST cho cả hai phía, chiều còn lại sẽ kết thúc vì lỗi đọc
+        for w in (c_writer, s_writer):
+            w.close()
+        for d in st:
+            for k in st[d]:
+                totals[d][k] += st[d][k]
+        nu.info(f"[NETEM] #{n} up {st['up']['bytes']:,} B / down {st['down']['bytes']:,} B, "
+                f"lost {st['up']['lost']}+{st['down']['lost']} segment"
+                + (", RESET" if st["up"]["resets"] or st["down"]["resets"] else ""))
+
+    srv = await asyncio.start_server(handle, config.HOST, opt.listen)
+    nu.info(f"[NETEM] {config.HOST}:{opt.listen} -> {opt.target_host}:{opt.target}  "
+            + "  ".join(f"{k}={getattr(opt, k):g}" for k in SHAPE) + f"  seed={opt.seed}")
+    try:
+        async with srv:
+            await srv.serve_forever()
+    finally:
+        nu.info(f"[NETEM] total up {totals['up']['bytes']:,} B / down {totals['down']['bytes']:,} B, "
+                f"lost {totals['up']['lost'] + totals['down']['lost']} segment, "
+                f"{totals['up']['resets'] + totals['down']['resets']} reset(s)")
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Proxy TCP giả lập mạng giữa client.py và server.py")
+    ap.add_argument("--listen", type=int, default=config.PORT, help="cổng nghe (mặc định config.PORT)")
+    ap.add_argument("--target", type=int, required=True, help="cổng server thật (server.py --port)")
+    ap.add_argument("--target-host", default=config.HOST)
+    ap.add_argument("--profile", choices=sorted(PROFILES), help="bộ thông số có sẵn; tham số riêng ghi đè")
+    ap.add_argument("--delay", type=float, help="trễ một chiều, ms")
+    ap.add_argument("--jitter", type=float, help="độ lệch chuẩn của trễ, ms (không đảo thứ tự)")
+    ap.add_argument("--rate", type=float, help="băng thông mỗi chiều, Mbit/s (0 = không giới hạn)")
+    ap.add_argument("--loss", type=float, help="xác suất mất mỗi segment (phát lại sau RTO)")
+    ap.add_argument("--byte-loss", type=float, help="xác suất mất theo byte (segment dài mất nhiều hơn)")
+    ap.add_argument("--reset", type=float, help="xác suất mỗi segment làm đứt kết nối (RST)")
+    ap.add_argument("--rto", type=float, help="thời gian chờ phát lại segment mất, ms (gấp đôi mỗi lần mất tiếp)")
+    ap.add_argument("--mss", type=int, help="kích thước segment tối đa, byte")
+    ap.add_argument("--seed", type=int, default=1)
+    opt = ap.parse_args(argv)
+    base = {**DEFAULTS, **PROFILES.get(opt.profile, {})}
+    for k in SHAPE:
+        if getattr(opt, k) is None:
+            setattr(opt, k, base[k])
+    return opt
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
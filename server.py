@@ -1,118 +1,572 @@
 # server.py – Cloud simulation server
-# Run: python server.py
-import base64, json, os, socket, threading, time
+# Run: python server.py                  (mỗi kết nối một thread)
+#      python server.py --engine asyncio  (event loop + thread pool cho RSA/AES/đĩa)
+#      python server.py --crypto-procs 4  (RSA khoá riêng chạy trên 4 tiến trình)
+#      python server.py --metrics 9100    (đo đạc, text Prometheus tại http://HOST:9100/metrics)
+#      python server.py --port 9001 --loss 0  (sau proxy netem.py, xem netem.py)
+#      python server.py --max-sessions 32 --rate-out 50 --conn-rate 10  (BUSY khi quá tải, chia băng thông MB/s)
+import argparse, asyncio, json, os, socket, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import config, net_utils as nu
-from crypto_utils import CryptoUtils
+import admission, config, metrics, net_utils as nu, storage, stream_utils as su
+from crypto_utils import CryptoUtils, SessionTickets, keys
 from ui_utils import print_requirement_table
 
-print_requirement_table()
+PARTIAL_DIR = Path(config.STORAGE_DIR, ".partial")
+SEAL_OVERHEAD = 32                       # byte ciphertext DATA lớn hơn plaintext: padding AES-CBC / tag AEAD
+FRAME_SLACK   = 64 * 1024                # byte frame DATA ngoài ciphertext: meta, chữ ký, iv, hash, header field
+streams = {}                             # token -> PartialFile đang nhận (cho các kết nối "join")
+store   = None                           # storage.ChunkStore, tạo trong main()
+tickets = None                           # SessionTickets, tạo trong main()
+sessions = memory = None                 # admission.Budget / AsyncBudget (theo engine): phiên đồng thời, byte trong RAM
+links   = None                           # (Link gửi, Link nhận) khi bật giới hạn băng thông
 
-# --- Khởi tạo khóa & thư mục lưu trữ ---
-server_priv, server_pub = CryptoUtils.load_or_create_rsa("server")
-client_priv, client_pub = CryptoUtils.load_or_create_rsa("client")
-Path(config.STORAGE_DIR).mkdir(exist_ok=True)
+# --- Xử lý một phiên đã handshake (chung cho cả hai engine) ---
+async def serve(ch):
+    pkt = await ch.recv()
+    master = None
+    if pkt.get("ticket"):
+        master = await ch.run(tickets.open, pkt["ticket"])
+        if master is None:               # vé hết hạn / không hợp lệ -> client làm lại bằng RSA
+            await ch.send({"type": "NACK", "err": "ticket"}, lossy=False)
+            pkt = await ch.recv()
+            if pkt.get("ticket"):
+                return
+    kind = pkt.get("type")
+    # tên metric Prometheus chỉ được [a-z0-9_]; loại lạ (JSON cũ) gộp chung, không sinh metric mới theo ý client
+    metrics.count("requests_" + (kind.lower().replace("-", "_") if kind in nu.FRAME_TYPES
+                                 else "other" if kind else "empty"))
+    if kind == "KEY":
+        # DATA trọn gói: client báo trước kích thước -> giữ chỗ RAM trước khi nhận; không báo (client cũ)
+        # -> giữ ADMIT_DEFAULT, header frame lớn hơn thì giữ thêm (grow); DATA-STREAM trả lại ngay
+        size   = pkt.get("size")
+        legacy = not (is_int(size) and size >= 0)
+        held   = [config.ADMIT_DEFAULT if legacy else size]   # các phần đã giữ chỗ, trả lại từng phần
 
-# --- Hàm xử lý mỗi kết nối ---
-def handle(conn: socket.socket):
-    conn.settimeout(config.TIMEOUT)
-    try:
-        # Handshake
-        if nu._recv_raw(conn) != b"Hello!":
-            conn.close(); return
-        nu._send_raw(conn, b"Ready!")
-
-        pkt = nu.recv_json(conn)
-        if pkt.get("type") == "KEY":
-            upload_flow(conn, pkt)
-        elif pkt.get("type") == "DOWNLOAD":
-            download_flow(conn, pkt)
-    except Exception as e:
-        nu.warn(f"[EX] {e}")
-    finally:
-        conn.close()
+        def grow(n: int) -> bool:
+            extra = n - sum(held)
+            if extra > 0 and not memory.try_acquire(extra):
+                return False
+            held.append(max(extra, 0))
+            return True
 
-# --- Upload flow ---
-def upload_flow(conn, key_pkt):
-    try:
-        sk = CryptoUtils.rsa_decrypt(server_priv,
-                                     base64.b64decode(key_pkt["enc_sk"]))
-    except Exception:
-        nu.send_json(conn, {"type": "NACK"}); return
+        if held[0] and not await memory.admit(held[0], config.ADMIT_WAIT):
+            await ch.send(busy()); return
+        grant = ch.gate.grant(frame_bytes(ch, held[0]), grow if legacy else None) if ch.gate else None
+        try:                             # grant mở trước KEY-OK: DATA tới ngay sau
+            with metrics.timer("server.upload"):
+                await upload_flow(ch, pkt, master, held)
+        finally:
+            for n in held:
+                memory.release(n)
+            if grant:
+                ch.gate.revoke(grant)
+    elif kind == "DOWNLOAD":
+        with metrics.timer("server.download"):
+            await download_flow(ch, pkt, master)
+    elif kind in ("LIST", "STAT", "STATS"):
+        with metrics.timer("server.browse"):
+            await browse_flow(ch, pkt, master)
+
+# --- Kiểm soát tải: BUSY, byte trong RAM, băng thông mỗi kết nối ---
+def busy() -> dict:
+    """Trả lời yêu cầu không có chỗ trong hạn ADMIT_WAIT: client chờ `retry` ms rồi thử lại."""
+    return {"type": "NACK", "err": "busy", "retry": int(config.BUSY_RETRY * 1000)}
+
+def shape(ch):
+    """
+    Kết nối vừa handshake: frame quá MAX_CONTROL chỉ được nhận khi khớp phần RAM một KEY đã giữ chỗ (FrameGate),
+    gắn token bucket gửi / nhận (khi có giới hạn băng thông).
+    """
+    if ch is not None:
+        ch.gate = admission.FrameGate(config.MAX_CONTROL, config.MAX_FRAME)
+        if links:
+            ch.tx, ch.rx = admission.Bucket(links[0]), admission.Bucket(links[1])
+    return ch
+
+def frame_bytes(ch, n: int) -> int:
+    """Kích thước frame DATA mang `n` byte plaintext (JSON cũ: base64 dài hơn 4/3)."""
+    return (n if ch.binary else n * 4 // 3) + SEAL_OVERHEAD + FRAME_SLACK
+
+def is_int(x) -> bool:
+    """Số nguyên thật từ gói tin (bool cũng là int trong Python nhưng không phải kích thước / vị trí hợp lệ)."""
+    return isinstance(x, int) and not isinstance(x, bool)
+
+def load_stats() -> dict:
+    """Độ sâu hàng đợi, thời gian chờ, số lần BUSY, tốc độ chia cho mỗi kết nối – cho STATS và /metrics."""
+    out = {"sessions": sessions.stats(), "memory": memory.stats()}
+    if links:
+        out.update(rate_out=links[0].stats(), rate_in=links[1].stats())
+    return out
+
+# --- Vé phiên: master = HKDF(khoá phiên của lần truyền RSA đã xác thực) ---
+def new_ticket(sk: bytes, master) -> dict:
+    """Cấp vé sau một lần truyền RSA đã xác thực client (phiên nối lại bằng vé thì giữ vé cũ)."""
+    if master is not None:
+        return {}
+    return {"ticket": tickets.issue(CryptoUtils.derive_key(sk, info=b"resumption"))}
+
+async def verify_client(ch, sk: bytes, master, sig, data) -> bool:
+    if master is not None:
+        return CryptoUtils.hmac_verify(sk, sig, data)
+    return await ch.run(CryptoUtils.rsa_verify, keys.pub("client"), sig, data)
+
+async def verify_request(ch, pkt, master) -> bool:
+    """Chữ ký client trên DOWNLOAD / LIST / STAT: HMAC bằng khoá suy từ vé, không có vé thì RSA."""
+    subject = nu.request_subject(pkt)
+    if master is not None:
+        return CryptoUtils.hmac_verify(CryptoUtils.derive_key(master, pkt["nonce"], b"auth"), pkt["sig"], subject)
+    return await ch.run(CryptoUtils.rsa_verify, keys.pub("client"), pkt["sig"], subject)
+
+def signed_by(pkt, master) -> dict:
+    """Bằng chứng người upload lưu vào chỉ mục: meta đã ký + chữ ký (RSA, hoặc HMAC khi dùng vé phiên)."""
+    return {"meta": pkt["meta"], "sig": pkt["sig"], "auth": "rsa" if master is None else "hmac"}
 
-    nu.send_json(conn, {"type": "KEY-OK"})
+async def sign_server(ch, sk: bytes, master, data) -> bytes:
+    if master is not None:
+        return CryptoUtils.hmac_sha512(sk, data)
+    return await ch.run(CryptoUtils.rsa_sign, keys.priv("server"), data)
+
+# --- Upload flow ---
+async def upload_flow(ch, key_pkt, master=None, held=None):
+    """`held`: các phần byte RAM đã giữ chỗ cho DATA trọn gói – DATA-STREAM trả lại, DATA lớn hơn tổng bị từ chối."""
+    if master is not None:               # vé phiên: khoá = HKDF(master, nonce client + nonce server)
+        nonce = os.urandom(16)
+        sk = CryptoUtils.derive_key(master, bytes(key_pkt["nonce"]) + nonce)
+        await ch.send({"type": "KEY-OK", "nonce": nonce})
+    else:
+        try:
+            with metrics.timer("server.upload.key"):
+                sk = await ch.run(CryptoUtils.rsa_decrypt, keys.priv("server"), key_pkt["enc_sk"])
+        except Exception:
+            await ch.send({"type": "NACK"}); return
+        await ch.send({"type": "KEY-OK"})
 
     # Mở rộng cửa sổ chờ (reties)
-    conn.settimeout(config.TIMEOUT * (config.MAX_RETRY + 1))
+    ch.settimeout(config.TIMEOUT * (config.MAX_RETRY + 1))
     try:
-        data_pkt = nu.recv_json(conn)
+        with metrics.timer("server.upload.wait_data"):
+            data_pkt = await ch.recv()
     except socket.timeout:
         nu.warn("[TIMEOUT] No DATA received"); return
+    if data_pkt.get("type") == "DATA-STREAM":
+        if held:                         # luồng chỉ giữ vài chunk trong RAM
+            for n in held:
+                memory.release(n)
+            held[:] = ()
+        await upload_stream_flow(ch, sk, master, data_pkt); return
     if data_pkt.get("type") != "DATA":
         return
+    if held is not None and len(data_pkt.get("cipher", b"")) > sum(held) + SEAL_OVERHEAD:
+        nu.warn(f"[SIZE] DATA larger than declared ({sum(held)} bytes)")
+        await ch.send({"type": "NACK", "err": "size"}); return
 
-    iv     = base64.b64decode(data_pkt["iv"])
-    cipher = base64.b64decode(data_pkt["cipher"])
-    if CryptoUtils.sha512(iv + cipher).hex() != data_pkt["hash"]:
-        nu.send_json(conn, {"type": "NACK"}); return
+    try:
+        with metrics.timer("server.upload.decrypt"):
+            plain = await ch.run(CryptoUtils.open_packet, ch.aead, sk, data_pkt, data_pkt["meta"])
+    except ValueError:
+        await ch.send({"type": "NACK"}); return
 
-    if not CryptoUtils.rsa_verify(client_pub,
-                                  base64.b64decode(data_pkt["sig"]),
-                                  base64.b64decode(data_pkt["meta"])):
-        nu.send_json(conn, {"type": "NACK"}); return
+    with metrics.timer("server.upload.verify"):
+        ok = await verify_client(ch, sk, master, data_pkt["sig"], data_pkt["meta"])
+    if not ok:
+        await ch.send({"type": "NACK"}); return
 
-    meta = json.loads(base64.b64decode(data_pkt["meta"]))
-    plain = CryptoUtils.aes_decrypt(sk, iv, cipher)
-    Path(config.STORAGE_DIR, meta["name"]).write_bytes(plain)
+    meta = json.loads(bytes(data_pkt["meta"]))
+    with metrics.timer("server.upload.store"):
+        await ch.run(store.put_bytes, meta["name"], plain, signed_by(data_pkt, master))
+    metrics.count("upload_bytes", len(plain))
     nu.info(f"[SAVE] {meta['name']} stored ({len(plain)} bytes)")
-    nu.send_json(conn, {"type": "ACK"})
+    await ch.send({"type": "ACK", **new_ticket(sk, master)})
+
+# --- Upload flow (DATA-STREAM: chunk có seq, ACK từng chunk, resume bằng token) ---
+async def upload_stream_flow(ch, sk, master, hdr):
+    if not await verify_client(ch, sk, master, hdr["sig"], hdr["meta"]):
+        await ch.send({"type": "NACK"}); return
+    meta  = json.loads(bytes(hdr["meta"]))
+    info  = {k: meta[k] for k in ("name", "size", "sha512")}
+    codec = meta.get("compress")         # chunk nén được thì client nén trước khi mã hoá
+    if codec and codec not in ch.caps:
+        await ch.send({"type": "NACK", "err": "compress"}); return
+    if hdr.get("join"):
+        await join_stream_flow(ch, sk, hdr.get("token", ""), info, codec); return
+    part, token = await ch.run(open_partial, hdr.get("token", ""), info)
+    if part.have:
+        nu.info(f"[RESUME] {meta['name']}: {len(part.have)}/{part.total} chunk on disk")
+    if hdr.get("digests"):
+        if dup := await ch.run(dedup_fill, part, hdr["digests"]):
+            nu.info(f"[DEDUP] {meta['name']}: {dup}/{part.total} chunk already in store")
+    streams[token] = part                # trước STREAM-OK: kết nối phụ (join) có thể tới ngay sau đó
+    try:
+        await ch.send({"type": "STREAM-OK", "token": token, "have": su.to_ranges(part.have)}, lossy=False)
+        ch.settimeout(config.TIMEOUT * (config.MAX_RETRY + 1))
+        with metrics.timer("server.upload_stream.recv_chunks"):
+            await su.recv_chunks(ch, part, sk, codec)
+    except Exception:
+        await ch.run(part.close); raise    # giữ trạng thái dở dang để client resume
+    finally:
+        streams.pop(token, None)
+    if not part.complete():
+        await ch.run(part.close)
+        await ch.send({"type": "NACK", "have": su.to_ranges(part.have)}, lossy=False); return
+
+    await ch.run(part.sync)
+    with metrics.timer("server.upload_stream.hash"):
+        digest = await ch.run(su.file_sha512, part.data_path)
+    if digest.hex() != meta["sha512"]:
+        await ch.run(part.discard)
+        await ch.send({"type": "NACK"}, lossy=False); return
+    with metrics.timer("server.upload_stream.store"):
+        await ch.run(store.put_file, meta["name"], part.data_path, meta["size"], signed_by(hdr, master))
+    await ch.run(part.discard)
+    metrics.count("upload_bytes", meta["size"])
+    nu.info(f"[SAVE] {meta['name']} stored ({meta['size']} bytes, streamed)")
+    await ch.send({"type": "ACK", **new_ticket(sk, master)}, lossy=False)
+
+async def join_stream_flow(ch, sk, token: str, info: dict, codec: str = None):
+    """
+    Kết nối phụ của upload song song: chunk được ghi vào cùng PartialFile với kết nối chính của `token`;
+    kiểm tra SHA-512 cả file và lưu vào kho do kết nối chính làm sau khi mọi kết nối phụ đã xong.
+    """
+    part = streams.get(token)
+    if part is None or part.info != info:
+        await ch.send({"type": "NACK"}, lossy=False); return
+    await ch.send({"type": "STREAM-OK", "token": token, "have": su.to_ranges(part.have)}, lossy=False)
+    ch.settimeout(config.TIMEOUT * (config.MAX_RETRY + 1))
+    await su.recv_chunks(ch, part, sk, codec)
+    await ch.run(part.sync)
+    await ch.send({"type": "ACK"}, lossy=False)
+
+def open_partial(token: str, info: dict):
+    """Upload dở dang lưu dưới STORAGE_DIR/.partial/<token>.{part,json} – còn nguyên sau khi server khởi động lại."""
+    if len(token) != 32 or not all(c in "0123456789abcdef" for c in token):
+        token = os.urandom(16).hex()
+    base = PARTIAL_DIR / token
+    return su.PartialFile.resume(base.with_suffix(".part"), base.with_suffix(".json"), info), token
+
+def sweep_partials(ttl: float = None) -> int:
+    """Xoá upload dở dang bị bỏ rơi: cả nhóm <token>.* không được ghi quá `ttl` giây và không đang nhận; trả về số upload."""
+    groups, n = {}, 0
+    for p in PARTIAL_DIR.glob("*"):
+        groups.setdefault(p.name.split(".")[0], []).append(p)
+    cut = time.time() - (config.PARTIAL_TTL if ttl is None else ttl)
+    for token, files in groups.items():
+        try:
+            if token in streams or max(f.stat().st_mtime for f in files) > cut:
+                continue
+            for f in files:
+                f.unlink(missing_ok=True)
+            n += 1
+        except OSError:
+            pass
+    return n
+
+def sweeper(every: float = 3600):
+    """Thread nền: dọn .partial lúc khởi động rồi mỗi `every` giây (chung cho cả hai engine)."""
+    while True:
+        if n := sweep_partials():
+            nu.info(f"[CLEAN] removed {n} abandoned partial upload(s)")
+        time.sleep(every)
+
+def dedup_fill(part: su.PartialFile, digests) -> int:
+    """Truy vấn dedup: chunk nào kho đã có thì chép thẳng từ kho vào file dở dang, client không phải gửi."""
+    if len(digests) != storage.DIGEST * part.total:
+        return 0
+    n = 0
+    for seq in part.missing():
+        data = store.read_chunk(bytes(digests[seq * storage.DIGEST:(seq + 1) * storage.DIGEST]).hex())
+        if data is not None:
+            part.write(seq, data); n += 1
+    return n
 
 # --- Download flow ---
-def download_flow(conn, pkt):
+async def download_flow(ch, pkt, master=None):
     filename = pkt["file"]
-    if not CryptoUtils.rsa_verify(client_pub,
-                                  base64.b64decode(pkt["sig"]),
-                                  filename.encode()):
-        nu.send_json(conn, {"type": "NACK", "err": "auth"}); return
-
-    path = Path(config.STORAGE_DIR, filename)
-    if not path.exists():
-        nu.send_json(conn, {"type": "NACK", "err": "not_found"}); return
-
-    plain = path.read_bytes()
-    sk  = os.urandom(32)
-    iv  = os.urandom(16)
-    cipher = CryptoUtils.aes_encrypt(sk, iv, plain)
-    meta = {"name": filename, "size": len(plain), "timestamp": int(time.time())}
-    sig_meta = CryptoUtils.rsa_sign(server_priv,
-                                    json.dumps(meta, sort_keys=True).encode())
-
-    nu.send_json(conn, {
-        "type":   "DATA",
-        "iv":     base64.b64encode(iv).decode(),
-        "cipher": base64.b64encode(cipher).decode(),
-        "hash":   CryptoUtils.sha512(iv + cipher).hex(),
-        "sig":    base64.b64encode(sig_meta).decode(),
-        "meta":   base64.b64encode(json.dumps(meta, sort_keys=True).encode()).decode(),
-        "enc_sk": base64.b64encode(CryptoUtils.rsa_encrypt(client_pub, sk)).decode(),
-    })
+    with metrics.timer("server.download.auth"):
+        ok = await verify_request(ch, pkt, master)
+    if not ok:
+        await ch.send({"type": "NACK", "err": "auth"}); return
 
-    conn.settimeout(config.TIMEOUT)
+    path = await ch.run(store.path, filename)
+    if path is None:
+        await ch.send({"type": "NACK", "err": "not_found"}); return
+    if pkt.get("stream"):
+        await download_stream_flow(ch, pkt, path, master); return
+
+    meta = {"name": filename, "timestamp": int(time.time())}
+    st   = path.stat()
+    need = st.st_size                    # cả file (hoặc cả đoạn) nằm trong RAM tới khi gửi xong
+    if "offset" in pkt:                  # đoạn [offset, offset + length) – xem / tua video không cần cả file
+        offset, length = pkt["offset"], pkt.get("length")
+        if not (is_int(offset) and 0 <= offset <= st.st_size and (length is None or is_int(length) and length >= 0)):
+            await ch.send({"type": "NACK", "err": "range"}); return
+        need = st.st_size - offset if length is None else min(length, st.st_size - offset)
+    if not await memory.admit(need, config.ADMIT_WAIT):
+        await ch.send(busy()); return
     try:
-        if nu.recv_json(conn).get("type") == "ACK":
+        with metrics.timer("server.download.read"):
+            if "offset" in pkt:
+                plain = await ch.run(read_range, path, offset, need)   # đúng số byte đã giữ chỗ
+                meta.update(offset=offset, total=st.st_size, mtime=st.st_mtime_ns)
+            else:
+                plain = await ch.run(path.read_bytes)
+        meta["size"] = len(plain)
+        with metrics.timer("server.download.key_sign"):
+            sk, key_fields = await download_key(ch, pkt, master)
+            meta_json = json.dumps(meta, sort_keys=True).encode()
+            sig_meta = await sign_server(ch, sk, master, meta_json)
+
+        with metrics.timer("server.download.seal_send"):
+            await ch.send({
+                "type":   "DATA",
+                **await ch.run(CryptoUtils.seal_packet, ch.aead, sk, plain, meta_json),
+                "sig":    sig_meta,
+                "meta":   meta_json,
+                **key_fields,
+            })
+    finally:
+        memory.release(need)
+    metrics.count("download_bytes", len(plain))
+
+    ch.settimeout(config.TIMEOUT)
+    try:
+        with metrics.timer("server.download.wait_ack"):
+            resp = await ch.recv()
+        if resp.get("type") == "ACK":
             nu.info("[OK] Download acknowledged")
     except socket.timeout:
         nu.warn("[WARN] Client did not ACK")
 
-# --- Main loop ---
-if __name__ == "__main__":
+def read_range(path, offset: int, length: int = None) -> bytes:
+    """
+    Chỉ đọc đoạn cần (Path hoặc StoredFile: chỉ các chunk chứa đoạn đó); length None -> tới cuối file.
+    Không bao giờ đọc (cấp phát) quá phần còn lại của file, dù `length` lớn đến đâu.
+    """
+    left = max(path.stat().st_size - offset, 0)
+    with path.open("rb", buffering=0) as f:
+        f.seek(offset)
+        return f.read(left if length is None else min(length, left))
+
+# --- LIST / STAT: đọc từ chỉ mục metadata, không chạm vào file; STATS: bộ đếm của server ---
+async def browse_flow(ch, pkt, master=None):
+    if not await verify_request(ch, pkt, master):
+        await ch.send({"type": "NACK", "err": "auth"}); return
+    if pkt["type"] == "STATS":
+        await ch.send({"type": "STATS-OK", "store": store.stats(), "load": load_stats()}); return
+    if pkt["type"] == "STAT":
+        st = await ch.run(store.index.stat, pkt["file"])
+        if st is None:
+            await ch.send({"type": "NACK", "err": "not_found"}); return
+        meta, sig = st.pop("meta"), st.pop("sig")
+        await ch.send({"type": "STAT-OK", "file": st, **({"meta": meta, "sig": sig} if meta else {})})
+        return
+    limit = pkt.get("limit") or config.LIST_LIMIT
+    if not is_int(limit):
+        await ch.send({"type": "NACK", "err": "limit"}); return
+    limit = max(1, min(limit, config.LIST_LIMIT))   # LIMIT âm trong SQLite = không giới hạn
+    files = await ch.run(store.index.list, pkt.get("prefix", ""), pkt.get("after", ""), limit)
+    await ch.send({"type": "LIST-OK", "files": files, "next": files[-1]["name"] if len(files) == limit else ""})
+
+# --- Download flow (DATA-STREAM: gửi từng chunk, bỏ qua chunk client đã có) ---
+async def download_key(ch, pkt, master) -> tuple:
+    """(sk, trường khoá của gói DATA / DATA-STREAM): enc_sk RSA + vé mới, hoặc nonce server khi dùng vé."""
+    if master is not None:
+        nonce = os.urandom(16)
+        return CryptoUtils.derive_key(master, bytes(pkt["nonce"]) + nonce), {"nonce": nonce}
+    sk = os.urandom(32)
+    return sk, {"enc_sk": await ch.run(CryptoUtils.rsa_encrypt, keys.pub("client"), sk), **new_ticket(sk, None)}
+
+async def download_stream_flow(ch, pkt, path, master=None):
+    st = path.stat()
+    version = {"name": pkt["file"], "size": st.st_size, "mtime": st.st_mtime_ns,
+               "sha512": await ch.run(whole_sha512, path)}   # client kiểm tra cả file trước khi nhận
+    count = su.chunk_count(st.st_size)
+    skip = su.from_ranges(pkt.get("have"), count) if pkt.get("resume") == version else set()
+    if skip:
+        nu.info(f"[RESUME] {pkt['file']}: client has {len(skip)} chunk")
+    sk, key_fields = await download_key(ch, pkt, master)
+    # client không đề nghị codec (hoặc file đã nén sẵn) -> luồng không nén
+    codec = ch.codec if ch.codec and await ch.run(su.file_compressible, path) else None
+    meta  = dict(version, timestamp=int(time.time()), **({"compress": codec} if codec else {}))
+    meta_json = json.dumps(meta, sort_keys=True).encode()
+
+    await ch.send({
+        "type":   "DATA-STREAM",
+        "sig":    await sign_server(ch, sk, master, meta_json),
+        "meta":   meta_json,
+        **key_fields,
+    }, lossy=False)
+
+    ch.settimeout(config.TIMEOUT)
+    seqs = [s for s in range(count) if s not in skip]
+    with metrics.timer("server.download_stream.send_chunks"):
+        sent = await su.send_chunks(ch, path, sk, seqs, codec)
+    if not sent:
+        nu.warn("[WARN] Download stream aborted"); return
+    metrics.count("download_bytes", st.st_size)
+    resp = (await su.finish_send(ch)).get("type")
+    if resp == "ACK":
+        nu.info(f"[OK] Download acknowledged ({st.st_size} bytes, streamed)")
+    elif resp == "NACK":
+        nu.warn("[WARN] Client rejected stream")
+    else:
+        nu.warn("[WARN] Client did not ACK")
+
+def whole_sha512(path) -> str:
+    """SHA-512 cả file: có sẵn trong manifest của kho; file thường (trước khi có kho) thì băm lại."""
+    man = getattr(path, "manifest", None)
+    return man["sha512"] if man and man.get("sha512") else su.file_sha512(path).hex()
+
+def flat_stats(d: dict, prefix: str = "store_") -> dict:
+    """{"cache": {"hits": 3}} -> {"store_cache_hits": 3} cho gauge Prometheus."""
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(flat_stats(v, f"{prefix}{k}_"))
+        else:
+            out[f"{prefix}{k}"] = v
+    return out
+
+# --- Engine thread: mỗi kết nối một thread, flow chạy blocking qua run_sync ---
+def handle(conn: socket.socket, addr):
+    conn.settimeout(config.TIMEOUT)
+    admitted = sessions.acquire(1, config.ADMIT_WAIT)   # đủ MAX_SESSIONS phiên -> chờ chỗ, quá hạn -> BUSY
+    try:
+        if not admitted:
+            nu.warn(f"[BUSY] {addr}: {sessions.used} session(s), {len(sessions.queue)} queued")
+            nu.server_handshake(conn, busy=config.BUSY_RETRY); return
+        # Handshake (+ đàm phán binary frame / phiên bền)
+        ch = shape(nu.server_handshake(conn))
+        if ch is not None and "mux" in ch.caps:
+            nu.Mux(ch, on_request=lambda sub: threading.Thread(   # MAX_SESSIONS đếm kết nối, MAX_STREAMS yêu cầu
+                target=serve_sub, args=(sub,), daemon=True).start(), max_subs=config.MAX_STREAMS, busy=busy()).pump()
+        elif ch is not None:
+            nu.run_sync(serve(nu.AwaitableChannel(ch)))
+    except Exception as e:
+        nu.warn(f"[EX] {e}")
+    finally:
+        conn.close()
+        if admitted:
+            sessions.release()
+
+def serve_sub(sub: nu.MuxChannel):
+    """Một yêu cầu (rid) của phiên bền, chạy trên thread riêng để các yêu cầu xử lý song song."""
+    try:
+        nu.run_sync(serve(nu.AwaitableChannel(sub)))
+    except Exception as e:
+        nu.warn(f"[EX] rid {sub.rid}: {e}")
+    finally:
+        sub.close()
+
+def run_threaded():
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     srv.bind((config.HOST, config.PORT))
-    srv.listen(5)
+    srv.listen(config.BACKLOG)
     nu.info(f"[SERV] Listening on {config.HOST}:{config.PORT}")
     try:
         while True:
             c, addr = srv.accept(); nu.info(f"[SERV] Connection from {addr}")
-            threading.Thread(target=handle, args=(c,), daemon=True).start()
+            threading.Thread(target=handle, args=(c, addr), daemon=True).start()
     except KeyboardInterrupt:
         nu.info("[SERV] Shutdown"); srv.close()
+
+# --- Engine asyncio: I/O trên event loop, RSA / AES / đĩa trên thread pool giới hạn ---
+async def run_asyncio():
+    pool = ThreadPoolExecutor(config.ASYNC_WORKERS)
+
+    async def handle_stream(reader, writer):
+        addr = writer.get_extra_info("peername")
+        nu.info(f"[SERV] Connection from {addr}")
+        if not await sessions.acquire(1, config.ADMIT_WAIT):
+            nu.warn(f"[BUSY] {addr}: {sessions.used} session(s), {len(sessions.queue)} queued")
+            try:
+                await nu.async_server_handshake(reader, writer, busy=config.BUSY_RETRY)
+            finally:
+                writer.close()
+            return
+        try:
+            ch = shape(await nu.async_server_handshake(reader, writer, executor=pool))
+            if ch is not None and "mux" in ch.caps:
+                tasks = set()
+                await nu.AsyncMux(ch, lambda sub: tasks.add(asyncio.create_task(serve_sub_async(sub))),
+                                  config.MAX_STREAMS, busy()).pump()
+                await asyncio.gather(*tasks)
+            elif ch is not None:
+                await serve(ch)
+        except Exception as e:
+            nu.warn(f"[EX] {e}")
+        finally:
+            writer.close()
+            sessions.release()
+
+    async def serve_sub_async(sub):
+        try:
+            await serve(sub)
+        except Exception as e:
+            nu.warn(f"[EX] rid {sub.rid}: {e}")
+        finally:
+            sub.close()
+
+    srv = await asyncio.start_server(handle_stream, config.HOST, config.PORT, backlog=config.BACKLOG)
+    nu.info(f"[SERV] Listening on {config.HOST}:{config.PORT} (asyncio)")
+    async with srv:
+        await srv.serve_forever()
+
+# --- Main loop ---
+def main():
+    global store, tickets, sessions, memory, links
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", choices=["thread", "asyncio"], default="thread")
+    parser.add_argument("--port", type=int, default=config.PORT)
+    parser.add_argument("--loss", type=float, default=config.LOSS_RATE,
+                        help="xác suất drop gói mô phỏng trong tiến trình (0 khi chạy sau netem.py)")
+    parser.add_argument("--crypto-procs", type=int, default=config.CRYPTO_PROCS,
+                        help="số tiến trình cho RSA decrypt/sign (0 = tắt)")
+    parser.add_argument("--metrics", type=int, nargs="?", const=config.METRICS_PORT, metavar="PORT",
+                        default=config.METRICS_PORT if config.METRICS else None,
+                        help="bật đo đạc, phục vụ text Prometheus tại http://HOST:PORT/metrics")
+    parser.add_argument("--max-sessions", type=int, default=config.MAX_SESSIONS,
+                        help="số phiên xử lý cùng lúc; thêm ADMIT_QUEUE kết nối chờ, quá nữa -> BUSY")
+    parser.add_argument("--rate-out", type=float, default=config.RATE_OUT / 1e6,
+                        help="MB/s server gửi đi, chia đều cho các kết nối đang truyền (0 = không giới hạn)")
+    parser.add_argument("--rate-in", type=float, default=config.RATE_IN / 1e6,
+                        help="MB/s server nhận vào, chia đều cho các kết nối đang truyền (0 = không giới hạn)")
+    parser.add_argument("--conn-rate", type=float, default=config.CONN_RATE / 1e6,
+                        help="MB/s tối đa mỗi kết nối, mỗi chiều (0 = không giới hạn)")
+    parser.add_argument("--fsck", action="store_true",
+                        help="quét toàn bộ kho khi khởi động: đếm lại tham chiếu, dọn chunk mồ côi / file tạm")
+    args = parser.parse_args()
+    config.PORT, config.LOSS_RATE, config.MAX_SESSIONS = args.port, args.loss, args.max_sessions
+    config.RATE_OUT, config.RATE_IN, config.CONN_RATE = (int(r * 1e6) for r in (args.rate_out, args.rate_in,
+                                                                                args.conn_rate))
+
+    print_requirement_table()
+    keys.pair("server"); keys.pair("client")     # sinh khoá (nếu thiếu) trước khi nhận kết nối
+    Path(config.STORAGE_DIR).mkdir(exist_ok=True)
+    store   = storage.ChunkStore(config.STORAGE_DIR, fsck=args.fsck)
+    tickets = SessionTickets()
+    threading.Thread(target=sweeper, daemon=True).start()
+    budget   = admission.AsyncBudget if args.engine == "asyncio" else admission.Budget
+    sessions = budget("sessions", config.MAX_SESSIONS, config.ADMIT_QUEUE)
+    memory   = budget("memory", config.MAX_INFLIGHT, config.ADMIT_QUEUE)
+    if config.RATE_OUT or config.RATE_IN or config.CONN_RATE:
+        links = (admission.Link(config.RATE_OUT, config.CONN_RATE), admission.Link(config.RATE_IN, config.CONN_RATE))
+        nu.info(f"[SERV] Bandwidth: out {config.RATE_OUT / 1e6:g} / in {config.RATE_IN / 1e6:g} MB/s total, "
+                f"{config.CONN_RATE / 1e6:g} MB/s per connection (0 = unlimited)")
+    if args.metrics:
+        config.METRICS = True
+        metrics.serve_http(args.metrics, lambda: {**flat_stats(store.stats()), **flat_stats(load_stats(), "")})
+        nu.info(f"[SERV] Metrics on http://{config.HOST}:{args.metrics}/metrics")
+    if args.crypto_procs > 0:
+        CryptoUtils.start_pool(["server"], args.crypto_procs)
+        nu.info(f"[SERV] RSA worker pool: {args.crypto_procs} process(es)")
+    if args.engine == "asyncio":
+        try:
+            asyncio.run(run_asyncio())
+        except KeyboardInterrupt:
+            nu.info("[SERV] Shutdown")
+    else:
+        run_threaded()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+# storage.py – Kho lưu trữ theo nội dung (content-addressed) cho STORAGE_DIR
+#
+# File được cắt thành chunk CHUNK_SIZE byte; mỗi chunk lưu đúng một lần dưới
+# .store/chunks/<2 hex>/<2 hex>/<SHA-512 hex>, mỗi file là một manifest JSON
+# (.store/files/<2 hex>/<2 hex>/<SHA-256 của tên>.json) liệt kê digest các chunk – hai tầng thư mục 256 x 256
+# giữ mỗi thư mục nhỏ kể cả khi có hàng triệu file. Số tham chiếu của chunk nằm trong SQLite, cập nhật cùng
+# giao dịch với chỉ mục; mỗi lần ghi / xoá được ghi nhật ký (bảng pending) trước khi đụng manifest nên khởi động
+# chỉ phải đối chiếu các thao tác dở dang, không quét cả kho. Quét toàn bộ (fsck: đếm lại từ manifest, dọn chunk
+# mồ côi / file tạm) chỉ chạy một lần khi nâng cấp kho cũ, hoặc khi được yêu cầu (server.py --fsck).
+# Ghi: file tạm rồi rename; chunk mới của một file được fsync một lượt trước khi ghi manifest (điểm commit,
+# cũng fsync) -> tắt máy giữa chừng chỉ để lại chunk mồ côi, không bao giờ có file cụt được phục vụ.
+# Đọc theo lát (open_view): lát của StoredFile trỏ thẳng vào chunk trong LRU, file thường được mmap – không copy.
+# Chỉ mục metadata SQLite (.store/index.sqlite) phục vụ LIST / STAT và tra tên file mà không quét đĩa.
+# Chunk đọc ra được giữ trong LRU (CACHE_BYTES) theo digest: nội dung đổi thì digest đổi, không bao giờ cũ.
+import collections, contextlib, hashlib, io, json, mmap, os, sqlite3, threading, time
+from pathlib import Path
+import config
+
+DIGEST = 64                              # byte SHA-512 mỗi chunk trong danh sách "digests"
+
+def _shard(root: Path, key: str) -> Path:
+    return root / key[:2] / key[2:4] / key
+
+def _atomic_write(path: Path, data, sync: bool = False):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _fsync_path(p):
+    fd = os.open(p, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _fsync_dirs(dirs):
+    if os.name != "nt":                  # Windows không mở / fsync được thư mục
+        for d in dirs:
+            _fsync_path(d)
+
+def _fsync(paths):
+    """fsync các file đã ghi (một lượt, sau khi đã ghi hết) rồi các thư mục chứa chúng (cho rename)."""
+    for p in paths:
+        _fsync_path(p)
+    _fsync_dirs({Path(p).parent for p in paths})
+
+class MappedFile:
+    """File thường map chỉ đọc vào bộ nhớ: view(offset, n) là memoryview trỏ vào page cache, không copy."""
+
+    def __init__(self, path):
+        self._f  = open(path, "rb", buffering=0)
+        size     = os.fstat(self._f.fileno()).st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.size = size
+
+    def view(self, offset: int, n: int) -> memoryview:
+        return memoryview(self._mm)[offset:offset + n] if self._mm else memoryview(b"")
+
+    def close(self):
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:          # còn lát đang được dùng: để GC đóng sau
+                pass
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_view(src):
+    """Nguồn đọc theo lát không copy cho đường gửi: StoredFile -> ChunkReader, file thường (Path) -> MappedFile."""
+    return src.open() if isinstance(src, StoredFile) else MappedFile(src)
+
+class StoredStat:
+    """Phần của os.stat_result mà server dùng (st_size, st_mtime_ns)."""
+    __slots__ = ("st_size", "st_mtime_ns")
+
+    def __init__(self, size: int, mtime_ns: int):
+        self.st_size, self.st_mtime_ns = size, mtime_ns
+
+class StoredFile:
+    """File trong kho, cùng giao diện đọc với Path (exists / stat / read_bytes / open)."""
+
+    def __init__(self, store, manifest: dict):
+        self.store    = store
+        self.manifest = manifest
+        self.name     = manifest["name"]
+
+    def exists(self) -> bool:
+        return True
+
+    def stat(self) -> StoredStat:
+        return StoredStat(self.manifest["size"], self.manifest["mtime_ns"])
+
+    def read_bytes(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def open(self, mode: str = "rb", buffering: int = -1):
+        if mode != "rb":
+            raise ValueError("stored files are read-only")
+        return ChunkReader(self.store, self.manifest)
+
+class ChunkReader(io.RawIOBase):
+    """Đọc tuần tự / seek trên chuỗi chunk của một manifest như một file thường."""
+
+    def __init__(self, store, manifest: dict):
+        self.store  = store
+        self.chunks = manifest["chunks"]
+        self.csize  = manifest["chunk_size"]
+        self.size   = manifest["size"]
+        self.pos    = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        self.pos = max(0, (0, self.pos, self.size)[whence] + pos)
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def readall(self) -> bytes:
+        buf = bytearray(max(self.size - self.pos, 0))
+        self.readinto(buf)
+        return bytes(buf)
+
+    def view(self, offset: int, n: int) -> memoryview:
+        """
+        Đoạn [offset, offset + n): nằm gọn trong một chunk (luôn đúng khi đọc theo seq * CHUNK_SIZE)
+        -> memoryview vào chunk trong LRU, không copy; vắt qua nhiều chunk thì chép ra bộ đệm mới.
+        """
+        n = max(0, min(n, self.size - offset))
+        idx, off = divmod(offset, self.csize)
+        if n and off + n <= self.csize:
+            chunk = self.store.load_chunk(self.chunks[idx])
+            if len(chunk) < off + n:
+                raise IOError(f"chunk {self.chunks[idx]} truncated")
+            return memoryview(chunk)[off:off + n]
+        buf = bytearray(n)
+        self.seek(offset)
+        return memoryview(buf)[:self.readinto(buf)]
+
+    def readinto(self, b) -> int:
+        view, n = memoryview(b).cast("B"), 0
+        while n < len(view) and self.pos < self.size:
+            idx, off = divmod(self.pos, self.csize)
+            want = min(len(view) - n, self.csize - off, self.size - self.pos)
+            chunk = self.store.load_chunk(self.chunks[idx])
+            if len(chunk) < off + want:
+                raise IOError(f"chunk {self.chunks[idx]} truncated")
+            view[n:n + want] = memoryview(chunk)[off:off + want]
+            n += want
+            self.pos += want
+        return n
+
+class ChunkCache:
+    """LRU chunk plaintext theo digest, tổng tối đa `capacity` byte; đếm hit / miss / eviction."""
+
+    def __init__(self, capacity: int = config.CACHE_BYTES):
+        self.capacity = capacity
+        self.size     = 0
+        self.data     = collections.OrderedDict()
+        self._lock    = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, digest: str):
+        with self._lock:
+            data = self.data.get(digest)
+            if data is None:
+                self.misses += 1
+                return None
+            self.data.move_to_end(digest)
+            self.hits += 1
+            return data
+
+    def put(self, digest: str, data: bytes):
+        if len(data) > self.capacity:
+            return
+        with self._lock:
+            if digest in self.data:
+                return
+            self.data[digest] = data
+            self.size += len(data)
+            while self.size > self.capacity:
+                _, old = self.data.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+    def drop(self, digest: str):
+        with self._lock:
+            if (data := self.data.pop(digest, None)) is not None:
+                self.size -= len(data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.data), "bytes": self.size, "capacity": self.capacity}
+
+def _plain_manifest(path: Path) -> dict:
+    """Metadata cho chỉ mục của một file thường (không qua kho chunk)."""
+    h = hashlib.sha512()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            h.update(block)
+    st = path.stat()
+    return {"name": path.name, "size": st.st_size, "sha512": h.hexdigest(), "mtime_ns": st.st_mtime_ns}
+
+class FileIndex:
+    """
+    Metadata mọi file đã lưu: tên, kích thước, SHA-512, timestamp và chữ ký của người upload
+    (meta đã ký + sig, auth = "rsa" / "hmac" theo cách client ký). Một kết nối SQLite dùng chung, có khoá.
+    """
+    FIELDS = ("name", "size", "sha512", "timestamp", "stored_ns", "auth")
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+                        " sha512 TEXT, timestamp INTEGER, stored_ns INTEGER NOT NULL, auth TEXT,"
+                        " meta BLOB, sig BLOB)")
+        # số tham chiếu mỗi chunk; thao tác ghi / xoá đang dở: target = mtime_ns manifest mới (None = xoá)
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (digest TEXT PRIMARY KEY, refs INTEGER NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS pending (name TEXT PRIMARY KEY, target INTEGER,"
+                        " new TEXT NOT NULL, old TEXT NOT NULL, meta BLOB, sig BLOB, auth TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def put(self, man: dict, meta: bytes = None, sig: bytes = None, auth: str = None):
+        with self._lock:
+            self._put_row(man, meta, sig, auth)
+
+    def _put_row(self, man: dict, meta=None, sig=None, auth=None):
+        ts = json.loads(bytes(meta)).get("timestamp") if meta else None
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (man["name"], man["size"], man.get("sha512"), ts, man["mtime_ns"], auth,
+                         None if meta is None else bytes(meta), None if sig is None else bytes(sig)))
+
+    def remove(self, name: str):
+        with self._lock:
+            self.db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def has(self, name: str) -> bool:
+        with self._lock:
+            return self.db.execute("SELECT 1 FROM files WHERE name = ?", (name,)).fetchone() is not None
+
+    def names(self) -> set:
+        with self._lock:
+            return {r[0] for r in self.db.execute("SELECT name FROM files")}
+
+    def stat(self, name: str):
+        """Metadata của `name` (kèm meta / sig của người upload), hoặc None."""
+        with self._lock:
+            row = self.db.execute(f"SELECT {', '.join(self.FIELDS)}, meta, sig FROM files WHERE name = ?",
+                                  (name,)).fetchone()
+        return None if row is None else dict(zip(self.FIELDS + ("meta", "sig"), row))
+
+    # ---- Số tham chiếu chunk + nhật ký thao tác dở dang ----
+    def refs(self, digest: str) -> int:
+        with self._lock:
+            row = self.db.execute("SELECT refs FROM chunks WHERE digest = ?", (digest,)).fetchone()
+        return row[0] if row else 0
+
+    def chunk_count(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def ready(self) -> bool:
+        """Bảng chunks đã được dựng (kho tạo bằng phiên bản trước không có -> cần fsck một lần)."""
+        with self._lock:
+            return self.db.execute("SELECT 1 FROM state WHERE key = 'refs'").fetchone() is not None
+
+    def begin(self, name: str, target, new: list, old: list, signed: dict = None):
+        """Trước khi ghi / xoá manifest: ghi nhật ký và cộng tham chiếu cho các chunk của bản mới."""
+        signed = signed or {}
+        with self._lock, self._tx():
+            self.db.execute("INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (name, target, json.dumps(new), json.dumps(old),
+                             *(None if signed.get(k) is None else bytes(signed[k]) for k in ("meta", "sig")),
+                             signed.get("auth")))
+            self._add(collections.Counter(new))
+
+    def finish(self, name: str, man) -> list:
+        """Manifest đã được ghi (man) / xoá (None): cập nhật chỉ mục, bớt tham chiếu bản cũ; trả về chunk về 0."""
+        with self._lock, self._tx():
+            row = self.db.execute("SELECT old, meta, sig, auth FROM pending WHERE name = ?", (name,)).fetchone()
+            if man is None:
+                self.db.execute("DELETE FROM files WHERE name = ?", (name,))
+            else:
+                self._put_row(man, *(row[1:] if row else ()))
+            self.db.execute("DELETE FROM pending WHERE name = ?", (name,))
+            return self._add(collections.Counter(json.loads(row[0])), -1) if row else []
+
+    def rollback(self, name: str) -> list:
+        """Manifest chưa kịp đổi: bỏ phần tham chiếu begin() đã cộng; trả về chunk về 0."""
+        with self._lock, self._tx():
+            row = self.db.execute("SELECT new FROM pending WHERE name = ?", (name,)).fetchone()
+            self.db.execute("DELETE FROM pending WHERE name = ?", (name,))
+            return self._add(collections.Counter(json.loads(row[0])), -1) if row else []
+
+    def pending(self) -> list:
+        with self._lock:
+            return self.db.execute("SELECT name, target FROM pending").fetchall()
+
+    def reset_refs(self, refs: collections.Counter):
+        """fsck: thay toàn bộ bảng chunks bằng số đếm lại từ manifest, bỏ nhật ký, đánh dấu đã dựng."""
+        with self._lock, self._tx():
+            self.db.execute("DELETE FROM chunks")
+            self.db.execute("DELETE FROM pending")
+            self.db.executemany("INSERT INTO chunks VALUES (?, ?)", refs.items())
+            self.db.execute("INSERT OR REPLACE INTO state VALUES ('refs', '1')")
+
+    def _add(self, counts: collections.Counter, sign: int = 1) -> list:
+        """Cộng (sign=-1: bớt) `counts` vào bảng chunks; trả về các digest về 0 (đã xoá khỏi bảng)."""
+        zero = []
+        for d, n in counts.items():
+            self.db.execute("INSERT INTO chunks VALUES (?, ?) ON CONFLICT(digest) DO UPDATE SET refs = refs + ?",
+                            (d, sign * n, sign * n))
+            if self.db.execute("SELECT refs FROM chunks WHERE digest = ?", (d,)).fetchone()[0] <= 0:
+                self.db.execute("DELETE FROM chunks WHERE digest = ?", (d,))
+                zero.append(d)
+        return zero
+
+    @contextlib.contextmanager
+    def _tx(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK"); raise
+        self.db.execute("COMMIT")
+
+    def list(self, prefix: str = "", after: str = "", limit: int = 100) -> list:
+        """Tối đa `limit` file có tên bắt đầu bằng `prefix`, theo thứ tự tên, sau tên `after` (phân trang)."""
+        with self._lock:
+            rows = self.db.execute(f"SELECT {', '.join(self.FIELDS)} FROM files WHERE name >= ? AND name < ?"
+                                   " AND name > ? ORDER BY name LIMIT ?",
+                                   (prefix, prefix + "\U0010ffff", after, limit)).fetchall()
+        return [dict(zip(self.FIELDS, r)) for r in rows]
+
+class ChunkStore:
+    """Kho chunk dùng chung cho mọi file: file giống nhau (hoặc giống một phần) chỉ tốn chỗ một lần."""
+
+    def __init__(self, root=config.STORAGE_DIR, fsck: bool = False):
+        self.root       = Path(root)
+        self.chunks_dir = self.root / ".store" / "chunks"
+        self.files_dir  = self.root / ".store" / "files"
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        self._lock     = threading.Lock()
+        self._dirs     = set()                   # thư mục shard đã chắc chắn tồn tại
+        self._unsynced = set()                   # chunk đã rename nhưng chưa fsync (file khác có thể dùng chung)
+        self._pending  = collections.Counter()   # chunk của các lần ghi chưa tới điểm commit (chưa vào bảng chunks)
+        self.cache = ChunkCache()
+        self.index = FileIndex(self.root / ".store" / "index.sqlite")
+        self._recover()
+        if fsck or not self.index.ready():
+            self.fsck()
+
+    def _recover(self):
+        """Hoàn tất / huỷ các thao tác ghi / xoá bị cắt ngang: manifest đã đổi đúng như nhật ký -> làm nốt, chưa -> huỷ."""
+        for name, target in self.index.pending():
+            man = self.manifest(name)
+            if (man and man["mtime_ns"]) == target:
+                self._drop(self.index.finish(name, man))
+            else:
+                self._drop(self.index.rollback(name))
+
+    def fsck(self):
+        """Quét toàn bộ kho: chuyển bố cục cũ, đếm lại tham chiếu từ manifest, dọn chunk mồ côi / file tạm, đồng bộ chỉ mục."""
+        refs, indexed, present = collections.Counter(), self.index.names(), set()
+        for m in list(self.files_dir.rglob("*.json")):
+            man = json.loads(m.read_text())
+            if m != (dst := self._manifest_path(man["name"])):   # bố cục cũ: files/<tên>.json
+                self._mkdir(dst.parent)
+                os.replace(m, dst)
+            refs.update(man["chunks"])
+            present.add(man["name"])
+            if man["name"] not in indexed:       # manifest ghi xong nhưng chưa kịp vào chỉ mục
+                self.index.put(man)
+        for p in self.files_dir.rglob(".*.tmp"):
+            p.unlink()
+        for p in list(self.chunks_dir.glob("*/*")):
+            if p.is_file() and not p.name.startswith("."):   # bố cục cũ: chunks/<2 hex>/<digest>
+                self._mkdir(self.chunk_path(p.name).parent)
+                os.replace(p, self.chunk_path(p.name))
+            elif p.is_file():
+                p.unlink()
+        for p in self.chunks_dir.glob("*/*/*"):  # chunk mồ côi / file tạm (ingest dở khi tắt máy)
+            if not refs[p.name]:
+                p.unlink()
+        for p in self.root.iterdir():            # file thường cũ (trước khi có kho)
+            if p.is_file() and not p.name.startswith(".") and p.name not in present:
+                present.add(p.name)
+                if p.name not in indexed:
+                    self.index.put(_plain_manifest(p))
+        for name in indexed - present:
+            self.index.remove(name)
+        self.index.reset_refs(refs)
+
+    def chunk_path(self, digest: str) -> Path:
+        return _shard(self.chunks_dir, digest)
+
+    def _manifest_path(self, name: str) -> Path:
+        return _shard(self.files_dir, hashlib.sha256(name.encode()).hexdigest()).with_suffix(".json")
+
+    def _plain_path(self, name: str):
+        """File thường cũ ngay trong thư mục gốc (như lúc quét khi khởi động); tên có '/', '..', bắt đầu '.' -> None."""
+        if not name or name.startswith(".") or Path(name).name != name or "\\" in name:
+            return None
+        return self.root / name
+
+    def _mkdir(self, d: Path):
+        if d not in self._dirs:
+            d.mkdir(parents=True, exist_ok=True)
+            self._dirs.add(d)
+
+    # ---- Truy vấn ----
+    def has(self, digest: str) -> bool:
+        return self._pending[digest] > 0 or self.index.refs(digest) > 0
+
+    def read_chunk(self, digest: str):
+        """Nội dung chunk, hoặc None nếu kho không có."""
+        if not self.has(digest):
+            return None
+        try:
+            return self.load_chunk(digest)
+        except OSError:
+            return None
+
+    def load_chunk(self, digest: str) -> bytes:
+        """Đọc chunk qua LRU (OSError nếu không có trên đĩa)."""
+        data = self.cache.get(digest)
+        if data is None:
+            data = self.chunk_path(digest).read_bytes()
+            self.cache.put(digest, data)
+        return data
+
+    def stats(self) -> dict:
+        return {"chunks": self.index.chunk_count(), "cache": self.cache.stats()}
+
+    def manifest(self, name: str):
+        try:
+            man = json.loads(self._manifest_path(name).read_text())
+        except (OSError, ValueError):
+            return None
+        return man if man["name"] == name else None
+
+    def path(self, name: str):
+        """StoredFile của `name`; file thường còn sót trong STORAGE_DIR (trước khi có kho) trả về Path; không có -> None."""
+        if not self.index.has(name):
+            return None
+        man = self.manifest(name)
+        if man is not None:
+            return StoredFile(self, man)
+        plain = self._plain_path(name)
+        return plain if plain is not None and plain.is_file() else None
+
+    # ---- Ghi ----
+    def put_file(self, name: str, src: Path, size: int = None, signed: dict = None) -> dict:
+        """Cắt `src` (tối đa `size` byte) thành chunk và lưu thành file `name`; `signed` = meta / sig / auth cho chỉ mục."""
+        size = Path(src).stat().st_size if size is None else size
+
+        def chunks():
+            buf, left = bytearray(config.CHUNK_SIZE), size
+            with open(src, "rb", buffering=0) as f:
+                while left > 0 and (n := f.readinto(buf)):
+                    n = min(n, left); left -= n
+                    yield memoryview(buf)[:n]
+        return self._put(name, chunks(), signed)
+
+    def put_bytes(self, name: str, data, signed: dict = None) -> dict:
+        view = memoryview(data)
+        return self._put(name, (view[i:i + config.CHUNK_SIZE] for i in range(0, len(view), config.CHUNK_SIZE)),
+                         signed)
+
+    def _put(self, name: str, chunks, signed: dict = None) -> dict:
+        digests, size, whole, fresh = [], 0, hashlib.sha512(), {}
+        try:
+            for chunk in chunks:
+                d = hashlib.sha512(chunk).hexdigest()
+                with self._lock:                 # giữ tham chiếu trước để GC không xoá giữa chừng
+                    self._pending[d] += 1
+                digests.append(d)
+                whole.update(chunk); size += len(chunk)
+                path = self.chunk_path(d)
+                if not path.exists():
+                    if config.FSYNC:
+                        with self._lock:         # đánh dấu trước khi rename: ai thấy file cũng thấy dấu
+                            self._unsynced.add(d)
+                    self._mkdir(path.parent)
+                    _atomic_write(path, chunk)
+                if d in self._unsynced:          # chunk mới (của file này hoặc file khác đang ghi) chưa fsync
+                    fresh[d] = None
+            if fresh:                            # một lượt cho cả file thay vì fsync sau từng chunk
+                _fsync([self.chunk_path(d) for d in fresh])
+                with self._lock:
+                    self._unsynced.difference_update(fresh)
+        except BaseException:
+            self._unpend(digests); raise
+        man = {"name": name, "size": size, "sha512": whole.hexdigest(), "chunk_size": config.CHUNK_SIZE,
+               "mtime_ns": time.time_ns(), "chunks": digests}
+        mpath = self._manifest_path(name)
+        self._mkdir(mpath.parent)
+        with self._lock:
+            old = self.manifest(name)
+            self.index.begin(name, man["mtime_ns"], digests, old["chunks"] if old else [], signed)
+            self._unhold(digests)                # từ đây tham chiếu nằm trong bảng chunks
+            try:
+                _atomic_write(mpath, json.dumps(man).encode(), config.FSYNC)   # điểm commit
+            except BaseException:
+                self._drop(self.index.rollback(name)); raise
+            self._drop(self.index.finish(name, man))
+        if config.FSYNC:
+            _fsync_dirs([mpath.parent])
+        plain = self._plain_path(name)              # bản file thường cũ (nếu có) đã được thay
+        if plain is not None and plain.is_file():
+            plain.unlink(missing_ok=True)
+        return man
+
+    def delete(self, name: str) -> bool:
+        with self._lock:
+            old = self.manifest(name)
+            if old is None:
+                self.index.remove(name)
+                return False
+            self.index.begin(name, None, [], old["chunks"])
+            self._manifest_path(name).unlink(missing_ok=True)
+            self._drop(self.index.finish(name, None))
+        return True
+
+    def _unpend(self, digests):
+        """Ghi thất bại trước điểm commit: nhả tham chiếu tạm, xoá chunk không còn ai dùng."""
+        with self._lock:
+            self._unhold(digests)
+            self._drop([d for d in set(digests) if self.index.refs(d) <= 0])
+
+    def _unhold(self, digests):
+        self._pending.subtract(digests)
+        for d in set(digests):
+            if self._pending[d] <= 0:
+                del self._pending[d]
+
+    def _drop(self, digests):
+        """Xoá chunk đã về 0 tham chiếu trong bảng chunks, trừ khi một lần ghi đang dở vẫn giữ nó (gọi khi giữ _lock)."""
+        for d in digests:
+            if self._pending[d] <= 0:
+                self._unsynced.discard(d)
+                self.cache.drop(d)
+                self.chunk_path(d).unlink(missing_ok=True)
@@ -0,0 +1,324 @@
+# stream_utils.py – Truyền file theo từng DATA-CHUNK có số thứ tự, ACK từng chunk, resume được
+#
+# Mỗi chunk (CHUNK_SIZE byte plaintext, chunk `seq` nằm ở offset seq * CHUNK_SIZE)
+# được mã hoá với iv / nonce riêng nên có thể gửi lại / ghi độc lập với các chunk khác:
+# AEAD (AES-GCM / ChaCha20-Poly1305, thống nhất khi handshake) hoặc AES-CBC + SHA-512 cho client cũ.
+# Luồng có "compress" trong meta đã ký: chunk nén được thì nén trước khi mã hoá, đánh dấu bằng bit cao của seq.
+import hashlib, itertools, json, lzma, os, socket, struct, threading, zlib
+from collections import OrderedDict, deque
+from pathlib import Path
+import config, metrics, net_utils as nu, storage
+from crypto_utils import CryptoUtils
+
+CHUNK_HDR = struct.Struct("!Q16s64s")     # seq | iv | SHA-512(iv + cipher), theo sau là cipher
+AEAD_HDR  = struct.Struct("!Q12s")        # seq | nonce, theo sau là cipher || tag; header là AAD
+COMPRESSED = 1 << 63                      # bit cao của seq trong header: plaintext của chunk đã nén
+SAMPLE     = 4096                         # byte đầu chunk dùng để thử độ nén
+
+def chunk_count(size: int) -> int:
+    return -(-size // config.CHUNK_SIZE)
+
+def file_sha512(path: Path) -> bytes:
+    h, buf = hashlib.sha512(), bytearray(config.CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+    return h.digest()
+
+def file_digests(path: Path) -> tuple:
+    """(SHA-512 cả file, SHA-512 từng chunk ghép liền) trong một lượt đọc – cho truy vấn dedup."""
+    h, parts, buf = hashlib.sha512(), [], bytearray(config.CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+            parts.append(hashlib.sha512(view[:n]).digest())
+    return h.digest(), b"".join(parts)
+
+# ---- Nén từng chunk (zlib / lzma), tự bỏ qua dữ liệu đã nén sẵn ----
+def compressible(data) -> bool:
+    """Thử nén nhanh (mức 1) phần đầu: không giảm được COMPRESS_RATIO thì coi như đã nén sẵn."""
+    sample = data[:SAMPLE]
+    return len(zlib.compress(sample, 1)) < len(sample) * config.COMPRESS_RATIO
+
+def file_compressible(src, samples: int = 4) -> bool:
+    """Lấy mẫu vài chunk rải đều trong file (Path hoặc storage.StoredFile)."""
+    buf = bytearray(config.CHUNK_SIZE)
+    with src.open("rb", buffering=0) as f:
+        size = src.stat().st_size
+        for i in range(samples):
+            f.seek(size * i // samples)
+            if (n := f.readinto(buf)) and compressible(memoryview(buf)[:n]):
+                return True
+    return False
+
+def compress_chunk(codec: str, plain):
+    """Bản nén của chunk, hoặc None nếu không đáng nén (khi đó gửi nguyên)."""
+    if not compressible(plain):
+        return None
+    if codec == "lzma":
+        out = lzma.compress(plain, preset=config.COMPRESS_LEVEL)
+    else:
+        out = zlib.compress(plain, config.COMPRESS_LEVEL)
+    return out if len(out) < len(plain) else None
+
+def decompress_chunk(codec: str, data) -> bytes:
+    """Giải nén, tối đa CHUNK_SIZE byte (chặn dữ liệu nén độc hại); ValueError nếu hỏng."""
+    try:
+        if codec == "zlib":
+            d = zlib.decompressobj()
+            out = d.decompress(data, config.CHUNK_SIZE)
+            ok = d.eof and not d.unconsumed_tail
+        elif codec == "lzma":
+            d = lzma.LZMADecompressor()
+            out = d.decompress(data, config.CHUNK_SIZE)
+            ok = d.eof
+        else:
+            raise ValueError(f"unknown codec {codec!r}")
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"bad compressed chunk: {e}") from None
+    if not ok:
+        raise ValueError("bad compressed chunk")
+    return out
+
+# ---- Danh sách seq <-> các đoạn [start, end) gọn cho JSON ----
+def to_ranges(seqs) -> list:
+    out = []
+    for s in sorted(seqs):
+        if out and out[-1][1] == s:
+            out[-1][1] = s + 1
+        else:
+            out.append([s, s + 1])
+    return out
+
+def from_ranges(ranges, total: int = None) -> set:
+    """
+    Ngược của to_ranges. Đoạn không phải cặp số nguyên bị bỏ qua; có `total` (danh sách từ bên kia gửi tới)
+    thì mỗi đoạn bị chặn về [0, total) và chỉ xét tối đa `total` đoạn -> tập kết quả không bao giờ quá total.
+    """
+    out = set()
+    if not isinstance(ranges, list):
+        return out
+    for r in ranges if total is None else ranges[:total]:
+        if not (isinstance(r, list) and len(r) == 2 and all(type(x) is int for x in r)):
+            continue
+        a, b = r if total is None else (max(r[0], 0), min(r[1], total))
+        out.update(range(a, b))
+    return out
+
+# ---- Đóng gói / mở một chunk ----
+def seal_chunk(key: bytes, seq: int, plain, out: bytearray, aead: str = None, codec: str = None) -> list:
+    if codec and (packed := compress_chunk(codec, plain)) is not None:
+        plain, seq = packed, seq | COMPRESSED
+    if aead:                             # một lượt: mã hoá + tag, seq được xác thực qua AAD
+        hdr = AEAD_HDR.pack(seq, os.urandom(CryptoUtils.AEAD_NONCE))
+        return [hdr, CryptoUtils.aead_encrypt_into(aead, key, hdr[8:], plain, out, hdr)]
+    iv     = os.urandom(16)
+    cipher = CryptoUtils.aes_encrypt_into(key, iv, plain, out)
+    return [CHUNK_HDR.pack(seq, iv, CryptoUtils.sha512(iv, cipher)), cipher]
+
+def open_chunk(key: bytes, data, aead: str = None, codec: str = None) -> tuple:
+    """Trả về (seq, plaintext); ValueError nếu chunk hỏng."""
+    if aead:
+        seq, nonce = AEAD_HDR.unpack_from(data)
+        try:
+            plain = CryptoUtils.aead_decrypt(aead, key, nonce, data[AEAD_HDR.size:], data[:AEAD_HDR.size])
+        except ValueError as e:
+            raise ValueError(f"chunk {seq & ~COMPRESSED}: {e}") from None
+    else:
+        seq, iv, digest = CHUNK_HDR.unpack_from(data)
+        cipher = data[CHUNK_HDR.size:]
+        if CryptoUtils.sha512(iv, cipher) != digest:
+            raise ValueError(f"chunk {seq & ~COMPRESSED}: hash mismatch")
+        plain = CryptoUtils.aes_decrypt(key, iv, cipher)
+    if seq & COMPRESSED:
+        if not codec:
+            raise ValueError(f"chunk {seq & ~COMPRESSED}: compressed but no codec")
+        return seq & ~COMPRESSED, decompress_chunk(codec, plain)
+    return seq, plain
+
+@metrics.timed("stream.read_seal")
+def _read_seal(f, key: bytes, seq: int, out: bytearray, aead: str = None, codec: str = None) -> list:
+    """f: storage.open_view – plaintext của chunk là lát mmap / chunk trong LRU, mã hoá thẳng vào `out`."""
+    return seal_chunk(key, seq, f.view(seq * config.CHUNK_SIZE, config.CHUNK_SIZE), out, aead, codec)
+
+@metrics.timed("stream.open_write")
+def _open_write(part, key: bytes, data, aead: str = None, codec: str = None):
+    """Giải mã (+ giải nén) + ghi một chunk; trả về seq hoặc None nếu chunk hỏng / seq ngoài [0, total)."""
+    try:
+        seq, plain = open_chunk(key, data, aead, codec)
+    except ValueError as e:
+        nu.warn(f"[STREAM] {e}"); return None
+    if not 0 <= seq < part.total:        # seq sai / phát lại: không ghi quá cuối file, không ACK
+        nu.warn(f"[STREAM] chunk {seq} out of range ({part.total} chunk)"); return None
+    part.write(seq, plain)
+    return seq
+
+# ---- Bên gửi (ch: AwaitableChannel hoặc AsyncChannel) ----
+async def send_chunks(ch, src: Path, key: bytes, seqs, codec: str = None, on_chunk=None) -> bool:
+    """
+    Gửi các chunk `seqs` của `src` (Path hoặc storage.StoredFile), tối đa WINDOW chunk chưa được CHUNK-ACK.
+    TCP giữ thứ tự nên ACK của chunk k mà chunk gửi trước k chưa có ACK nghĩa là
+    chunk đó (hoặc ACK của nó) đã bị drop -> chỉ gửi lại đúng những chunk đó.
+    `on_chunk(seq)` được gọi khi chunk seq được ACK. Trả về False nếu một chunk vượt quá CHUNK_RETRY lần gửi.
+    """
+    todo     = deque(seqs)
+    inflight = OrderedDict()             # seq -> None, theo thứ tự gửi
+    tries    = {}
+    out      = bytearray(config.CHUNK_SIZE + 32)
+    with storage.open_view(src) as f:
+        while todo or inflight:
+            while todo and len(inflight) < config.WINDOW:
+                seq = todo.popleft()
+                tries[seq] = tries.get(seq, 0) + 1
+                if tries[seq] > config.CHUNK_RETRY:
+                    nu.error(f"[STREAM] chunk {seq} failed after {config.CHUNK_RETRY} tries")
+                    return False
+                await ch.send_chunk(*await ch.run(_read_seal, f, key, seq, out, ch.aead, codec))
+                inflight[seq] = None
+                metrics.count("chunks_sent")
+            try:
+                msg = await ch.recv()
+            except socket.timeout:
+                nu.warn(f"   timeout; resend {len(inflight)} chunk(s)")
+                metrics.count("chunks_resent", len(inflight))
+                todo.extendleft(reversed(inflight)); inflight.clear()
+                continue
+            if not msg:
+                raise ConnectionError("stream closed early")
+            if msg.get("type") == "NACK":
+                return False
+            if msg.get("type") != "CHUNK-ACK" or msg["seq"] not in inflight:
+                continue                 # ACK trùng của chunk đã gửi lại
+            lost = list(itertools.takewhile(lambda s: s != msg["seq"], inflight))
+            for s in lost + [msg["seq"]]:
+                del inflight[s]
+            if on_chunk:
+                on_chunk(msg["seq"])
+            if lost:
+                nu.warn(f"   resend chunk {', '.join(map(str, lost))}")
+                metrics.count("chunks_resent", len(lost))
+                todo.extendleft(reversed(lost))
+    return True
+
+async def finish_send(ch) -> dict:
+    """Gửi DATA-END tới khi bên nhận trả ACK/NACK (bỏ qua CHUNK-ACK trùng còn sót)."""
+    for attempt in range(1, config.MAX_RETRY + 1):
+        await ch.send({"type": "DATA-END"})
+        try:
+            while (msg := await ch.recv()).get("type") not in ("ACK", "NACK", None):
+                pass
+            return msg
+        except socket.timeout:
+            nu.warn("   timeout; resend DATA-END")
+    return {}
+
+# ---- Bên nhận ----
+class PartialFile:
+    """
+    File đang nhận dở: chunk được ghi đúng vị trí theo seq (pwrite – nhiều kết nối của một upload
+    song song ghi cùng lúc được), danh sách seq đã có được lưu ra file trạng thái JSON
+    (sau khi fsync dữ liệu) để resume sau khi ngắt / khởi động lại.
+    """
+
+    def __init__(self, data_path: Path, state_path: Path, info: dict, have=()):
+        self.data_path  = Path(data_path)
+        self.state_path = Path(state_path)
+        self.info       = info
+        self.total      = chunk_count(info["size"])
+        self.have       = set(have)
+        self._dirty     = 0
+        self._lock      = threading.Lock()
+        self.data_path.parent.mkdir(parents=True, exist_ok=True)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.data_path, "r+b" if self.have else "w+b")
+
+    @classmethod
+    def resume(cls, data_path: Path, state_path: Path, info: dict):
+        """Mở lại trạng thái cũ nếu cùng `info` (tên, kích thước, phiên bản…), không thì làm lại từ đầu."""
+        have = ()
+        try:
+            st = json.loads(Path(state_path).read_text())
+            if st["info"] == info and Path(data_path).exists():
+                have = from_ranges(st["have"])
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls(data_path, state_path, info, have)
+
+    def write(self, seq: int, plain):
+        if seq >= self.total or seq in self.have:
+            return
+        if hasattr(os, "pwrite"):
+            os.pwrite(self._f.fileno(), plain, seq * config.CHUNK_SIZE)
+        else:                            # Windows: không có pwrite
+            with self._lock:
+                self._f.seek(seq * config.CHUNK_SIZE)
+                self._f.write(plain)
+                self._f.flush()
+        with self._lock:
+            self.have.add(seq)
+            self._dirty += 1
+            full = self._dirty >= config.STATE_SYNC
+        if full:
+            self.sync()
+
+    def sync(self):
+        """fsync dữ liệu trước rồi mới ghi trạng thái: state không bao giờ chứa chunk chưa xuống đĩa."""
+        with self._lock:
+            if self._f.closed:
+                return
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            tmp = self.state_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"info": self.info, "have": to_ranges(self.have)}))
+            os.replace(tmp, self.state_path)
+            self._dirty = 0
+
+    def missing(self) -> list:
+        return [s for s in range(self.total) if s not in self.have]
+
+    def complete(self) -> bool:
+        return len(self.have) == self.total
+
+    def close(self):
+        self.sync()
+        self._f.close()
+
+    def commit(self, dst: Path):
+        self._f.truncate(self.info["size"])
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.replace(self.data_path, dst)
+        self.state_path.unlink(missing_ok=True)
+
+    def discard(self):
+        self._f.close()
+        self.data_path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
+
+async def recv_chunks(ch, part: PartialFile, key: bytes, codec: str = None, on_chunk=None) -> dict:
+    """
+    Nhận DATA-CHUNK, ghi vào `part` và ACK từng chunk cho tới gói DATA-END (trả về gói đó);
+    `on_chunk(seq)` được gọi sau mỗi chunk ghi xong.
+    """
+    while True:
+        msg = await ch.recv()
+        t   = msg.get("type")
+        if t == "DATA-CHUNK":
+            seq = await ch.run(_open_write, part, key, msg["data"], ch.aead, codec)
+            if seq is not None:          # chunk hỏng: không ACK -> bên gửi sẽ gửi lại
+                metrics.count("chunks_recv")
+                await ch.send({"type": "CHUNK-ACK", "seq": seq})
+                if on_chunk:
+                    on_chunk(seq)
+            else:
+                metrics.count("chunks_bad")
+        elif t == "DATA-END":
+            return msg
+        elif not msg:
+            raise ConnectionError("stream closed early")
+
+def part_path(dst: Path) -> Path:
+    return dst.with_name("." + dst.name + ".part")
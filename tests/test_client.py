@@ -0,0 +1,43 @@
+# test_client.py – Client._many: huỷ một thao tác trong lô không làm treo các thao tác còn lại
+import sys, threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import client
+
+@pytest.fixture
+def c():
+    with client.Client(connections=0, workers=2) as c:
+        yield c
+
+def test_many_cancel_inner(c):
+    """Future bên trong bị huỷ -> Future của lô báo huỷ, các item sau vẫn chạy."""
+    pool = ThreadPoolExecutor(1)
+
+    def submit(item, cb):
+        if item == 1:
+            f = Future()
+            f.cancel()
+            return f
+        return pool.submit(lambda: item * 10)
+
+    out = c._many(submit, [0, 1, 2, 3, 4], 1, None)
+    assert [out[i].result(timeout=5) for i in (0, 2, 3, 4)] == [0, 20, 30, 40]
+    with pytest.raises(CancelledError):
+        out[1].result(timeout=5)
+    pool.shutdown()
+
+def test_many_cancel_outer(c):
+    """Người gọi huỷ Future của một item -> thao tác kế vẫn được mở."""
+    gate, pool = threading.Event(), ThreadPoolExecutor(1)
+
+    def submit(item, cb):
+        return pool.submit(lambda: (gate.wait(5) if item == 0 else None, item)[1])
+
+    out = c._many(submit, [0, 1, 2], 1, None)
+    assert out[0].cancel()
+    gate.set()
+    assert [out[i].result(timeout=5) for i in (1, 2)] == [1, 2]
+    pool.shutdown()
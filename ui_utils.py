@@ -17,15 +17,20 @@ def print_requirement_table():
 
 # ----- Step tracker -----
 class StepTracker:
-    def __init__(self, total: int):
+    def __init__(self, total: int, quiet: bool = False):
         self.total = total
         self.idx   = 0
+        self.quiet = quiet        # chế độ lô: không in từng bước, không delay
 
     def next(self, desc: str):
         self.idx += 1
+        if self.quiet:
+            return
         info(f"[STEP {self.idx}/{self.total}] {desc} …")
-        time.sleep(0.3)           # delay nhẹ để dễ đọc
+        time.sleep(config.STEP_DELAY)   # delay nhẹ để dễ đọc
 
     def done(self, action: str):
+        if self.quiet:
+            return
         ts = datetime.datetime.now().strftime("%H:%M:%S")
         info(f"[SUCCESS] {action} completed at {ts}\n")